@@ -1,26 +1,46 @@
-import csv
-import io
-from datetime import datetime
 import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import redis
 
 from flask_apidoc import ApiDoc
 from flask_api import FlaskAPI
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from flask import request, jsonify, abort
+from flask import request, jsonify, abort, stream_with_context
 
 
 # local import
 from instance.config import app_config
+from app.replicas import RoutingSQLAlchemy
 
-# initialize sql-alchemy
-db = SQLAlchemy()
+# initialize sql-alchemy, reads of GET requests may go to a replica
+db = RoutingSQLAlchemy()
 
 
 def create_app(config_name):
-    from app.models import Trainer, Pokemon
+    from app.models import Trainer, Pokemon, PokemonRollup, TeamSize
+    from app.ingest import REDIS_DB, UploadError, ingest_file
+    from app.jobs import Job, run_job
+    from app.chunks import ChunkedUpload
+    from app.pagination import paginate
+    from app.cache import Cache, LocalCache
+    from app.compression import Compression
+    from app.replicas import PRIMARY_COOKIE, ReplicaPool
+    from app.conditional import conditional
+    from app.validation import parse_date, parse_integer
+    from app.export import FORMATS, iter_export
+    from app.search import FIELDS, MemorySearch, TrigramSearch, has_trigrams
+    from app.serializers import (
+        POKEMON,
+        ROLLUP,
+        TRAINER,
+        TRAINER_DETAIL,
+        TRAINER_WITH_POKEMONS,
+        json_response,
+    )
 
     app = FlaskAPI(__name__, instance_relative_config=True)
     app.config.from_object(app_config[config_name])
@@ -29,20 +49,234 @@ def create_app(config_name):
     doc = ApiDoc(app=app, folder_path="/home/indra/pokemon/docs")
     db.init_app(app)
     migrate = Migrate(app, db)
+    jobs = ThreadPoolExecutor(
+        max_workers=app.config["UPLOAD_JOB_WORKERS"], thread_name_prefix="upload"
+    )
+    local_cache = None
+    if app.config["CACHE_LOCAL_MAX_BYTES"]:
+        local_cache = LocalCache(
+            app.config["CACHE_LOCAL_MAX_BYTES"], ttl=app.config["CACHE_LOCAL_TTL"]
+        )
+    cache = Cache(
+        redis.StrictRedis.from_url(
+            app.config["CACHE_REDIS_URL"], encoding="utf-8", decode_responses=True
+        ),
+        ttl=app.config["CACHE_TTL"],
+        local=local_cache,
+    )
+    # kept up to date from the cache invalidations of every worker
+    memory_search = MemorySearch(app.config["SEARCH_MIN_SIMILARITY"])
+    if app.config["SEARCH_BACKEND"] != "trigram":
+        cache.subscribe(memory_search)
+    cache.listen()
+    app.extensions["cache"] = cache
+    compressed = None
+    if app.config["COMPRESSION_CACHE_MAX_BYTES"]:
+        compressed = LocalCache(
+            app.config["COMPRESSION_CACHE_MAX_BYTES"], ttl=app.config["CACHE_TTL"]
+        )
+    compression = Compression(
+        app.config["COMPRESSION_ENCODINGS"],
+        {
+            "gzip": app.config["COMPRESSION_GZIP_LEVEL"],
+            "br": app.config["COMPRESSION_BROTLI_LEVEL"],
+        },
+        min_size=app.config["COMPRESSION_MIN_SIZE"],
+        cache=compressed,
+    )
+    app.after_request(compression)
+    app.extensions["compression"] = compression
+    app.extensions["replicas"] = ReplicaPool.from_urls(
+        app.config["SQLALCHEMY_REPLICA_URIS"],
+        check_interval=app.config["REPLICA_CHECK_INTERVAL"],
+        max_lag=app.config["REPLICA_MAX_LAG"],
+    )
+    app.extensions["replicas"].start()
+
+    @app.before_request
+    def route_reads():
+        """Send the reads of GET requests to a replica, unless the client just wrote"""
+        if request.method not in ("GET", "HEAD"):
+            return
 
-    def validate_date(date_text):
-        """Helper function to validate date format"""
         try:
-            datetime.strptime(date_text, "%d-%m-%Y")
-        except:
-            return False
+            primary_until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        if primary_until > time.time():
+            return
+
+        replica = app.extensions["replicas"].pick()
+        if replica is not None:
+            db.session().info["replica"] = replica
+
+    @app.after_request
+    def read_your_writes(response):
+        """Keep the reads of a client that wrote on the primary for a while"""
+        seconds = app.config["REPLICA_STICKY_SECONDS"]
+        if (
+            request.method not in ("GET", "HEAD", "OPTIONS")
+            and response.status_code < 400
+            and app.extensions["replicas"].engines
+            and seconds
+        ):
+            response.set_cookie(
+                PRIMARY_COOKIE, str(time.time() + seconds), max_age=seconds
+            )
+
+        return response
+
+    def r_jobs():
+        """Helper function to connect to the redis db holding upload jobs"""
+        return redis.StrictRedis(db=0, encoding="utf-8", decode_responses=True)
+
+    def is_true(value):
+        """Helper function to parse boolean request parameters"""
+        return str(value).lower() in ("1", "true", "yes")
+
+    def read_ids():
+        """Helper function to read the ids of a batch lookup
+
+        ids are given as a comma separated ids parameter, or as a list in the
+        ids field of a JSON body. Duplicates are dropped. Raises ValueError.
+        """
+        if request.method == "POST":
+            body = request.get_json(silent=True)
+            ids = body.get("ids") if isinstance(body, dict) else None
+            if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+                raise ValueError("ids must be a list of strings")
+        else:
+            ids = request.args.get("ids", default="", type=str).split(",")
+
+        ids = list(dict.fromkeys(id for id in ids if id))
+        if not ids:
+            raise ValueError("No ids given")
+        if len(ids) > app.config["BATCH_MAX_IDS"]:
+            raise ValueError(f"At most {app.config['BATCH_MAX_IDS']} ids per request")
+
+        return ids
+
+    def read_fields(serializer):
+        """Helper function to read the fields parameter of a read request
+
+        fields is a comma separated list of the fields of serializer to
+        return. Returns None when it is not given. Raises ValueError.
+        """
+        fields = request.args.get("fields", default=None, type=str)
+        if fields is None:
+            return None
+
+        names = list(dict.fromkeys(name for name in fields.split(",") if name))
+        unknown = [name for name in names if name not in serializer.names]
+        if unknown:
+            raise ValueError(f"Unknown fields {', '.join(unknown)}")
+        if not names:
+            raise ValueError("No fields given")
+
+        return names
+
+    def read_filters():
+        """Helper function to read the filters of the pokemon list
+
+        Levels are integers and ownership dates DD-MM-YYYY dates, as in
+        uploads. Returns the criteria of Pokemon.filters(). Raises ValueError.
+        """
+        filters = {}
+        for name, parse in (
+            ("species", str),
+            ("levelMin", parse_integer),
+            ("levelMax", parse_integer),
+            ("owner", str),
+            ("ownedFrom", parse_date),
+            ("ownedTo", parse_date),
+        ):
+            value = request.args.get(name, default=None, type=str)
+            if value is None:
+                continue
+
+            filters[name] = parse(value)
+            if filters[name] is None:
+                raise ValueError(f"Invalid {name} {value}")
+
+        return Pokemon.filters(**filters)
+
+    def project(value, names):
+        """Helper function to keep the fields names of a serialized value"""
+        if names is None:
+            return value
+
+        return {name: value[name] for name in names}
+
+    def invalid_fields(e):
+        """Helper function to answer a request with an invalid fields parameter"""
+        response = jsonify({"success": False, "error": str(e)})
+        response.status_code = 400
+
+        return response
 
-        return True
+    def search_backend():
+        """Helper function to get the search backend, picked on first use"""
+        if "search" not in app.extensions:
+            backend = app.config["SEARCH_BACKEND"]
+            if backend == "trigram" or (backend == "auto" and has_trigrams()):
+                app.extensions["search"] = TrigramSearch(
+                    app.config["SEARCH_MIN_SIMILARITY"]
+                )
+            else:
+                app.extensions["search"] = memory_search
+
+        return app.extensions["search"]
+
+    def lookup_many(namespace, ids, load, build, depends_on):
+        """Helper function to get many cached objects, loading the others at once
 
-    def validate_input_format(inputList, dataType):
-        """Helper function to validate input format"""
+        load(ids) fetches the objects missing from the cache in one query,
+        build(obj) makes their cached value and depends_on(obj) lists the
+        cache entries they depend on. Returns {id: value} of the ids found.
+        """
+        found = cache.get_many(namespace, ids)
+        missing = [id for id in ids if id not in found]
+        if missing:
+            entries = []
+            for obj in load(missing):
+                found[obj.id] = build(obj)
+                entries.append((obj.id, found[obj.id], depends_on(obj)))
+            cache.set_many(namespace, entries)
+
+        return found
+
+    def run_upload(dataType, f, workers):
+        """Helper function to ingest an uploaded file and build the response"""
+        try:
+            summary = ingest_file(dataType, f, workers)
+        except UploadError as e:
+            response = jsonify(
+                {
+                    "success": False,
+                    "error": e.message,
+                    "errors": e.errors,
+                }
+            )
+            response.status_code = 400
 
-        return all([isinstance(i, dataType) for i in inputList])
+            return response
+
+        response = jsonify({"success": True, **summary._asdict()})
+        # nothing is created when the same file was already loaded
+        response.status_code = 200 if summary.duplicate else 201
+
+        return response
+
+    def submit_upload(dataType, path, workers, chunks=None):
+        """Helper function to ingest a file saved at path in the background"""
+        job = Job(r_jobs(), ttl=app.config["UPLOAD_JOB_TTL"])
+        job.update(status="queued", type=dataType, created=time.time())
+        jobs.submit(run_job, app, job, dataType, path, workers, chunks)
+
+        response = jsonify({"success": True, "job": job.id})
+        response.status_code = 202
+
+        return response
 
     @app.route("/upload/", methods=["POST"])
     def seeding():
@@ -54,201 +288,513 @@ def create_app(config_name):
 
         @apiParam {String}      type        Type of data uploaded
         @apiParam {Object}      data        UTF8 encoded CSV file
+        @apiParam {Number}      [workers=1] Number of processes used to parse the file
+        @apiParam {Boolean}     [async=false] Run the upload as a background job
+
+        @apiSuccess (202 Accepted) {String}   job         Id of the background job, see /upload/status/:job
 
         @apiSuccess (201 Created) {String}    success     True of False
         @apiSuccess (201 Created) {String}    error       Error message
+        @apiSuccess (201 Created) {Number}    rows_committed  Rows new or changed since they were last uploaded
+        @apiSuccess (201 Created) {Number}    rows_unchanged  Rows skipped as already up to date
+        @apiSuccess (200 OK) {Boolean}        duplicate   True if the same file was already loaded, nothing is written
+
+        @apiError (400 Bad Request) {Boolean}   success     False
+        @apiError (400 Bad Request) {String}    error       Error message
+        @apiError (400 Bad Request) {Object[]}  errors      Invalid rows (row, column, error)
 
         @apiSuccessExample {json} Success-Response:
             HTTP/1.1 201 Created
             {
-                "success": True
+                "success": True,
+                "rows_committed": 2,
+                "rows_unchanged": 998,
+                "duplicate": False
+            }
+
+        @apiErrorExample {json} Error-Response:
+            HTTP/1.1 400 Bad Request
+            {
+                "success": False,
+                "error": "Input data not valid",
+                "errors": [{"row": 2,
+                            "column": "dateOfBirth",
+                            "error": "Input date format incorrect, should be DD-MM-YYYY"}]
             }
         """
         if request.method == "POST":
             dataType = request.data.get("type", "")
-            f = request.files["data"]
-            stream = io.StringIO(f.stream.read().decode("utf-8"), newline=None)
-            # print(f"Type: {type}, Filename: {stream.read()}")
-
-            if dataType == "trainer":
-                message = "Input data not valid"  # base error message
-                success = True
-                r = redis.StrictRedis(db=0, encoding="utf-8", decode_responses=True)
-
-                reader = csv.reader(stream)
-                _ = next(reader)
-
-                for id, firstName, lastName, dateOfBirth in reader:
-                    # print(id, firstName, lastName, dateOfBirth)
-
-                    if None in (id, firstName, lastName, dateOfBirth):
-                        # NOTE: handle incomplete data (Current: Method 2)
-                        # 1. Skip this row
-                        # 2. Dont accept entire csv file
-                        success = False
-                        message = "Missing values in input data"
-                        break
-
-                    if not validate_input_format([id, firstName, lastName], str):
-                        success = False
-                        message = "Input data format not correct"
-                        break
-
-                    if not validate_date(dateOfBirth):
-                        success = False
-                        message = "Input date format incorrect, should be DD-MM-YYYY"
-                        break
-
-                    if not success:
-                        response = jsonify(
-                            {
-                                "success": success,
-                                "error": message,
-                            }
-                        )
-                        response.status_code = 400
-
-                        return response
-
-                    # TODO: implement redis cache to preload csv before saving whole item
-                    r.hset(
-                        id,
-                        mapping={
-                            "firstName": firstName,
-                            "lastName": lastName,
-                            "dateOfBirth": dateOfBirth,
-                        },
-                    )
-
-                # retrieve all keys from redis cache and update database
-                keys = r.keys()
-
-                for key in keys:
-                    v = r.hgetall(key)
-                    trainer = Trainer(
-                        id=key,
-                        firstName=v["firstName"],
-                        lastName=v["lastName"],
-                        dateOfBirth=v["dateOfBirth"],
-                    )
-
-                    try:
-                        trainer.save()
-                    except:
-                        message = "Unable to save data"
-
-                        success = False
-
-                        response = jsonify(
-                            {
-                                "success": success,
-                                "error": message,
-                            }
-                        )
-                        response.status_code = 400
-
-                        return response
-
-                response = jsonify({"success": success})
-                response.status_code = 201
+            f = request.files.get("data")
+
+            if dataType not in REDIS_DB or f is None:
+                response = jsonify({"success": False, "error": "No valid payload"})
+                response.status_code = 400
 
                 return response
 
-            elif dataType == "pokemon":
-                message = "Input data not valid"  # base error message
-                success = True
-                r = redis.StrictRedis(db=1, encoding="utf-8", decode_responses=True)
-
-                reader = csv.reader(stream)
-                _ = next(reader)
-
-                for id, nickname, species, level, owner, dateOfOwnership in reader:
-                    # print(id, nickname, species, level, owner, dateOfOwnership)
-
-                    if None in (id, nickname, species, level, owner, dateOfOwnership):
-                        # NOTE: handle incomplete data (Current: Method 2)
-                        # 1. Skip this row
-                        # 2. Dont accept entire csv file
-                        success = False
-                        message = "Missing values in input data"
-                        break
-
-                    if not validate_input_format([id, nickname, species, owner], str):
-                        success = False
-                        message = "Input data format not correct"
-                        break
-
-                    if not validate_date(dateOfOwnership):
-                        success = False
-                        message = "Input date format incorrect, should be DD-MM-YYYY"
-                        break
-
-                    if not success:
-                        response = jsonify(
-                            {
-                                "success": success,
-                                "error": message,
-                            }
-                        )
-                        response.status_code = 400
-
-                        return response
-
-                    r.hset(
-                        id,
-                        mapping={
-                            "nickname": nickname,
-                            "species": species,
-                            "level": level,
-                            "owner": owner,
-                            "dateOfOwnership": dateOfOwnership,
-                        },
-                    )
-
-                # retrieve all keys from redis cache and update database
-                keys = r.keys()
-
-                for key in keys:
-                    v = r.hgetall(key)
-                    pokemon = Pokemon(
-                        id=key,
-                        nickname=v["nickname"],
-                        species=v["species"],
-                        level=v["level"],
-                        owner=v["owner"],
-                        dateOfOwnership=v["dateOfOwnership"],
-                        history=[v["owner"]],
-                    )
-
-                    try:
-                        pokemon.save()
-                    except:
-                        message = "Unable to save data"
-
-                        success = False
-
-                        response = jsonify(
-                            {
-                                "success": success,
-                                "error": message,
-                            }
-                        )
-                        response.status_code = 400
-
-                        return response
-
-                response = jsonify({"success": success})
-                response.status_code = 201
+            workers = min(
+                request.data.get(
+                    "workers", default=app.config["UPLOAD_WORKERS"], type=int
+                ),
+                app.config["UPLOAD_MAX_WORKERS"],
+            )
+            run_async = request.data.get(
+                "async", default=app.config["UPLOAD_ASYNC"], type=is_true
+            )
+
+            if run_async:
+                # the request stream is gone once we return, keep a copy on disk
+                with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as tmp:
+                    f.save(tmp)
 
-                return response
+                return submit_upload(dataType, tmp.name, workers)
 
-        else:
+            return run_upload(dataType, f.stream, workers)
+
+    @app.route("/upload/chunked/", methods=["POST"])
+    def create_chunked_upload():
+        """
+        @api {post} /upload/chunked Starts a chunked upload
+        @apiVersion 1.0.0
+        @apiName CreateChunkedUpload
+        @apiGroup Trainer
+
+        @apiParam {String}      type        Type of data uploaded
+
+        @apiSuccess (201 Created) {Boolean}   success     True of False
+        @apiSuccess (201 Created) {String}    upload      Id of the chunked upload
+
+        @apiSuccessExample {json} Success-Response:
+            HTTP/1.1 201 Created
+            {
+                "success": True,
+                "upload": "9b2f6a0e5c3d4b1a8e7f6d5c4b3a2910"
+            }
+        """
+        dataType = request.args.get("type", default=None, type=str)
+
+        if dataType not in REDIS_DB:
             response = jsonify({"success": False, "error": "No valid payload"})
             response.status_code = 400
 
             return response
 
+        # abandoned uploads go as new ones come
+        ChunkedUpload.expire(
+            app.config["UPLOAD_CHUNK_DIR"], app.config["UPLOAD_CHUNK_TTL"]
+        )
+        upload = ChunkedUpload.create(app.config["UPLOAD_CHUNK_DIR"], dataType)
+
+        response = jsonify({"success": True, "upload": upload.id})
+        response.status_code = 201
+
+        return response
+
+    @app.route("/upload/chunked/<upload_id>", methods=["GET"])
+    def get_chunked_upload(upload_id):
+        """
+        @api {get} /upload/chunked/:upload Gets chunks received for an upload
+        @apiVersion 1.0.0
+        @apiName GetChunkedUpload
+        @apiGroup Trainer
+
+        @apiSuccess (200 OK) {String}    upload      Id of the chunked upload
+        @apiSuccess (200 OK) {String}    type        Type of data uploaded
+        @apiSuccess (200 OK) {Number[]}  chunks      Indexes of the chunks received
+
+        @apiSuccessExample {json} Success-Response:
+            HTTP/1.1 200 OK
+            {
+                "upload": "9b2f6a0e5c3d4b1a8e7f6d5c4b3a2910",
+                "type": "pokemon",
+                "chunks": [0, 1, 2]
+            }
+        """
+        upload = ChunkedUpload.get(app.config["UPLOAD_CHUNK_DIR"], upload_id)
+
+        if upload is None:
+            response = jsonify({"success": False, "error": "Upload not found"})
+            response.status_code = 404
+
+            return response
+
+        response = jsonify(
+            {"upload": upload.id, "type": upload.type, "chunks": upload.received()}
+        )
+        response.status_code = 200
+
+        return response
+
+    @app.route("/upload/chunked/<upload_id>/<int:index>", methods=["PUT"])
+    def put_chunk(upload_id, index):
+        """
+        @api {put} /upload/chunked/:upload/:index Uploads a chunk
+        @apiVersion 1.0.0
+        @apiName PutChunk
+        @apiGroup Trainer
+
+        @apiParam {Number}      index       0-based index of the chunk, below UPLOAD_MAX_CHUNKS
+        @apiParam {Object}      body        Raw bytes of the chunk
+
+        @apiSuccess (201 Created) {Boolean}   success     True of False
+        @apiSuccess (200 OK) {Boolean}        skipped     True if the chunk was already received
+
+        @apiSuccessExample {json} Success-Response:
+            HTTP/1.1 201 Created
+            {
+                "success": True,
+                "chunk": 0
+            }
+        """
+        upload = ChunkedUpload.get(app.config["UPLOAD_CHUNK_DIR"], upload_id)
+
+        if upload is None:
+            response = jsonify({"success": False, "error": "Upload not found"})
+            response.status_code = 404
+
+            return response
+
+        if index >= app.config["UPLOAD_MAX_CHUNKS"]:
+            response = jsonify({"success": False, "error": "Too many chunks"})
+            response.status_code = 400
+
+            return response
+
+        if not upload.put(index, request.stream):
+            response = jsonify({"success": True, "chunk": index, "skipped": True})
+            response.status_code = 200
+
+            return response
+
+        response = jsonify({"success": True, "chunk": index})
+        response.status_code = 201
+
+        return response
+
+    @app.route("/upload/chunked/<upload_id>/finalize", methods=["POST"])
+    def finalize_chunked_upload(upload_id):
+        """
+        @api {post} /upload/chunked/:upload/finalize Finalizes a chunked upload
+        @apiVersion 1.0.0
+        @apiName FinalizeChunkedUpload
+        @apiGroup Trainer
+
+        @apiParam {Number}      [chunks]        Total number of chunks, at most UPLOAD_MAX_CHUNKS
+        @apiParam {Number}      [workers=1]     Number of processes used to parse the file
+        @apiParam {Boolean}     [async=false]   Run the upload as a background job
+
+        @apiSuccess (201 Created) {Boolean}   success     True of False
+        @apiSuccess (202 Accepted) {String}   job         Id of the background job, see /upload/status/:job
+        @apiError (400 Bad Request) {Number[]}  missing   Indexes of the chunks not received yet
+        @apiError (400 Bad Request) {Number[]}  extra     Indexes of the chunks received past chunks
+
+        @apiSuccessExample {json} Success-Response:
+            HTTP/1.1 201 Created
+            {
+                "success": True
+            }
+        """
+        upload = ChunkedUpload.get(app.config["UPLOAD_CHUNK_DIR"], upload_id)
+
+        if upload is None:
+            response = jsonify({"success": False, "error": "Upload not found"})
+            response.status_code = 404
+
+            return response
+
+        total = request.args.get("chunks", default=None, type=int)
+
+        if total is not None and not 0 < total <= app.config["UPLOAD_MAX_CHUNKS"]:
+            response = jsonify({"success": False, "error": "Too many chunks"})
+            response.status_code = 400
+
+            return response
+
+        missing = upload.missing(total)
+
+        if missing or not upload.received():
+            response = jsonify(
+                {"success": False, "error": "Missing chunks", "missing": missing}
+            )
+            response.status_code = 400
+
+            return response
+
+        extra = upload.extra(total) if total is not None else []
+
+        if extra:
+            response = jsonify(
+                {"success": False, "error": "Unexpected chunks", "extra": extra}
+            )
+            response.status_code = 400
+
+            return response
+
+        dataType = upload.type
+        workers = min(
+            request.args.get("workers", default=app.config["UPLOAD_WORKERS"], type=int),
+            app.config["UPLOAD_MAX_WORKERS"],
+        )
+        run_async = request.args.get(
+            "async", default=app.config["UPLOAD_ASYNC"], type=is_true
+        )
+
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        # chunks are kept until the file is loaded, so a failed load can be
+        # finalized again without sending them again
+        upload.touch()
+        upload.assemble(path, total or len(upload.received()))
+
+        if run_async:
+            return submit_upload(dataType, path, workers, upload)
+
+        try:
+            with open(path, "rb") as f:
+                response = run_upload(dataType, f, workers)
+        finally:
+            os.remove(path)
+
+        if response.status_code < 300:
+            upload.remove()
+
+        return response
+
+    @app.route("/upload/status/<job_id>", methods=["GET"])
+    def upload_status(job_id):
+        """
+        @api {get} /upload/status/:job Gets status of an upload job
+        @apiVersion 1.0.0
+        @apiName UploadStatus
+        @apiGroup Trainer
+
+        @apiParam {String}      job         Id of the upload job
+
+        @apiSuccess (200 OK) {String}    status              queued, running, loading, done or failed
+        @apiSuccess (200 OK) {Number}    rows_validated      Rows validated and staged so far
+        @apiSuccess (200 OK) {Number}    rows_committed      Rows committed to the database
+        @apiSuccess (200 OK) {Number}    rows_per_second     Throughput of the job
+        @apiSuccess (200 OK) {String}    error               Error message if the job failed
+        @apiSuccess (200 OK) {Object[]}  errors              Invalid rows if the job failed
+
+        @apiSuccessExample Success-Response:
+            HTTP/1.1 {json} 200 OK
+            {
+                "id": "4f0c3f6c1d7a4e0b9a52d8a9c1f1e2b3",
+                "type": "pokemon",
+                "status": "done",
+                "success": True,
+                "rows_validated": 1000000,
+                "rows_committed": 1000000,
+                "rows_per_second": 52341.7
+            }
+        """
+        status = Job(r_jobs(), job_id).status()
+
+        if status is None:
+            response = jsonify({"success": False, "error": "Upload job not found"})
+            response.status_code = 404
+
+            return response
+
+        response = json_response(status)
+        response.status_code = 200
+
+        return response
+
+    @app.route("/search/", methods=["GET"])
+    @conditional("trainer", "pokemon")
+    def search():
+        """
+        @api {get} /search Searches trainers and pokemons by name
+        @apiVersion 1.0.0
+        @apiName Search
+        @apiGroup Search
+
+        @apiParam {String}      q                 Start or approximate spelling of a name
+        @apiParam {String}      [type]            trainer or pokemon, both by default
+        @apiParam {String}      [page=1]          Page number
+        @apiParam {String}      [limit=5]         Results limit per page
+
+        @apiSuccess (200 OK) {Object}    results         Best matches first, with the field matched
+        @apiSuccess (200 OK) {String}    page            Page Number
+        @apiSuccess (200 OK) {String}    next            Next page number, null on the last page
+
+        @apiSuccessExample Success-Response:
+            HTTP/1.1 {json} 200 OK
+            {
+                "page": 1,
+                "next": 2,
+                "results": [{"type": "pokemon",
+                            "id": "pika1",
+                            "field": "nickname",
+                            "value": "pikapika",
+                            "score": 1.5}]
+            }
+        """
+        q = request.args.get("q", default="", type=str)
+        dataType = request.args.get("type", default=None, type=str)
+        if not q.strip() or dataType not in (None, *FIELDS):
+            response = jsonify({"success": False, "error": "Invalid payload"})
+            response.status_code = 400
+
+            return response
+
+        limit = min(
+            max(request.args.get("limit", default=5, type=int), 1),
+            app.config["PAGE_MAX_LIMIT"],
+        )
+        page = max(request.args.get("page", default=1, type=int), 1)
+        types = (dataType,) if dataType else tuple(FIELDS)
+
+        # one extra result tells whether there is a next page
+        results = search_backend().search(q, types, limit + 1, (page - 1) * limit)
+
+        response = json_response(
+            {
+                "results": [
+                    {**result._asdict(), "score": round(result.score, 4)}
+                    for result in results[:limit]
+                ],
+                "page": page,
+                "next": page + 1 if len(results) > limit else None,
+            }
+        )
+        response.status_code = 200
+
+        return response
+
+    @app.route("/export/", methods=["GET"])
+    def export():
+        """
+        @api {get} /export Exports all trainers or pokemons
+        @apiVersion 1.0.0
+        @apiName Export
+        @apiGroup Export
+
+        @apiParam {String}      type            Type of data (trainer or pokemon)
+        @apiParam {String}      [format=csv]    csv, with the columns /upload accepts, or ndjson
+
+        @apiSuccessExample Success-Response:
+            HTTP/1.1 200 OK
+            Content-Type: text/csv
+            Transfer-Encoding: chunked
+
+            id,firstName,lastName,dateOfBirth
+            trainer1,Ash,Ketchum,22-05-1987
+        """
+        dataType = request.args.get("type", default=None, type=str)
+        format = request.args.get("format", default="csv", type=str)
+        if dataType not in ("trainer", "pokemon") or format not in FORMATS:
+            response = jsonify({"success": False, "error": "Invalid payload"})
+            response.status_code = 400
+
+            return response
+
+        rows = iter_export(dataType, format, app.config["EXPORT_BATCH_SIZE"])
+        # sent as it is read, without a Content-Length
+        response = app.response_class(
+            stream_with_context(rows), mimetype=FORMATS[format]
+        )
+        response.headers[
+            "Content-Disposition"
+        ] = f"attachment; filename={dataType}.{format}"
+        response.status_code = 200
+
+        return response
+
+    @app.route("/cache/stats", methods=["GET"])
+    def cache_stats():
+        """
+        @api {get} /cache/stats Gets hit and miss counts of the cache
+        @apiVersion 1.0.0
+        @apiName CacheStats
+        @apiGroup Cache
+
+        @apiSuccess (200 OK) {Object}    trainer     Trainer lookups (hits, misses, local_hits, hit_rate)
+        @apiSuccess (200 OK) {Object}    pokemon     Pokemon lookups (hits, misses, local_hits, hit_rate)
+
+        @apiSuccessExample Success-Response:
+            HTTP/1.1 {json} 200 OK
+            {
+                "trainer": {"hits": 150, "misses": 50, "local_hits": 800, "hit_rate": 0.95},
+                "pokemon": {"hits": 12, "misses": 4, "local_hits": 0, "hit_rate": 0.75}
+            }
+        """
+        response = json_response(cache.stats())
+        response.status_code = 200
+
+        return response
+
+    @app.route("/stats/", methods=["GET"])
+    @conditional("trainer", "pokemon")
+    def get_stats():
+        """
+        @api {get} /stats Gets pokemon counts and levels
+        @apiVersion 1.0.0
+        @apiName GetStats
+        @apiGroup Stats
+
+        @apiParam {String}      [trainerId]     Id of trainer, for its team only
+
+        @apiSuccess (200 OK) {Number}    trainers        Number of trainers
+        @apiSuccess (200 OK) {Number}    pokemons        Number of pokemons
+        @apiSuccess (200 OK) {Number}    averageLevel    Average level, null without levels
+        @apiSuccess (200 OK) {Number}    maxLevel        Highest level, null without levels
+        @apiSuccess (200 OK) {Object}    species         Counts and levels per species, most common first
+        @apiSuccess (200 OK) {Object}    teamSizes       Number of trainers per number of pokemons owned
+
+        @apiSuccessExample Success-Response:
+            HTTP/1.1 {json} 200 OK
+            {
+                "trainers": 2,
+                "pokemons": 3,
+                "averageLevel": 12.33,
+                "maxLevel": 20,
+                "species": [{"species": "pikachu",
+                            "pokemons": 2,
+                            "averageLevel": 15.0,
+                            "maxLevel": 20}],
+                "teamSizes": [{"size": 0, "trainers": 1},
+                            {"size": 3, "trainers": 1}]
+            }
+        """
+        # read from the rollups the triggers keep, never from the tables
+        trainer_id = request.args.get("trainerId", default=None, type=str)
+        if trainer_id is not None:
+            rollup = PokemonRollup.get("owner", trainer_id)
+            # trainers get a rollup with their first pokemon
+            if not rollup.pokemons and Trainer.get_trainer(trainer_id) is None:
+                response = jsonify("No trainer found")
+                response.status_code = 404
+
+                return response
+
+            response = json_response(ROLLUP(rollup))
+            response.status_code = 200
+
+            return response
+
+        sizes = TeamSize.get_all()
+        response = json_response(
+            {
+                "trainers": sum(size.trainers for size in sizes),
+                **ROLLUP(PokemonRollup.get("all")),
+                "species": [
+                    {"species": rollup.key, **ROLLUP(rollup)}
+                    for rollup in PokemonRollup.get_species()
+                ],
+                "teamSizes": [
+                    {"size": size.size, "trainers": size.trainers} for size in sizes
+                ],
+            }
+        )
+        response.status_code = 200
+
+        return response
+
     @app.route("/trainer/", methods=["GET", "PUT", "DELETE"])
+    @conditional("trainer", "pokemon")
     def get_trainers():
         """
         @api {get} /trainer Gets trainer
@@ -257,6 +803,7 @@ def create_app(config_name):
         @apiGroup Trainer
 
         @apiParam {String}      trainerId       Id of trainer
+        @apiParam {String}      [fields]        Comma separated fields to return, all by default
 
         @apiSuccess (200 OK) {String}    firstName       True of False
         @apiSuccess (200 OK) {String}    error           Error message
@@ -282,16 +829,21 @@ def create_app(config_name):
 
         @apiParam {String}      [page=1]          Page number
         @apiParam {String}      [limit=5]         Results limit per page
+        @apiParam {String}      [cursor]          Cursor of the page to get, replaces page
+        @apiParam {String}      [embed]           "pokemons" to list the pokemons of each trainer
+        @apiParam {String}      [fields]          Comma separated fields of trainers to return, all by default
 
         @apiSuccess (200 OK) {Object}    trainers        Trainer object
-        @apiSuccess (200 OK) {String}    page            Page Number
-        @apiSuccess (200 OK) {String}    total_page      Total Page Number
+        @apiSuccess (200 OK) {String}    page            Page Number, without cursor
+        @apiSuccess (200 OK) {String}    total_page      Total Page Number, without cursor
+        @apiSuccess (200 OK) {String}    next            Cursor of the next page, null on the last page
 
         @apiSuccessExample Success-Response:
             HTTP/1.1 {json} 200 OK
             {
                 "page": "1",
                 "total_page": "4",
+                "next": "dHJhaW5lcjE0",
                 "trainers": [{"id": "pika1",
                             "firstName": "pikapika",
                             "lastName": "pikachu",
@@ -333,11 +885,22 @@ def create_app(config_name):
         trainer_id = request.args.get("trainerId", default=None, type=str)
         if request.method == "GET":
             if trainer_id is not None:
-                pokemon_objs, trainer_obj = Pokemon.get_trainer(
-                    trainer_id
-                ), Trainer.get_trainer(trainer_id)
+                try:
+                    names = read_fields(TRAINER_DETAIL)
+                except ValueError as e:
+                    return invalid_fields(e)
 
-                pokemons = []
+                cached = cache.get("trainer", trainer_id)
+                if cached is not None:
+                    response = json_response(project(cached, names))
+                    response.status_code = 200
+
+                    return response
+
+                # the trainer and its pokemons in a single query, never their history
+                trainer_obj = Trainer.get_trainer(
+                    trainer_id, pokemons="joined", pokemon_columns=POKEMON.names
+                )
 
                 if trainer_obj is None:
                     response = jsonify("No trainer found")
@@ -345,59 +908,48 @@ def create_app(config_name):
 
                     return response
 
-                for obj in pokemon_objs:
-                    poke_obj = {
-                        "id": obj.id,
-                        "nickname": obj.nickname,
-                        "species": obj.species,
-                        "level": obj.level,
-                        "owner": obj.owner,
-                        "dateOfOwnership": obj.dateOfOwnership.strftime("%d-%m-%Y"),
-                    }
-                    # trainer_obj = {
-                    #     "id": i.owner,
-                    #     "firstName": i.firstName,
-                    # }
-                    pokemons.append(poke_obj)
-
-                trainer = {
-                    "firstName": trainer_obj.firstName,
-                    "lastName": trainer_obj.lastName,
-                }
-
-                response = jsonify(
-                    {
-                        "firstName": trainer_obj.firstName,
-                        "lastName": trainer_obj.lastName,
-                        "pokemons": pokemons,
-                    }
+                trainer = TRAINER_DETAIL(trainer_obj)
+                # dropped whenever one of the pokemons listed changes
+                cache.set(
+                    "trainer",
+                    trainer_id,
+                    trainer,
+                    depends_on=[f"pokemon:{obj.id}" for obj in trainer_obj.pokemons],
                 )
+
+                response = json_response(project(trainer, names))
                 response.status_code = 200
 
                 return response
 
-            page = request.args.get("page", default=1, type=int)
-            limit = request.args.get("limit", default=5, type=int)
-            trainers = Trainer.get_all()
-            total_pages = len(trainers) // limit
-            results = []
-            start = 0 + page * limit
-            end = min(start + limit, len(trainers))
-
-            for trainer in trainers:
-                obj = {
-                    "id": trainer.id,
-                    "firstName": trainer.firstName,
-                    "lastName": trainer.lastName,
-                    "dateOfBirth": trainer.dateOfBirth.strftime("%d-%m-%Y"),
-                }
-                results.append(obj)
+            # pokemons of the whole page are loaded in one more query
+            embed = request.args.get("embed", default=None, type=str)
+            embed_pokemons = embed == "pokemons"
+            serializer = TRAINER_WITH_POKEMONS if embed_pokemons else TRAINER
+            try:
+                names = read_fields(TRAINER)
+            except ValueError as e:
+                return invalid_fields(e)
 
-            results = results[start:end]
+            if names is not None:
+                serializer = serializer.only([*names, "pokemons"])
+            try:
+                trainers, fields = paginate(
+                    Trainer,
+                    request.args,
+                    app.config["PAGE_MAX_LIMIT"],
+                    pokemons="selectin" if embed_pokemons else None,
+                    # only the columns returned are read
+                    columns=names or TRAINER.names,
+                    pokemon_columns=POKEMON.names,
+                )
+            except ValueError:
+                response = jsonify({"success": False, "error": "Invalid cursor"})
+                response.status_code = 400
 
-            response = jsonify(
-                {"trainers": results, "page": page, "total_page": total_pages}
-            )
+                return response
+
+            response = json_response({"trainers": serializer.many(trainers), **fields})
 
             response.status_code = 200
 
@@ -415,25 +967,30 @@ def create_app(config_name):
 
                 return response
 
-            trainer = Trainer.get_trainer(trainer_id)
-
+            fields = {}
             if firstName is not None:
-                trainer.firstName = firstName
+                fields["firstName"] = firstName
             if lastName is not None:
-                trainer.lastName = lastName
+                fields["lastName"] = lastName
             if dateOfBirth is not None:
-                trainer.dateOfBirth = dateOfBirth
+                fields["dateOfBirth"] = dateOfBirth
 
             try:
-                "trying to save"
-                trainer.save()
+                found = Trainer.update(trainer_id, **fields)
             except:
+                db.session.rollback()
                 message = f"Unable to update {trainer_id}"
                 response = jsonify({"success": False, "error": message})
                 response.status_code = 400
 
                 return response
 
+            if not found:
+                response = jsonify({"success": False, "error": "No trainers found"})
+                response.status_code = 404
+
+                return response
+
             response = jsonify({"success": True})
             response.status_code = 200
 
@@ -464,6 +1021,60 @@ def create_app(config_name):
 
             return response
 
+    @app.route("/trainer/batch/", methods=["GET", "POST"])
+    @conditional("trainer", "pokemon")
+    def get_trainers_batch():
+        """
+        @api {get} /trainer/batch Gets many trainers at once
+        @apiVersion 1.0.0
+        @apiName GetTrainersBatch
+        @apiGroup Trainer
+
+        @apiParam {String}      ids           Comma separated ids of trainers, or a JSON body {"ids": [...]} with POST
+
+        @apiSuccess (200 OK) {Object}    trainers        Trainers in the order asked, or an error per id not found
+
+        @apiSuccessExample Success-Response:
+            HTTP/1.1 {json} 200 OK
+            {
+                "trainers": [{"id": "trainer1",
+                            "firstName": "Ash",
+                            "lastName": "Ketchum",
+                            "pokemons": []},
+                            {"id": "trainer99",
+                            "error": "No trainer found"}]
+            }
+        """
+        try:
+            ids = read_ids()
+        except ValueError as e:
+            response = jsonify({"success": False, "error": str(e)})
+            response.status_code = 400
+
+            return response
+
+        found = lookup_many(
+            "trainer",
+            ids,
+            lambda missing: Trainer.get_trainers(
+                missing, pokemons="selectin", pokemon_columns=POKEMON.names
+            ),
+            TRAINER_DETAIL,
+            lambda trainer: [f"pokemon:{obj.id}" for obj in trainer.pokemons],
+        )
+
+        results = [
+            {"id": id, **found[id]}
+            if id in found
+            else {"id": id, "error": "No trainer found"}
+            for id in ids
+        ]
+
+        response = json_response({"trainers": results})
+        response.status_code = 200
+
+        return response
+
     @app.route("/trainer/create/", methods=["POST"])
     def create_trainer():
         """
@@ -586,6 +1197,7 @@ def create_app(config_name):
             return response
 
     @app.route("/pokemon/", methods=["GET", "PUT", "DELETE"])
+    @conditional("pokemon")
     def get_pokemon():
         """
         @api {get} /pokemon Gets list of pokemon
@@ -595,10 +1207,18 @@ def create_app(config_name):
 
         @apiParam {String}               [page=1]          Page number
         @apiParam {String}               [limit=5]         Results limit per page
-
-
-        @apiSuccess (200 OK) {String}    page            Page Number
-        @apiSuccess (200 OK) {String}    total_page      Total Page Number
+        @apiParam {String}               [cursor]          Cursor of the page to get, replaces page
+        @apiParam {String}               [fields]          Comma separated fields of pokemons to return, all by default
+        @apiParam {String}               [species]         Only pokemons of this species
+        @apiParam {Number}               [levelMin]        Only pokemons of at least this level
+        @apiParam {Number}               [levelMax]        Only pokemons of at most this level
+        @apiParam {String}               [owner]           Only pokemons of this trainer
+        @apiParam {String}               [ownedFrom]       Only pokemons owned since this date (DD-MM-YYYY)
+        @apiParam {String}               [ownedTo]         Only pokemons owned until this date (DD-MM-YYYY)
+
+        @apiSuccess (200 OK) {String}    page            Page Number, without cursor
+        @apiSuccess (200 OK) {String}    total_page      Total Page Number, without cursor
+        @apiSuccess (200 OK) {String}    next            Cursor of the next page, null on the last page
         @apiSuccess (200 OK) {Object}    pokemons        Pokemon object
 
         @apiSuccessExample Success-Response:
@@ -606,6 +1226,7 @@ def create_app(config_name):
             {
                 "page": "1",
                 "total_page": "4",
+                "next": "cGlrYWNodTU",
                 "pokemons": [
                     {"id": "pika1",
                     "nickname": "pikapika",
@@ -623,6 +1244,7 @@ def create_app(config_name):
         @apiGroup Pokemon
 
         @apiParam {String}               pokemonId           Id of Pokemon
+        @apiParam {String}               [fields]            Comma separated fields to return, all by default
 
         @apiSuccess (200 OK) {String}    id                  Id of Pokemon
         @apiSuccess (200 OK) {String}    nickname            Nickname of Pokemon
@@ -680,8 +1302,21 @@ def create_app(config_name):
         """
         pokemon_id = request.args.get("pokemonId", default=None, type=str)
         if request.method == "GET":
+            try:
+                names = read_fields(POKEMON)
+            except ValueError as e:
+                return invalid_fields(e)
+
             if pokemon_id is not None:
-                pokemon = Pokemon.get_pokemon(pokemon_id)
+                cached = cache.get("pokemon", pokemon_id)
+                if cached is not None:
+                    response = json_response(project(cached, names))
+                    response.status_code = 200
+
+                    return response
+
+                # the whole pokemon is cached, but never its history
+                pokemon = Pokemon.get_pokemon(pokemon_id, columns=POKEMON.names)
                 if not pokemon:
                     response = jsonify("No Pokemon found")
                     response.status_code = 404
@@ -690,44 +1325,45 @@ def create_app(config_name):
 
                 # date_object = datetime.strptime(date_string, "%d %B, %Y")
 
-                poke_obj = {
-                    "id": pokemon.id,
-                    "nickname": pokemon.nickname,
-                    "species": pokemon.species,
-                    "level": pokemon.level,
-                    "owner": pokemon.owner,
-                    "dateOfOwnership": pokemon.dateOfOwnership.strftime("%d-%m-%Y"),
-                }
+                poke_obj = POKEMON(pokemon)
+                # dropped along with its owner when the trainer is deleted
+                cache.set(
+                    "pokemon",
+                    pokemon_id,
+                    poke_obj,
+                    depends_on=[f"trainer:{pokemon.owner}"],
+                )
 
-                response = jsonify(poke_obj)
+                response = json_response(project(poke_obj, names))
                 response.status_code = 200
 
                 return response
 
-            page = request.args.get("page", default=1, type=int)
-            limit = request.args.get("limit", default=5, type=int)
-            pokemons = Pokemon.get_all()
-            total_pages = len(pokemons) // limit
-            results = []
-            start = 0 + page * limit
-            end = min(start + limit, len(pokemons))
-
-            for pokemon in pokemons:
-                obj = {
-                    "id": pokemon.id,
-                    "nickname": pokemon.nickname,
-                    "species": pokemon.species,
-                    "level": pokemon.level,
-                    "owner": pokemon.owner,
-                    "dateOfOwnership": pokemon.dateOfOwnership.strftime("%d-%m-%Y"),
-                }
-                results.append(obj)
+            try:
+                filters = read_filters()
+            except ValueError as e:
+                response = jsonify({"success": False, "error": str(e)})
+                response.status_code = 400
 
-            results = results[start:end]
+                return response
 
-            response = jsonify(
-                {"pokemons": results, "page": page, "total_page": total_pages}
-            )
+            try:
+                pokemons, fields = paginate(
+                    Pokemon,
+                    request.args,
+                    app.config["PAGE_MAX_LIMIT"],
+                    filters=filters,
+                    # only the columns returned are read, never the history
+                    columns=names or POKEMON.names,
+                )
+            except ValueError:
+                response = jsonify({"success": False, "error": "Invalid cursor"})
+                response.status_code = 400
+
+                return response
+
+            serializer = POKEMON if names is None else POKEMON.only(names)
+            response = json_response({"pokemons": serializer.many(pokemons), **fields})
 
             response.status_code = 200
 
@@ -750,28 +1386,34 @@ def create_app(config_name):
 
                 return response
 
-            pokemon = Pokemon.get_pokemon(pokemon_id)
-
+            fields = {}
             if nickname is not None:
-                pokemon.nickname = nickname
+                fields["nickname"] = nickname
             if species is not None:
-                pokemon.species = species
+                fields["species"] = species
             if level is not None:
-                pokemon.level = level
+                fields["level"] = level
             if owner is not None:
-                pokemon.owner = owner
+                fields["owner"] = owner
             if dateOfOwnership is not None:
-                pokemon.dateOfOwnership = dateOfOwnership
+                fields["dateOfOwnership"] = dateOfOwnership
 
             try:
-                pokemon.save()
+                found = Pokemon.update(pokemon_id, **fields)
             except:
+                db.session.rollback()
                 message = f"Unable to update {pokemon_id}"
                 response = jsonify({"success": False, "error": message})
                 response.status_code = 400
 
                 return response
 
+            if not found:
+                response = jsonify({"success": False, "error": "No Pokemon found"})
+                response.status_code = 404
+
+                return response
+
             response = jsonify({"success": True})
             response.status_code = 200
 
@@ -803,6 +1445,62 @@ def create_app(config_name):
 
             return response
 
+    @app.route("/pokemon/batch/", methods=["GET", "POST"])
+    @conditional("pokemon")
+    def get_pokemons_batch():
+        """
+        @api {get} /pokemon/batch Gets many pokemons at once
+        @apiVersion 1.0.0
+        @apiName GetPokemonsBatch
+        @apiGroup Pokemon
+
+        @apiParam {String}      ids           Comma separated ids of pokemons, or a JSON body {"ids": [...]} with POST
+        @apiParam {String}      [fields]      Comma separated fields of pokemons to return, all by default
+
+        @apiSuccess (200 OK) {Object}    pokemons        Pokemons in the order asked, or an error per id not found
+
+        @apiSuccessExample Success-Response:
+            HTTP/1.1 {json} 200 OK
+            {
+                "pokemons": [{"id": "pika1",
+                            "nickname": "pikapika",
+                            "species": "pikachu",
+                            "level": 10,
+                            "owner": "trainer1",
+                            "dateOfOwnership": "25-12-2021"},
+                            {"id": "pika99",
+                            "error": "No Pokemon found"}]
+            }
+        """
+        try:
+            ids = read_ids()
+            names = read_fields(POKEMON)
+        except ValueError as e:
+            response = jsonify({"success": False, "error": str(e)})
+            response.status_code = 400
+
+            return response
+
+        found = lookup_many(
+            "pokemon",
+            ids,
+            lambda missing: Pokemon.get_pokemons(missing, columns=POKEMON.names),
+            POKEMON,
+            lambda pokemon: [f"trainer:{pokemon.owner}"],
+        )
+
+        results = [
+            project(found[id], names)
+            if id in found
+            else {"id": id, "error": "No Pokemon found"}
+            for id in ids
+        ]
+
+        response = json_response({"pokemons": results})
+        response.status_code = 200
+
+        return response
+
     @app.route("/exchange/", methods=["POST"])
     def exchange():
         """
@@ -842,20 +1540,23 @@ def create_app(config_name):
 
             return response
 
-        trainer_obj_a = Trainer.get_trainer(trainerA)
-        trainer_obj_b = Trainer.get_trainer(trainerB)
+        try:
+            exchanged = Pokemon.exchange(trainerA, pokemonsA, trainerB, pokemonsB)
+        except:
+            # unknown trainers fail the owner foreign key
+            db.session.rollback()
+            exchanged = False
 
-        for i in pokemonsA:
-            pokemon_obj_a = Pokemon.get_pokemon(i)
-            pokemon_obj_a.owner = trainer_obj_b.id
-            pokemon_obj_a.history.append(trainer_obj_b.id)
-            pokemon_obj_a.save()
+        if not exchanged:
+            response = jsonify(
+                {
+                    "success": False,
+                    "error": "Unable to exchange pokemons",
+                }
+            )
+            response.status_code = 400
 
-        for i in pokemonsB:
-            pokemon_obj_b = Pokemon.get_pokemon(i)
-            pokemon_obj_b.owner = trainer_obj_a.id
-            pokemon_obj_b.history.append(trainer_obj_a.id)
-            pokemon_obj_b.save()
+            return response
 
         response = jsonify({"success": True})
         response.status_code = 200
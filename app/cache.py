@@ -0,0 +1,452 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import redis
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from app import db
+from app.serializers import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# past this many entries invalidated by one transaction the whole cache is
+# dropped instead, e.g. for large uploads
+MAX_PENDING = 10000
+# left in place of an invalidated entry, see Cache.invalidate()
+TOMBSTONE = ""
+# rough bookkeeping cost of an in-process entry on top of its JSON size
+ENTRY_OVERHEAD = 200
+
+
+class LocalCache(object):
+    """This class represents the in-process tier of the cache.
+
+    Entries are kept in least recently used order and dropped past ttl
+    seconds or once their total size goes over max_bytes, sizes being
+    estimated from the JSON documents they were read from. Every eviction
+    bumps generation, and an entry read before an eviction is not added
+    after it, so a lookup racing an invalidation cannot keep the old value.
+    """
+
+    def __init__(self, max_bytes, ttl=30):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = 0
+        self.hits = Counter()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            expires, size, value = entry
+            if expires < time.monotonic():
+                self._drop(key)
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size, generation):
+        """Add value unless something was evicted since generation was read"""
+        size += ENTRY_OVERHEAD
+        with self.lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+
+            self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def evict(self, keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.size = 0
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+class Cache(object):
+    """This class represents the redis read-through cache of detail lookups.
+
+    Entries are JSON documents stored under <prefix>:<namespace>:<id> that
+    expire after ttl seconds, eviction under memory pressure is left to the
+    maxmemory-policy of the redis server. An entry may depend on others, like
+    a trainer on the pokemons it lists, and is dropped along with them.
+
+    Invalidated entries are replaced by a tombstone for tombstone_ttl seconds
+    and entries are only added where there is nothing, so a reader that
+    queried the database before a write committed cannot put the old value
+    back. Hits and misses are counted per namespace, in the worker first,
+    and sent to redis along with its next lookup, or by the listener thread
+    once the worker is idle, see send_counts().
+
+    With a LocalCache, entries are also kept in the worker itself and looked
+    up there first. Invalidations are published on a redis channel that every
+    worker listens to, see listen(), and the local tier is only used while
+    the worker is subscribed, since it would miss invalidations otherwise.
+    Other in-process copies of the data can follow the same invalidations,
+    see subscribe().
+    """
+
+    def __init__(self, r, ttl=300, tombstone_ttl=5, prefix="cache", local=None):
+        self.r = r
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.prefix = prefix
+        self.stats_key = f"{prefix}-stats"
+        # hits and misses not sent to redis yet, see flush_counts()
+        self.counts = Counter()
+        self.counts_lock = threading.Lock()
+        self.channel = f"{prefix}-invalidate"
+        self.local = local
+        # told of every invalidation, from this worker or another one
+        self.subscribers = [local] if local is not None else []
+        self.listening = threading.Event()
+        self.stopped = threading.Event()
+        self.listener = None
+
+    def key(self, name):
+        return f"{self.prefix}:{name}"
+
+    def get(self, namespace, id):
+        """Return the cached value of namespace:id, None on a miss"""
+        return self.get_many(namespace, [id]).get(id)
+
+    def get_many(self, namespace, ids):
+        """Return {id: value} of the ids of namespace found in the cache
+
+        The local tier is looked at first, the rest is read from redis in a
+        single MGET, pipelined with the counts of the previous lookups.
+        """
+        found, keys = {}, {}
+        local = self.local if self.listening.is_set() else None
+        if local is not None:
+            generation = local.generation
+            for id in ids:
+                key = self.key(f"{namespace}:{id}")
+                value = local.get(key)
+                if value is None:
+                    keys[id] = key
+                else:
+                    found[id] = value
+            local.hits[namespace] += len(found)
+        else:
+            keys = {id: self.key(f"{namespace}:{id}") for id in ids}
+
+        if not keys:
+            return found
+
+        pipe = self.r.pipeline(transaction=False)
+        pipe.mget(list(keys.values()))
+        counts = self.flush_counts(pipe)
+        try:
+            values = pipe.execute()[0]
+        except redis.RedisError:
+            self.count(counts)
+            logger.warning(
+                "Cache unavailable, reading %d %s from the database",
+                len(keys),
+                namespace,
+            )
+            return found
+
+        hits = sum(1 for value in values if value)
+        self.count(
+            {f"{namespace}:hits": hits, f"{namespace}:misses": len(values) - hits}
+        )
+        for (id, key), value in zip(keys.items(), values):
+            if not value:
+                continue
+
+            found[id] = loads(value)
+            if local is not None:
+                local.put(key, found[id], len(value), generation)
+
+        return found
+
+    def count(self, counts):
+        """Add counts {"namespace:outcome": n} to those not sent to redis yet"""
+        with self.counts_lock:
+            self.counts.update(counts)
+
+    def flush_counts(self, pipe):
+        """Queue the counts not sent to redis yet on pipe and return them"""
+        with self.counts_lock:
+            counts, self.counts = self.counts, Counter()
+
+        for field, n in counts.items():
+            if n:
+                pipe.hincrby(self.stats_key, field, n)
+
+        return counts
+
+    def send_counts(self):
+        """Send the counts not sent to redis yet on their own"""
+        pipe = self.r.pipeline(transaction=False)
+        counts = self.flush_counts(pipe)
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            self.count(counts)
+
+    def set(self, namespace, id, value, depends_on=()):
+        """Cache value as namespace:id unless it was just invalidated
+
+        depends_on lists the "namespace:id" entries whose invalidation must
+        also drop this one.
+        """
+        self.set_many(namespace, [(id, value, depends_on)])
+
+    def set_many(self, namespace, entries):
+        """Cache (id, value, depends_on) entries of namespace, see set()"""
+        local = self.local if self.listening.is_set() else None
+        generation = local.generation if local is not None else None
+
+        pipe, added = self.r.pipeline(transaction=False), []
+        for id, value, depends_on in entries:
+            key = self.key(f"{namespace}:{id}")
+            document = dumps(value)
+            added.append((len(pipe), key, value, len(document)))
+            pipe.set(key, document, ex=self.ttl, nx=True)
+            for name in depends_on:
+                dependents = self.key(f"deps:{name}")
+                pipe.sadd(dependents, key)
+                pipe.expire(dependents, self.ttl)
+
+        if not added:
+            return
+
+        try:
+            results = pipe.execute()
+        except redis.RedisError:
+            logger.warning(
+                "Cache unavailable, not caching %d %s", len(added), namespace
+            )
+            return
+
+        # not over a tombstone, so no write committed since value was read
+        if local is not None:
+            for index, key, value, size in added:
+                if results[index]:
+                    local.put(key, value, size, generation)
+
+    def invalidate(self, names, batch_size=1000):
+        """Drop the "namespace:id" entries names and the entries depending on them"""
+        names = list(names)
+        for start in range(0, len(names), batch_size):
+            batch = names[start : start + batch_size]
+            dependents = [self.key(f"deps:{name}") for name in batch]
+
+            keys = [self.key(name) for name in batch]
+
+            pipe = self.r.pipeline(transaction=False)
+            for key in keys:
+                pipe.set(key, TOMBSTONE, ex=self.tombstone_ttl)
+            for key in dependents:
+                pipe.smembers(key)
+            pipe.delete(*dependents)
+            pipe.publish(self.channel, json.dumps(keys))
+            results = pipe.execute()
+            keys += set().union(*results[len(batch) : len(batch) + len(dependents)])
+
+            # a second round trip only when other entries depend on these
+            if len(keys) > len(batch):
+                for key in keys[len(batch) :]:
+                    pipe.set(key, TOMBSTONE, ex=self.tombstone_ttl)
+                pipe.publish(self.channel, json.dumps(keys[len(batch) :]))
+                pipe.execute()
+
+            # this worker at once, the others when the message reaches them
+            self.notify(keys)
+
+    def clear(self, batch_size=1000):
+        """Drop every entry"""
+        self.notify(None)
+        self.r.publish(self.channel, "*")
+
+        keys = []
+        for key in self.r.scan_iter(match=self.key("*"), count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                self.r.delete(*keys)
+                keys = []
+
+        if keys:
+            self.r.delete(*keys)
+
+    def stats(self):
+        """Return {namespace: {hits, misses, local_hits, hit_rate}} counted so far
+
+        hits and misses are counted in redis across workers, less the last
+        lookups the other workers did not send yet, local_hits are the
+        lookups served by the local tier of this worker only.
+        """
+        local_hits = self.local.hits if self.local is not None else Counter()
+        pipe = self.r.pipeline(transaction=False)
+        pending = self.flush_counts(pipe)
+        pipe.hgetall(self.stats_key)
+        try:
+            totals = pipe.execute()[-1]
+        except redis.RedisError:
+            self.count(pending)
+            raise
+
+        stats = {}
+        for field, count in totals.items():
+            namespace, outcome = field.rsplit(":", 1)
+            counts = stats.setdefault(namespace, {"hits": 0, "misses": 0})
+            counts[outcome] = int(count)
+
+        for namespace, counts in stats.items():
+            counts["local_hits"] = local_hits[namespace]
+            hits = counts["hits"] + counts["local_hits"]
+            total = hits + counts["misses"]
+            counts["hit_rate"] = round(hits / total, 4) if total else 0
+
+        return stats
+
+    def subscribe(self, subscriber):
+        """Tell subscriber of invalidations, call before listen()
+
+        subscriber.evict(keys) is called with the keys of invalidated entries
+        and subscriber.clear() when everything is, or when invalidations may
+        have been missed.
+        """
+        self.subscribers.append(subscriber)
+
+    def listen(self, retry_delay=1.0):
+        """Start evicting local entries invalidated by other workers
+
+        Messages are read by a daemon thread, which resubscribes after a
+        connection error. The local tier is emptied whenever the worker
+        (re)subscribes, as invalidations published meanwhile were missed.
+        """
+        if not self.subscribers or self.listener is not None:
+            return
+
+        self.listener = threading.Thread(
+            target=self._listen, args=(retry_delay,), name="cache", daemon=True
+        )
+        self.listener.start()
+
+    def close(self):
+        """Stop listening to invalidations, see listen()
+
+        The thread exits after its current wait, within retry_delay.
+        """
+        self.stopped.set()
+        self.listening.clear()
+
+    def _listen(self, retry_delay):
+        while not self.stopped.is_set():
+            pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                self.notify(None)
+                self.listening.set()
+                while not self.stopped.is_set():
+                    message = pubsub.get_message(timeout=retry_delay)
+                    if message is None:
+                        # idle, the other workers can see its counts now
+                        self.send_counts()
+                        continue
+                    elif message["data"] == "*":
+                        self.notify(None)
+                    else:
+                        self.notify(json.loads(message["data"]))
+            except redis.RedisError:
+                logger.warning("Cache invalidations unavailable, local cache disabled")
+            finally:
+                self.listening.clear()
+                self.notify(None)
+                pubsub.close()
+
+            self.stopped.wait(retry_delay)
+
+    def notify(self, keys):
+        """Pass invalidated keys on to subscribers, None for everything"""
+        for subscriber in self.subscribers:
+            if keys is None:
+                subscriber.clear()
+            else:
+                subscriber.evict(keys)
+
+
+def current_cache():
+    """Helper function to get the cache of the current app, if any"""
+    if has_app_context():
+        return current_app.extensions.get("cache")
+
+
+def invalidate(*names):
+    """Helper function to invalidate "namespace:id" cache entries
+
+    Entries are only dropped once the current transaction commits, so that
+    nobody can cache the old rows again in between.
+    """
+    info = db.session.info
+    if info.get("cache_clear"):
+        return
+
+    pending = info.setdefault("cache_invalidate", set())
+    pending.update(names)
+    if len(pending) > MAX_PENDING:
+        invalidate_all()
+
+
+def invalidate_all():
+    """Helper function to drop the whole cache once the current transaction commits"""
+    db.session.info["cache_clear"] = True
+    db.session.info.pop("cache_invalidate", None)
+
+
+def invalidating(rows, keys):
+    """Helper function to invalidate the cache entries keys(row) of rows as they go by"""
+    for row in rows:
+        invalidate(*keys(row))
+        yield row
+
+
+@event.listens_for(db.session, "after_commit")
+def flush_invalidations(session):
+    names = session.info.pop("cache_invalidate", None)
+    clear = session.info.pop("cache_clear", False)
+    cache = current_cache()
+    if cache is None or not (names or clear):
+        return
+
+    try:
+        if clear:
+            cache.clear()
+        else:
+            cache.invalidate(names)
+    except redis.RedisError:
+        # the rows are committed, stale entries are left to expire
+        logger.exception("Unable to invalidate cache entries")
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard_invalidations(session):
+    session.info.pop("cache_invalidate", None)
+    session.info.pop("cache_clear", None)
@@ -0,0 +1,133 @@
+import json
+import os
+import shutil
+import time
+import uuid
+
+
+class ChunkedUpload(object):
+    """This class represents a resumable upload sent as numbered chunks.
+
+    Chunks are stored as separate files in a directory per upload under base,
+    so they can arrive in any order and be retried until the upload is
+    finalized. A chunk only counts as received once it has been completely
+    written to disk. Chunks are kept until the file they make up is loaded,
+    and uploads left alone for too long are removed by expire().
+    """
+
+    def __init__(self, base, id):
+        self.id = id
+        self.path = os.path.join(base, id)
+
+    @staticmethod
+    def create(base, dataType):
+        """Start a new chunked upload of dataType"""
+        upload = ChunkedUpload(base, uuid.uuid4().hex)
+        os.makedirs(upload.path)
+
+        with open(os.path.join(upload.path, "meta.json"), "w") as f:
+            json.dump({"type": dataType}, f)
+
+        return upload
+
+    @staticmethod
+    def expire(base, ttl):
+        """Remove the uploads under base nothing was written to for ttl seconds"""
+        cutoff = time.time() - ttl
+        try:
+            entries = list(os.scandir(base))
+        except FileNotFoundError:
+            return
+
+        for entry in entries:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    @staticmethod
+    def get(base, id):
+        """Look up a chunked upload, returns None if it does not exist"""
+        try:
+            # ids come from urls, make sure they cannot escape base
+            if uuid.UUID(id).hex != id:
+                return None
+        except ValueError:
+            return None
+
+        upload = ChunkedUpload(base, id)
+        if not os.path.isdir(upload.path):
+            return None
+
+        return upload
+
+    @property
+    def type(self):
+        with open(os.path.join(self.path, "meta.json")) as f:
+            return json.load(f)["type"]
+
+    def chunk_path(self, index):
+        return os.path.join(self.path, f"{index}.chunk")
+
+    def received(self):
+        """Return the sorted indexes of the chunks received so far"""
+        return sorted(
+            int(name[: -len(".chunk")])
+            for name in os.listdir(self.path)
+            if name.endswith(".chunk")
+        )
+
+    def put(self, index, stream):
+        """Store chunk index read from stream
+
+        Returns False without reading the stream if the chunk was already
+        received, which lets clients blindly resend chunks on resume.
+        """
+        path = self.chunk_path(index)
+        if os.path.exists(path):
+            return False
+
+        partial = f"{path}.{uuid.uuid4().hex}.partial"
+        with open(partial, "wb") as f:
+            shutil.copyfileobj(stream, f)
+        os.replace(partial, path)
+
+        return True
+
+    def missing(self, total=None):
+        """Return indexes of the chunks still needed out of total
+
+        Without total, chunks are expected to be numbered 0 to the highest
+        index received. Only the gaps between received chunks are walked, so
+        callers bound total and the indexes accepted, see put().
+        """
+        received = self.received()
+        if total is None:
+            total = received[-1] + 1 if received else 0
+
+        missing = []
+        expected = 0
+        for index in received:
+            if index >= total:
+                break
+            missing.extend(range(expected, index))
+            expected = index + 1
+        missing.extend(range(expected, total))
+
+        return missing
+
+    def extra(self, total):
+        """Return indexes of the chunks received past total"""
+        return [index for index in self.received() if index >= total]
+
+    def assemble(self, path, total):
+        """Write chunks 0 to total - 1 in order into a single file at path"""
+        with open(path, "wb") as out:
+            for index in range(total):
+                with open(self.chunk_path(index), "rb") as f:
+                    shutil.copyfileobj(f, out)
+
+    def touch(self):
+        """Keep the upload from expiring for another ttl, see expire()"""
+        os.utime(self.path)
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,200 @@
+import io
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    MetaData,
+    Table,
+    Text,
+    cast,
+    distinct,
+    func,
+    select,
+)
+from sqlalchemy.dialects.postgresql import array, insert
+
+from app import db
+from app.models import Trainer
+from app.validation import (
+    INVALID_DATE,
+    INVALID_INTEGER,
+    MISSING_VALUE,
+    parse_date,
+    parse_integer,
+)
+
+
+def missing_columns(names, schema):
+    """Helper function to report the schema columns absent from a file"""
+    return [
+        {"row": None, "column": name, "error": "Missing column"}
+        for name in schema.columns
+        if name not in names
+    ]
+
+
+def parse_column(column, parse, type):
+    """Helper function to parse a string column once per distinct value
+
+    Returns the parsed column, with nulls where values are missing or invalid.
+    """
+    encoded = column.dictionary_encode()
+    parsed = [parse(value) for value in encoded.dictionary.to_pylist()]
+
+    return pa.array(parsed, type=type).take(encoded.indices)
+
+
+def validate_record_batch(batch, schema, start=1):
+    """Validate an Arrow record batch against schema
+
+    Columns are checked with Arrow compute functions, and date or integer
+    strings are only parsed once per distinct value, so no Python object is
+    built per row. Native date and integer columns are taken as they are.
+    Returns (columns, errors) where columns maps each schema column to its
+    typed values and errors is the same report as validation.validate_batch().
+    """
+    columns, errors = {}, []
+
+    for name in schema.columns:
+        column = batch.column(name)
+        missing = pc.is_null(column)
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            missing = pc.or_kleene(missing, pc.equal(column, ""))
+
+        message = None
+        if name in schema.dates and (
+            pa.types.is_date(column.type) or pa.types.is_timestamp(column.type)
+        ):
+            values = column.cast(pa.date32())
+        elif name in schema.integers and pa.types.is_integer(column.type):
+            values = column.cast(pa.int64())
+        elif name in schema.dates:
+            values = parse_column(column.cast(pa.string()), parse_date, pa.date32())
+            message = INVALID_DATE
+        elif name in schema.integers:
+            values = parse_column(column.cast(pa.string()), parse_integer, pa.int64())
+            message = INVALID_INTEGER
+        else:
+            values = column.cast(pa.string())
+
+        for index in pc.indices_nonzero(missing).to_pylist():
+            errors.append(
+                {"row": start + index, "column": name, "error": MISSING_VALUE}
+            )
+
+        if message is not None:
+            invalid = pc.and_(pc.is_null(values), pc.invert(missing))
+            for index in pc.indices_nonzero(invalid).to_pylist():
+                errors.append({"row": start + index, "column": name, "error": message})
+
+        columns[name] = values
+
+    errors.sort(key=lambda error: error["row"])
+
+    return columns, errors
+
+
+def fingerprint_sql(schema, columns):
+    """SQL counterpart of validation.fingerprint(), which must stay in step"""
+    values = []
+    for name in schema.columns[1:]:
+        value = columns[name]
+        if name in schema.dates:
+            value = func.to_char(value, "YYYY-MM-DD")
+        elif name in schema.integers:
+            value = cast(value, Text)
+        values.append(value)
+
+    return func.md5(func.concat_ws("\x1f", *values))
+
+
+class StagingTable(object):
+    """This class represents the temporary table of a columnar upload.
+
+    Validated record batches are sent with COPY, straight from Arrow's CSV
+    writer, and the table is dropped at the end of the transaction. Rows are
+    numbered in the order they were added so errors can point back at them.
+    """
+
+    def __init__(self, model, schema):
+        self.model = model
+        self.schema = schema
+        target = model.__table__
+
+        self.table = Table(
+            f"staging_{target.name}",
+            MetaData(),
+            Column("upload_row", BigInteger, primary_key=True),
+            *(Column(name, target.c[name].type) for name in schema.columns),
+            prefixes=["TEMPORARY"],
+            postgresql_on_commit="DROP",
+        )
+        self.table.create(db.session.connection())
+
+        names = ", ".join(f'"{name}"' for name in schema.columns)
+        self.copy = f"COPY {self.table.name} ({names}) FROM STDIN WITH (FORMAT csv)"
+
+    def add(self, columns):
+        """Copy validated columns, see validate_record_batch()"""
+        batch = pa.record_batch(
+            [columns[name] for name in self.schema.columns],
+            names=list(self.schema.columns),
+        )
+        buffer = io.BytesIO()
+        pyarrow.csv.write_csv(
+            batch, buffer, pyarrow.csv.WriteOptions(include_header=False)
+        )
+        buffer.seek(0)
+
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(self.copy, buffer)
+
+    def missing_owners(self, limit):
+        """Return the first rows, at most limit, whose owner is not a trainer"""
+        staged, trainer = self.table, Trainer.__table__
+
+        return (
+            db.session.execute(
+                select(staged.c.upload_row)
+                .outerjoin(trainer, trainer.c.id == staged.c.owner)
+                .where(trainer.c.id.is_(None))
+                .order_by(staged.c.upload_row)
+                .limit(limit)
+            )
+            .scalars()
+            .all()
+        )
+
+    def load(self):
+        """Insert or update the staged rows in a single statement
+
+        Later rows win over earlier ones with the same id, and rows whose
+        fingerprint did not change are left alone. Nothing is committed.
+        Returns (rows written, distinct rows staged).
+        """
+        staged, target = self.table, self.model.__table__
+
+        values = {name: staged.c[name] for name in self.schema.columns}
+        if "history" in target.c:
+            values["history"] = array([staged.c.owner])
+        values["fingerprint"] = fingerprint_sql(self.schema, staged.c)
+
+        rows = (
+            select(*(value.label(name) for name, value in values.items()))
+            .distinct(staged.c.id)
+            .order_by(staged.c.id, staged.c.upload_row.desc())
+        )
+        stmt = insert(target).from_select(list(values), rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[target.c.id],
+            set_={name: stmt.excluded[name] for name in values if name != "id"},
+            where=target.c.fingerprint.is_distinct_from(stmt.excluded.fingerprint),
+        )
+
+        written = db.session.execute(stmt).rowcount
+        total = db.session.execute(select(func.count(distinct(staged.c.id)))).scalar()
+
+        return written, total
@@ -0,0 +1,156 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# media types worth compressing, the others are sent as they are
+COMPRESSIBLE = ("application/json", "text/csv", "application/x-ndjson")
+# supported Content-Encodings, br needs the brotli package
+ENCODINGS = ("br", "gzip")
+
+
+def encoded_etag(etag, encoding):
+    """Helper function to tag the ETag of a representation with its encoding"""
+    return f"{etag}-{encoding}"
+
+
+class Encoder(object):
+    """This class represents the incremental compression of a body.
+
+    Each chunk given to compress() comes out whole, so a streamed response
+    can be decompressed as it arrives, and finish() ends the stream.
+    """
+
+    def __init__(self, encoding, level):
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=level)
+        else:
+            # gzip framing
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self.encoding = encoding
+
+    def compress(self, chunk):
+        if self.encoding == "br":
+            return self.compressor.process(chunk) + self.compressor.flush()
+
+        return self.compressor.compress(chunk) + self.compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self):
+        if self.encoding == "br":
+            return self.compressor.finish()
+
+        return self.compressor.flush()
+
+
+def iter_encoded(chunks, encoding, level):
+    """Generator to compress a streamed body chunk by chunk"""
+    encoder = Encoder(encoding, level)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if chunk:
+                yield encoder.compress(chunk)
+
+        yield encoder.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+class Compression(object):
+    """This class represents the negotiated compression of responses.
+
+    Successful responses of a COMPRESSIBLE type are compressed with the
+    first of encodings the client accepts, at levels[encoding], once they
+    are at least min_size bytes long. Streamed responses are compressed as
+    they are sent, whatever their size. Every response that could have been
+    compressed varies on Accept-Encoding, and the ETag of a compressed one
+    gets the encoding appended, see encoded_etag().
+
+    With a LocalCache, compressed bodies of responses with an ETag are kept
+    under the encoded ETag, which changes with the data, so the same page
+    is only compressed once while the tables it is read from do not change.
+    """
+
+    def __init__(self, encodings, levels, min_size=1024, cache=None):
+        self.encodings = [e for e in encodings if e != "br" or brotli is not None]
+        self.levels = levels
+        self.min_size = min_size
+        self.cache = cache
+
+    def negotiate(self):
+        """Return the encoding to send the current response in, None for none"""
+        if not self.encodings:
+            return None
+
+        return request.accept_encodings.best_match(self.encodings)
+
+    def __call__(self, response):
+        """Compress response if worth it, for Flask.after_request()"""
+        if not self.encodings:
+            return response
+
+        if response.status_code == 304:
+            response.vary.add("Accept-Encoding")
+            return response
+
+        if (
+            response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+
+        level = self.levels[encoding]
+        etag, weak = response.get_etag()
+        if response.is_streamed:
+            response.response = iter_encoded(response.response, encoding, level)
+            response.direct_passthrough = False
+            response.headers.pop("Content-Length", None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+
+            response.set_data(self.compress(body, encoding, level, etag))
+
+        response.headers["Content-Encoding"] = encoding
+        if etag is not None:
+            response.set_etag(encoded_etag(etag, encoding), weak)
+
+        return response
+
+    def compress(self, body, encoding, level, etag=None):
+        """Return body compressed, from the cache when it has an ETag"""
+        if self.cache is None or etag is None:
+            return self.encode(body, encoding, level)
+
+        key = encoded_etag(etag, encoding)
+        generation = self.cache.generation
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = self.encode(body, encoding, level)
+            self.cache.put(key, compressed, len(compressed), generation)
+
+        return compressed
+
+    @staticmethod
+    def encode(body, encoding, level):
+        if encoding == "br":
+            return brotli.compress(body, quality=level)
+
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+        return compressor.compress(body) + compressor.flush()
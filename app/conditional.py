@@ -0,0 +1,62 @@
+import functools
+import hashlib
+
+from flask import make_response, request
+
+from app.compression import ENCODINGS, encoded_etag
+from app.models import TableVersion
+
+
+def compute_etag(versions):
+    """Helper function to build the ETag of the current request
+
+    The ETag covers the path and query string, which pick the representation,
+    and the versions of the tables it is read from.
+    """
+    seed = request.full_path + "|" + ",".join(str(v) for v, _ in versions)
+
+    return hashlib.sha1(seed.encode("utf-8")).hexdigest()
+
+
+def conditional(*tables):
+    """Decorator answering GET requests of a view from tables conditionally
+
+    The versions of tables are read before the view runs, in a single small
+    query, and a request whose If-None-Match holds the resulting ETag gets a
+    304 Not Modified without running the view at all. Otherwise the ETag and
+    the time of the last change to tables, as Last-Modified, are set on
+    successful responses. A write committed while the view runs changes the
+    versions, so the client gets the new data on its next request.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+
+            found = TableVersion.get(*tables)
+            if len(found) != len(tables):
+                # tables without their triggers yet, see TableVersion
+                return view(*args, **kwargs)
+
+            versions = [found[name] for name in tables]
+            etag = compute_etag(versions)
+            # compressed responses have the encoding appended to their ETag
+            for tag in (etag, *(encoded_etag(etag, e) for e in ENCODINGS)):
+                if request.if_none_match.contains(tag):
+                    response = make_response("", 304)
+                    response.set_etag(tag)
+
+                    return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.last_modified = max(modified for _, modified in versions)
+
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,51 @@
+import csv
+import io
+
+from sqlalchemy import select
+
+from app import db
+from app.ingest import MODELS
+from app.serializers import dumps, format_date
+from app.validation import SCHEMAS
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def iter_export(dataType, format, batch_size=10000):
+    """Generator to export a whole table in the layout /upload/ accepts
+
+    Rows are read in id order through a server-side cursor, batch_size at a
+    time, and each batch is yielded as one chunk of CSV or NDJSON, so memory
+    does not grow with the table and the first rows go out at once.
+    """
+    table = MODELS[dataType].__table__
+    schema = SCHEMAS[dataType]
+    dates = [schema.columns.index(name) for name in schema.dates]
+
+    stmt = select(*(table.c[name] for name in schema.columns)).order_by(table.c.id)
+    result = db.session.execute(
+        stmt.execution_options(stream_results=True, max_row_buffer=batch_size)
+    )
+
+    try:
+        if format == "csv":
+            yield ",".join(schema.columns).encode("utf-8") + b"\n"
+
+        for rows in result.partitions(batch_size):
+            records = [list(row) for row in rows]
+            for values in records:
+                for index in dates:
+                    if values[index] is not None:
+                        values[index] = format_date(values[index])
+
+            if format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer, lineterminator="\n").writerows(records)
+                yield buffer.getvalue().encode("utf-8")
+            else:
+                yield b"".join(
+                    dumps(dict(zip(schema.columns, values))) + b"\n"
+                    for values in records
+                )
+    finally:
+        result.close()
@@ -0,0 +1,69 @@
+import gzip
+import io
+import zlib
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+import zstandard
+
+# leading bytes of each supported format, anything else is read as plain CSV
+MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"PAR1", "parquet"),
+    (b"ARROW1", "arrow"),
+    (b"\xff\xff\xff\xff", "arrows"),
+)
+COMPRESSED = ("gzip", "zstd")
+COLUMNAR = ("parquet", "arrow", "arrows")
+# raised while reading a corrupt, truncated or wrongly encoded file
+READ_ERRORS = (
+    EOFError,
+    gzip.BadGzipFile,
+    zlib.error,
+    zstandard.ZstdError,
+    UnicodeDecodeError,
+    pa.ArrowException,
+)
+
+
+def sniff(f):
+    """Helper function to detect the format of a file object and rewind it"""
+    head = f.read(8)
+    f.seek(0)
+
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            return kind
+
+    return "csv"
+
+
+def decompress(kind, f):
+    """Helper function to decompress a gzip or zstd file object as a stream"""
+    if kind == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="rb")
+
+    # zstd frames may be concatenated, as written by zstd over several files
+    reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+    return io.BufferedReader(reader)
+
+
+def iter_record_batches(kind, f, batch_size):
+    """Helper function to read a Parquet file or an Arrow IPC file or stream
+
+    Yields record batches of at most batch_size rows. Larger batches found in
+    the file are sliced, which does not copy their data.
+    """
+    if kind == "parquet":
+        batches = pq.ParquetFile(f).iter_batches(batch_size=batch_size)
+    elif kind == "arrow":
+        reader = pa.ipc.open_file(f)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    else:
+        batches = pa.ipc.open_stream(f)
+
+    for batch in batches:
+        for offset in range(0, batch.num_rows, batch_size):
+            yield batch.slice(offset, batch_size)
@@ -0,0 +1,310 @@
+import codecs
+import csv
+import hashlib
+import shutil
+import tempfile
+from collections import namedtuple
+from contextlib import ExitStack
+
+import redis
+from flask import current_app
+
+from app import db
+from app.cache import invalidate_all, invalidating
+from app.columnar import StagingTable, missing_columns, validate_record_batch
+from app.formats import (
+    COLUMNAR,
+    COMPRESSED,
+    READ_ERRORS,
+    decompress,
+    iter_record_batches,
+    sniff,
+)
+from app.loader import bulk_upsert, iter_batches, iter_changed
+from app.models import Trainer, Pokemon, Upload
+from app.owners import OwnerIndex, check_owners
+from app.parallel import iter_validated_parallel
+from app.staging import Staging
+from app.validation import SCHEMAS, UNKNOWN_OWNER, fingerprint, validate_rows
+
+MODELS = {"trainer": Trainer, "pokemon": Pokemon}
+# redis db used to stage uploads of each type
+REDIS_DB = {"trainer": 0, "pokemon": 1}
+
+# outcome of an upload, duplicate is True when the same file was already loaded
+Summary = namedtuple("Summary", ["rows_committed", "rows_unchanged", "duplicate"])
+
+
+class UploadError(Exception):
+    """Raised when an upload is rejected, nothing has been written"""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors or []
+
+
+def iter_rows(stream, encoding="utf-8"):
+    """Helper function to lazily parse an uploaded CSV file
+
+    Bytes are decoded incrementally while the file is iterated line by line,
+    so only the current row is held in memory regardless of file size. The
+    header row is skipped.
+    """
+    reader = csv.reader(codecs.iterdecode(stream, encoding))
+    next(reader, None)
+
+    for row in reader:
+        yield row
+
+
+def file_digest(f, block_size=1024 * 1024):
+    """Helper function to hash the content of a file object and rewind it"""
+    digest = hashlib.sha256()
+    for block in iter(lambda: f.read(block_size), b""):
+        digest.update(block)
+    f.seek(0)
+
+    return digest.hexdigest()
+
+
+def to_record(dataType, id, values):
+    """Helper function to map staged values to model columns"""
+    record = dict(zip(SCHEMAS[dataType].columns[1:], values))
+    record["id"] = id
+    record["fingerprint"] = fingerprint(SCHEMAS[dataType], values)
+
+    if dataType == "pokemon":
+        record["history"] = [record["owner"]]
+
+    return record
+
+
+def iter_validated(dataType, rows, batch_size=1000):
+    """Helper function to validate rows, yields a validation.Batch per batch"""
+    schema = SCHEMAS[dataType]
+    start = 1
+
+    for batch in iter_batches(rows, batch_size):
+        yield validate_rows(batch, schema, start)
+        start += len(batch)
+
+
+def ingest(
+    dataType,
+    batches,
+    r,
+    batch_size=1000,
+    ttl=3600,
+    max_errors=100,
+    progress=None,
+    owners=None,
+    digest=None,
+):
+    """Stage and load the validated batches of an upload
+
+    batches yields validation.Batch in file order, see iter_validated().
+    Every row is validated before anything is written to the database, and
+    the whole upload is loaded in one transaction. Rows whose fingerprint
+    matches the one stored in the table are not written again. Raises
+    UploadError with a per-row error report (at most max_errors entries) if
+    the upload is rejected. Returns a Summary.
+
+    progress is called with keyword arguments (rows_validated, status,
+    rows_committed) as the upload moves along. When given an OwnerIndex, the
+    owner of every pokemon row is checked against it. digest, the hash of the
+    file, is recorded along with the rows, see Upload.record().
+    """
+    progress = progress or (lambda **fields: None)
+    errors = []
+    validated = 0
+
+    with Staging(r, ttl, batch_size) as staging:
+        for batch in batches:
+            batch_errors = batch.errors
+            if owners is not None and not batch_errors:
+                batch_errors = check_owners(batch, owners)
+
+            if batch_errors:
+                errors.extend(batch_errors[: max_errors - len(errors)])
+                if len(errors) >= max_errors:
+                    break
+                continue
+
+            # no point staging more rows once the upload is known to be invalid
+            if not errors:
+                staging.add(batch.ids, batch.payloads)
+                validated += batch.size
+                progress(rows_validated=validated)
+
+        if errors:
+            raise UploadError("Input data not valid", errors)
+
+        progress(status="loading")
+        model = MODELS[dataType]
+        staged = len(staging)
+        records = (to_record(dataType, id, values) for id, values in staging)
+
+        try:
+            rows = iter_changed(model, records, batch_size)
+            count = bulk_upsert(model, invalidating(rows, model.cache_keys), batch_size)
+            if digest is not None:
+                Upload.record(dataType, digest, staged)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise UploadError("Unable to save data")
+
+        progress(rows_committed=count, rows_unchanged=staged - count)
+
+    return Summary(count, staged - count, False)
+
+
+def ingest_columnar(dataType, batches, max_errors=100, progress=None, digest=None):
+    """Validate and load the record batches of a Parquet or Arrow upload
+
+    Same contract as ingest(), but batches are validated column-wise and
+    copied into a temporary table without building Python objects per row,
+    then loaded with a single INSERT ... SELECT. Owners are checked with one
+    join against the trainer table once every row is staged.
+    """
+    progress = progress or (lambda **fields: None)
+    schema = SCHEMAS[dataType]
+    errors = []
+    rows = 0
+
+    try:
+        staging = StagingTable(MODELS[dataType], schema)
+
+        for batch in batches:
+            if not rows:
+                errors = missing_columns(batch.schema.names, schema)
+                if errors:
+                    break
+
+            columns, batch_errors = validate_record_batch(batch, schema, rows + 1)
+            rows += batch.num_rows
+
+            if batch_errors:
+                errors.extend(batch_errors[: max_errors - len(errors)])
+                if len(errors) >= max_errors:
+                    break
+                continue
+
+            # no point staging more rows once the upload is known to be invalid
+            if not errors:
+                staging.add(columns)
+                progress(rows_validated=rows)
+
+        if not errors and "owner" in schema.columns:
+            errors = [
+                {"row": row, "column": "owner", "error": UNKNOWN_OWNER}
+                for row in staging.missing_owners(max_errors)
+            ]
+
+        if errors:
+            raise UploadError("Input data not valid", errors)
+
+        progress(status="loading")
+        count, staged = staging.load()
+        # rows are never read back into python, drop the whole cache instead
+        invalidate_all()
+        if digest is not None:
+            Upload.record(dataType, digest, staged)
+        db.session.commit()
+    except UploadError:
+        db.session.rollback()
+        raise
+    except READ_ERRORS:
+        db.session.rollback()
+        raise UploadError("Unable to read file")
+    except Exception:
+        db.session.rollback()
+        raise UploadError("Unable to save data")
+
+    progress(rows_committed=count, rows_unchanged=staged - count)
+
+    return Summary(count, staged - count, False)
+
+
+def ingest_file(dataType, f, workers=1, progress=None):
+    """Validate, stage and load an uploaded file object
+
+    Files are CSV, optionally gzip or zstd compressed, or Parquet or Arrow
+    IPC, detected from their first bytes. Settings are read from the app
+    config. A file identical to the last one loaded for dataType is skipped
+    without being parsed. With more than one worker CSV files are parsed by
+    a process pool, which reads them from disk, so file objects that do not
+    live on disk are copied (and decompressed) to a temporary file first, as
+    are files that cannot be rewound after hashing.
+    """
+    config = current_app.config
+    r = redis.StrictRedis(
+        db=REDIS_DB[dataType], encoding="utf-8", decode_responses=True
+    )
+    batch_size = config["UPLOAD_BATCH_SIZE"]
+    max_errors = config["UPLOAD_MAX_ERRORS"]
+
+    with ExitStack() as stack:
+        path = getattr(f, "name", None)
+        seekable = getattr(f, "seekable", None)
+        if not (seekable and seekable()):
+            f, path = copy_to_disk(stack, f)
+
+        digest = file_digest(f)
+        if Upload.is_loaded(dataType, digest):
+            return Summary(0, 0, True)
+
+        kind = sniff(f)
+        if kind in COLUMNAR:
+            batches = iter_record_batches(kind, f, config["UPLOAD_COLUMNAR_BATCH_SIZE"])
+
+            return ingest_columnar(dataType, batches, max_errors, progress, digest)
+
+        # trainer ids are loaded once so owners are checked without a query per row
+        owners = None
+        if dataType == "pokemon":
+            owners = OwnerIndex.load(config["UPLOAD_OWNER_BLOOM_THRESHOLD"])
+
+        try:
+            if kind in COMPRESSED:
+                f, path = stack.enter_context(decompress(kind, f)), None
+
+            if workers > 1:
+                if not isinstance(path, str):
+                    f, path = copy_to_disk(stack, f)
+
+                batches = iter_validated_parallel(
+                    dataType, path, workers, config["UPLOAD_CHUNK_SIZE"], max_errors
+                )
+            else:
+                batches = iter_validated(dataType, iter_rows(f), batch_size)
+            stack.callback(batches.close)
+
+            summary = ingest(
+                dataType,
+                batches,
+                r,
+                batch_size=batch_size,
+                ttl=config["UPLOAD_STAGING_TTL"],
+                max_errors=max_errors,
+                progress=progress,
+                owners=owners,
+                digest=digest,
+            )
+        except READ_ERRORS:
+            raise UploadError("Unable to read file")
+
+        return summary
+
+
+def copy_to_disk(stack, f):
+    """Helper function to copy a file object to a temporary file
+
+    The file is removed when stack exits. Returns (file, path) rewound.
+    """
+    tmp = stack.enter_context(tempfile.NamedTemporaryFile(suffix=".csv"))
+    shutil.copyfileobj(f, tmp)
+    tmp.seek(0)
+
+    return tmp, tmp.name
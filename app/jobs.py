@@ -0,0 +1,90 @@
+import json
+import os
+import time
+import uuid
+
+from app import db
+from app.ingest import UploadError, ingest_file
+
+
+class Job(object):
+    """This class represents a background upload job.
+
+    The state of a job is kept in a redis hash so that any app worker can
+    report on it, and expires ttl seconds after its last update.
+    """
+
+    def __init__(self, r, id=None, ttl=86400):
+        self.r = r
+        self.id = id or uuid.uuid4().hex
+        self.key = f"job:{self.id}"
+        self.ttl = ttl
+
+    def update(self, **fields):
+        """Record new values for fields of the job"""
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hset(self.key, mapping={k: json.dumps(v) for k, v in fields.items()})
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+
+    def status(self):
+        """Return the state of the job as a dict, None if it does not exist"""
+        fields = self.r.hgetall(self.key)
+        if not fields:
+            return None
+
+        status = {k: json.loads(v) for k, v in fields.items()}
+        status["id"] = self.id
+
+        # throughput while running, or over the whole job once finished
+        started = status.get("started")
+        if started is not None:
+            elapsed = status.get("finished", time.time()) - started
+            status["rows_per_second"] = (
+                round(status.get("rows_validated", 0) / elapsed, 1) if elapsed else 0
+            )
+
+        return status
+
+
+def run_job(app, job, dataType, path, workers=1, chunks=None):
+    """Run an upload job on a file saved at path, deleting it afterwards
+
+    chunks, the ChunkedUpload the file was assembled from, is removed once
+    the file is loaded and kept for another try otherwise. Meant to be
+    submitted to a background executor.
+    """
+    with app.app_context():
+        job.update(status="running", started=time.time())
+
+        try:
+            with open(path, "rb") as f:
+                summary = ingest_file(dataType, f, workers, progress=job.update)
+        except UploadError as e:
+            job.update(
+                status="failed",
+                success=False,
+                error=e.message,
+                errors=e.errors,
+                finished=time.time(),
+            )
+        except Exception:
+            app.logger.exception("Upload job %s failed", job.id)
+            job.update(
+                status="failed",
+                success=False,
+                error="Unable to process upload",
+                finished=time.time(),
+            )
+        else:
+            job.update(
+                status="done",
+                success=True,
+                finished=time.time(),
+                **summary._asdict(),
+            )
+            if chunks is not None:
+                chunks.remove()
+        finally:
+            db.session.remove()
+            os.remove(path)
@@ -0,0 +1,70 @@
+from itertools import islice
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db
+
+
+def iter_batches(rows, batch_size):
+    """Helper function to split an iterable of rows into lists of batch_size"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def bulk_upsert(model, rows, batch_size=1000):
+    """Insert or update rows of model in batches
+
+    Each batch is sent as a single multi-row INSERT ... ON CONFLICT (id) DO
+    UPDATE, which gives the same semantics as calling save() on every row.
+    Nothing is committed here so that the caller can load a whole upload in
+    one transaction. Returns the number of rows written.
+    """
+    table = model.__table__
+    excluded = insert(table).excluded
+    updates = {
+        column.name: excluded[column.name]
+        for column in table.columns
+        if not column.primary_key
+    }
+
+    count = 0
+    for batch in iter_batches(rows, batch_size):
+        # a row may only be affected once per statement, last one wins
+        batch = list({row["id"]: row for row in batch}.values())
+        # the rows go in the VALUES of the statement, executemany() would
+        # send one statement per row and fire statement triggers as often
+        stmt = insert(table).values(batch)
+        db.session.execute(
+            stmt.on_conflict_do_update(index_elements=[table.c.id], set_=updates)
+        )
+        count += len(batch)
+
+    return count
+
+
+def iter_changed(model, rows, batch_size=1000):
+    """Helper function to skip rows whose fingerprint is already in the table
+
+    Stored fingerprints are read back for batch_size ids at a time, so rows
+    that are new or changed since they were last loaded are the only ones
+    left to write.
+    """
+    table = model.__table__
+
+    for batch in iter_batches(rows, batch_size):
+        stored = dict(
+            db.session.execute(
+                select(table.c.id, table.c.fingerprint).where(
+                    table.c.id.in_([row["id"] for row in batch])
+                )
+            ).all()
+        )
+
+        for row in batch:
+            if row["id"] not in stored or stored[row["id"]] != row["fingerprint"]:
+                yield row
@@ -1,6 +1,30 @@
+from sqlalchemy import DDL, any_, bindparam, case, event, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy.orm import joinedload, load_only, selectinload
 
 from app import db
+from app.cache import invalidate, invalidating
+from app.loader import bulk_upsert
+
+# trainer deletes cascade to their pokemons
+TYPES = ("trainer", "pokemon")
+# ways to load the pokemons of trainers along with them: "joined" in the same
+# query, best for one trainer, or "selectin" in one more query for all of them
+LOADERS = {"joined": joinedload, "selectin": selectinload}
+
+
+def only(query, model, columns):
+    """Helper function to load only columns of model, None loads them all"""
+    if columns is None:
+        return query
+
+    return query.options(load_only(*(getattr(model, name) for name in columns)))
+
+
+def any_ids(ids):
+    """Helper function to bind a list of ids as a single array parameter"""
+    return bindparam("ids", list(ids), type_=ARRAY(db.String))
 
 
 class Trainer(db.Model):
@@ -12,6 +36,16 @@ class Trainer(db.Model):
     firstName = db.Column(db.String(255))
     lastName = db.Column(db.String(255))
     dateOfBirth = db.Column(db.Date)
+    # hash of the values last loaded by an upload, cleared by any other write
+    fingerprint = db.Column(db.String(32))
+    # the database deletes them along with the trainer
+    pokemons = db.relationship(
+        "Pokemon",
+        back_populates="trainer",
+        order_by="Pokemon.id",
+        cascade="all, delete",
+        passive_deletes=True,
+    )
 
     def __init__(self, id, firstName, lastName, dateOfBirth):
         """Initialize with trainer details"""
@@ -20,32 +54,123 @@ class Trainer(db.Model):
         self.lastName = lastName
         self.dateOfBirth = dateOfBirth
 
+    def to_dict(self):
+        return {column.name: getattr(self, column.name) for column in self.__table__.c}
+
     def save(self):
-        # check if row exists
-        # if exists, update. else, insert
-        exists = (
-            db.session.query(Trainer).filter(Trainer.id == self.id).first() is not None
-        )
-
-        if exists:
-            trainer = db.session.query(Trainer).filter(Trainer.id == self.id).one()
-            trainer.firstName = self.firstName
-            trainer.lastName = self.lastName
-            trainer.dateOfBirth = self.dateOfBirth
-        else:
-            db.session.add(self)
+        # insert, or update if the row exists, in a single statement
+        Trainer.upsert([self])
+
+    @staticmethod
+    def cache_keys(row):
+        """Return the cache entries a write of row invalidates"""
+        return (f"trainer:{row['id']}",)
+
+    @staticmethod
+    def upsert(trainers, batch_size=1000):
+        """Insert or update trainers (instances or dicts) and commit
+
+        Trainers are sent as multi-row INSERT ... ON CONFLICT (id) DO UPDATE
+        statements of batch_size rows. Returns the number of rows written.
+        """
+        rows = (t.to_dict() if isinstance(t, Trainer) else t for t in trainers)
+        count = bulk_upsert(Trainer, invalidating(rows, Trainer.cache_keys), batch_size)
+        db.session.commit()
+
+        return count
+
+    @staticmethod
+    def update(id, **fields):
+        """Update fields of a trainer in a single statement
+
+        Returns False if the trainer does not exist.
+        """
+        if not fields:
+            return Trainer.get_trainer(id) is not None
+
+        result = db.session.execute(
+            Trainer.__table__.update()
+            .where(Trainer.id == id)
+            .values(fingerprint=None, **fields)
+        )
+        invalidate(f"trainer:{id}")
         db.session.commit()
 
+        return result.rowcount > 0
+
     @staticmethod
     def get_all():
         return Trainer.query.order_by(Trainer.id).all()
 
     @staticmethod
-    def get_trainer(id):
-        return Trainer.query.filter(Trainer.id == id).first()
+    def get_page(
+        limit,
+        after=None,
+        offset=0,
+        pokemons=None,
+        columns=None,
+        filters=(),
+        pokemon_columns=None,
+    ):
+        """Return at most limit trainers matching filters in id order
+
+        Starts after the id after, or skips offset trainers. pokemons is the
+        LOADERS strategy of their pokemons, which are loaded lazily if None.
+        Only columns are loaded if given, plus the id, and only pokemon_columns
+        of the pokemons.
+        """
+        query = Trainer.with_pokemons(pokemons, pokemon_columns)
+        query = only(query, Trainer, columns)
+        query = query.filter(*filters)
+        if after is not None:
+            query = query.filter(Trainer.id > after)
+
+        return query.order_by(Trainer.id).offset(offset).limit(limit).all()
+
+    @staticmethod
+    def count(filters=()):
+        return db.session.query(func.count(Trainer.id)).filter(*filters).scalar()
+
+    @staticmethod
+    def get_trainer(id, pokemons=None, pokemon_columns=None):
+        return (
+            Trainer.with_pokemons(pokemons, pokemon_columns)
+            .filter(Trainer.id == id)
+            .first()
+        )
+
+    @staticmethod
+    def get_trainers(ids, pokemons=None, pokemon_columns=None):
+        """Return the trainers among ids, in no particular order
+
+        ids are sent as one array parameter, WHERE id = ANY(:ids), so the
+        statement is the same however many there are.
+        """
+        return (
+            Trainer.with_pokemons(pokemons, pokemon_columns)
+            .filter(Trainer.id == any_(any_ids(ids)))
+            .all()
+        )
+
+    @staticmethod
+    def with_pokemons(strategy=None, columns=None):
+        """Return a trainer query loading pokemons with a LOADERS strategy
+
+        Only columns of the pokemons are loaded if given, plus the id.
+        """
+        if strategy is None:
+            return Trainer.query
+
+        loader = LOADERS[strategy](Trainer.pokemons)
+        if columns is not None:
+            loader = loader.load_only(*(getattr(Pokemon, name) for name in columns))
+
+        return Trainer.query.options(loader)
 
     def delete(self):
         db.session.delete(self)
+        # cached pokemons of the trainer depend on it and go too
+        invalidate(f"trainer:{self.id}")
         db.session.commit()
 
     def __repr__(self):
@@ -56,6 +181,13 @@ class Pokemon(db.Model):
     """This class represents the pokemon table."""
 
     __tablename__ = "pokemon"
+    # see Pokemon.filters(), created for existing tables by a migration
+    __table_args__ = (
+        db.Index("ix_pokemon_owner_id", "owner", "id"),
+        db.Index("ix_pokemon_species_id", "species", "id"),
+        db.Index("ix_pokemon_level_id", "level", "id"),
+        db.Index("ix_pokemon_dateOfOwnership_id", "dateOfOwnership", "id"),
+    )
 
     id = db.Column(db.String(255), primary_key=True)
     nickname = db.Column(db.String(255))
@@ -64,6 +196,9 @@ class Pokemon(db.Model):
     owner = db.Column(db.String(255), db.ForeignKey("trainer.id", ondelete="CASCADE"))
     dateOfOwnership = db.Column(db.Date)
     history = db.Column(MutableList.as_mutable(db.ARRAY(db.String)))
+    # hash of the values last loaded by an upload, cleared by any other write
+    fingerprint = db.Column(db.String(32))
+    trainer = db.relationship("Trainer", back_populates="pokemons")
 
     def __init__(self, id, nickname, species, level, owner, dateOfOwnership, history):
         """initialize with pokemon details."""
@@ -75,40 +210,519 @@ class Pokemon(db.Model):
         self.dateOfOwnership = dateOfOwnership
         self.history = history
 
+    def to_dict(self):
+        return {column.name: getattr(self, column.name) for column in self.__table__.c}
+
     def save(self):
-        # check if row exists
-        # if exists, update. else, insert
-        exists = (
-            db.session.query(Pokemon).filter(Pokemon.id == self.id).first() is not None
-        )
-
-        if exists:
-            pokemon = db.session.query(Pokemon).filter(Pokemon.id == self.id).one()
-            pokemon.nickname = self.nickname
-            pokemon.species = self.species
-            pokemon.level = self.level
-            pokemon.owner = self.owner
-            pokemon.dateOfOwnership = self.dateOfOwnership
-            pokemon.history = self.history
-        else:
-            db.session.add(self)
+        # insert, or update if the row exists, in a single statement
+        Pokemon.upsert([self])
+
+    @staticmethod
+    def cache_keys(row):
+        """Return the cache entries a write of row invalidates"""
+        return (f"pokemon:{row['id']}", f"trainer:{row['owner']}")
+
+    @staticmethod
+    def upsert(pokemons, batch_size=1000):
+        """Insert or update pokemons (instances or dicts) and commit
+
+        Pokemons are sent as multi-row INSERT ... ON CONFLICT (id) DO UPDATE
+        statements of batch_size rows. Returns the number of rows written.
+        """
+        rows = (p.to_dict() if isinstance(p, Pokemon) else p for p in pokemons)
+        count = bulk_upsert(Pokemon, invalidating(rows, Pokemon.cache_keys), batch_size)
+        db.session.commit()
+
+        return count
+
+    @staticmethod
+    def update(id, **fields):
+        """Update fields of a pokemon in a single statement
+
+        Returns False if the pokemon does not exist.
+        """
+        if not fields:
+            return Pokemon.get_pokemon(id) is not None
+
+        result = db.session.execute(
+            Pokemon.__table__.update()
+            .where(Pokemon.id == id)
+            .values(fingerprint=None, **fields)
+        )
+        invalidate(f"pokemon:{id}")
+        if "owner" in fields:
+            # the old owner depends on the pokemon, the new one does not yet
+            invalidate(f"trainer:{fields['owner']}")
         db.session.commit()
 
+        return result.rowcount > 0
+
+    @staticmethod
+    def exchange(trainerA, pokemonsA, trainerB, pokemonsB):
+        """Swap the owners of two lists of pokemons in a single statement
+
+        pokemonsA go to trainerB and pokemonsB go to trainerA, and the new
+        owner is appended to the history of each pokemon. Nothing is changed
+        and False is returned unless every pokemon exists.
+        """
+        ids = sorted(set(pokemonsA) | set(pokemonsB))
+        owner = case((Pokemon.id.in_(pokemonsA), trainerB), else_=trainerA)
+
+        result = db.session.execute(
+            Pokemon.__table__.update()
+            .where(Pokemon.id.in_(ids))
+            .values(
+                owner=owner,
+                history=func.array_append(Pokemon.history, owner),
+                fingerprint=None,
+            )
+        )
+
+        if result.rowcount != len(ids):
+            db.session.rollback()
+            return False
+
+        # trainers that cached the pokemons they lost depend on them
+        invalidate(
+            *(f"pokemon:{id}" for id in ids),
+            f"trainer:{trainerA}",
+            f"trainer:{trainerB}",
+        )
+        db.session.commit()
+
+        return True
+
     @staticmethod
     def get_all():
         return Pokemon.query.order_by(Pokemon.id).all()
 
+    @staticmethod
+    def get_page(limit, after=None, offset=0, columns=None, filters=()):
+        """Return at most limit pokemons matching filters in id order
+
+        Starts after the id after, or skips offset pokemons. Only columns are
+        loaded if given, plus the id. See Pokemon.filters().
+        """
+        query = only(Pokemon.query, Pokemon, columns).filter(*filters)
+        if after is not None:
+            query = query.filter(Pokemon.id > after)
+
+        return query.order_by(Pokemon.id).offset(offset).limit(limit).all()
+
+    @staticmethod
+    def count(filters=()):
+        return db.session.query(func.count(Pokemon.id)).filter(*filters).scalar()
+
+    @staticmethod
+    def filters(
+        species=None,
+        levelMin=None,
+        levelMax=None,
+        owner=None,
+        ownedFrom=None,
+        ownedTo=None,
+    ):
+        """Return the criteria selecting pokemons, None leaves a field unfiltered
+
+        Each of them is backed by one of the indexes of the table, which also
+        end with the id so pages of a species or an owner are read in order.
+        """
+        filters = []
+        if species is not None:
+            filters.append(Pokemon.species == species)
+        if levelMin is not None:
+            filters.append(Pokemon.level >= levelMin)
+        if levelMax is not None:
+            filters.append(Pokemon.level <= levelMax)
+        if owner is not None:
+            filters.append(Pokemon.owner == owner)
+        if ownedFrom is not None:
+            filters.append(Pokemon.dateOfOwnership >= ownedFrom)
+        if ownedTo is not None:
+            filters.append(Pokemon.dateOfOwnership <= ownedTo)
+
+        return filters
+
     @staticmethod
     def get_trainer(id):
         return Pokemon.query.filter(Pokemon.owner == id).all()
 
     @staticmethod
-    def get_pokemon(id):
-        return Pokemon.query.filter(Pokemon.id == id).first()
+    def get_pokemon(id, columns=None):
+        """Return the pokemon id, only columns are loaded if given"""
+        return only(Pokemon.query, Pokemon, columns).filter(Pokemon.id == id).first()
+
+    @staticmethod
+    def get_pokemons(ids, columns=None):
+        """Return the pokemons among ids in one query, see Trainer.get_trainers()
+
+        Only columns are loaded if given, plus the id.
+        """
+        query = only(Pokemon.query, Pokemon, columns)
+
+        return query.filter(Pokemon.id == any_(any_ids(ids))).all()
 
     def delete(self):
         db.session.delete(self)
+        invalidate(f"pokemon:{self.id}")
         db.session.commit()
 
     def __repr__(self):
         return "".format(self.id)
+
+
+class Upload(db.Model):
+    """This class represents the last file loaded by an upload of each type.
+
+    The record keeps the version of the table as the load committed, see
+    TableVersion, so while the hash and the version both match the table was
+    not written to since and uploading the file again would not change
+    anything. Other writes do not have to touch the record.
+    """
+
+    __tablename__ = "upload"
+
+    type = db.Column(db.String(255), primary_key=True)
+    hash = db.Column(db.String(64), nullable=False)
+    rows = db.Column(db.Integer)
+    version = db.Column(db.BigInteger)
+    created = db.Column(db.DateTime, server_default=func.now())
+
+    @staticmethod
+    def table_version(dataType):
+        return (
+            select(TableVersion.version)
+            .where(TableVersion.name == dataType)
+            .scalar_subquery()
+        )
+
+    @staticmethod
+    def is_loaded(dataType, hash):
+        """Return True if hash was loaded last and the table is unchanged since"""
+        query = Upload.query.filter_by(type=dataType, hash=hash).filter(
+            Upload.version == Upload.table_version(dataType)
+        )
+
+        return query.count() > 0
+
+    @staticmethod
+    def record(dataType, hash, rows):
+        """Remember hash as the last file loaded for dataType
+
+        Meant to run in the transaction of the load, after its writes, so the
+        version read is the one the load commits. Nothing is committed here.
+        """
+        version = Upload.table_version(dataType)
+        stmt = insert(Upload.__table__).values(
+            type=dataType, hash=hash, rows=rows, version=version
+        )
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Upload.type],
+                set_={
+                    "hash": hash,
+                    "rows": rows,
+                    "version": version,
+                    "created": func.now(),
+                },
+            )
+        )
+
+
+class TableVersion(db.Model):
+    """This class represents the change sequence of the trainer and pokemon tables.
+
+    version is bumped by a statement level trigger on every write to the
+    table, including the cascade of trainer deletes to their pokemons and
+    writes from outside the app, in the transaction of the write.
+    """
+
+    __tablename__ = "table_version"
+
+    name = db.Column(db.String(255), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, server_default="0")
+    modified = db.Column(
+        db.DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+    @staticmethod
+    def get(*names):
+        """Return {name: (version, modified)} of tables names in one query"""
+        rows = TableVersion.query.filter(TableVersion.name.in_(names)).all()
+
+        return {row.name: (row.version, row.modified) for row in rows}
+
+
+class PokemonRollup(db.Model):
+    """This class represents running totals of pokemons by owner, by species and overall.
+
+    Rows are kept up to date by statement level triggers from the rows each
+    write adds and removes, in the transaction of the write, so reading them
+    is a primary key lookup however many pokemons there are. dimension is
+    "owner", "species" or "all", whose single row has an empty key.
+    """
+
+    __tablename__ = "pokemon_rollup"
+
+    dimension = db.Column(db.String(16), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    pokemons = db.Column(db.BigInteger, nullable=False, default=0)
+    # pokemons with a level, and the sum and highest of their levels
+    levels = db.Column(db.BigInteger, nullable=False, default=0)
+    levelSum = db.Column(db.BigInteger, nullable=False, default=0)
+    maxLevel = db.Column(db.Integer)
+
+    @property
+    def averageLevel(self):
+        return self.levelSum / self.levels if self.levels else None
+
+    @staticmethod
+    def get(dimension, key=""):
+        """Return the rollup of key, an empty one if there is no row for it"""
+        rollup = PokemonRollup.query.get((dimension, key))
+        if rollup is None:
+            rollup = PokemonRollup(
+                dimension=dimension, key=key, pokemons=0, levels=0, levelSum=0
+            )
+
+        return rollup
+
+    @staticmethod
+    def get_species():
+        """Return the rollups of every species, most common first"""
+        return (
+            PokemonRollup.query.filter(PokemonRollup.dimension == "species")
+            .order_by(PokemonRollup.pokemons.desc(), PokemonRollup.key)
+            .all()
+        )
+
+
+class TeamSize(db.Model):
+    """This class represents the number of trainers owning each number of pokemons.
+
+    Maintained by the triggers of PokemonRollup from the team size of the
+    trainers each write touches, trainers without pokemons count in size 0.
+    """
+
+    __tablename__ = "team_size"
+
+    size = db.Column(db.Integer, primary_key=True)
+    trainers = db.Column(db.BigInteger, nullable=False)
+
+    @staticmethod
+    def get_all():
+        return TeamSize.query.order_by(TeamSize.size).all()
+
+
+# run by `db.create_all()`, existing databases get it from a migration
+event.listen(
+    db.Model.metadata,
+    "after_create",
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE table_version SET version = version + 1, modified = now()
+            WHERE name = TG_TABLE_NAME;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+        + "".join(
+            f"""
+            INSERT INTO table_version (name) VALUES ('{name}')
+            ON CONFLICT DO NOTHING;
+            DROP TRIGGER IF EXISTS {name}_version ON {name};
+            CREATE TRIGGER {name}_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {name}
+            FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version();
+            """
+            for name in TYPES
+        )
+    ).execute_if(dialect="postgresql"),
+)
+
+
+# the rows a statement wrote to the pokemon table, with n = 1 for rows added
+# and -1 for rows removed, from the transition tables of the triggers
+ROLLUP_DELTAS = {
+    "insert": "SELECT owner, species, level, 1 AS n FROM new_rows",
+    "update": """
+        SELECT owner, species, level, 1 AS n FROM new_rows
+        UNION ALL SELECT owner, species, level, -1 FROM old_rows
+    """,
+    "delete": "SELECT owner, species, level, -1 AS n FROM old_rows",
+}
+# the delta grouped by owner, by species and overall, see PokemonRollup
+ROLLUP_GROUPS = """
+    SELECT
+        CASE WHEN grouping(owner) = 0 THEN 'owner'
+             WHEN grouping(species) = 0 THEN 'species' ELSE 'all' END AS dimension,
+        CASE WHEN grouping(owner) = 0 THEN owner
+             WHEN grouping(species) = 0 THEN species ELSE '' END AS key,
+        sum(n) AS pokemons,
+        coalesce(sum(n) FILTER (WHERE level IS NOT NULL), 0) AS levels,
+        coalesce(sum(n * level), 0) AS "levelSum",
+        max(level) FILTER (WHERE n > 0) AS added,
+        max(level) FILTER (WHERE n < 0) AS removed
+    FROM delta GROUP BY GROUPING SETS ((owner), (species), ())
+"""
+
+
+def rollup_function(op):
+    """Helper function to build the trigger function of pokemon writes of op"""
+    rows = "new_rows" if op == "insert" else "old_rows"
+    statements = [
+        f"""
+        PERFORM 1 FROM {rows} LIMIT 1;
+        IF NOT FOUND THEN
+            RETURN NULL;
+        END IF;
+
+        -- trainers whose team changes size, read before their count changes
+        WITH delta AS ({{delta}}),
+        changed AS (
+            SELECT owner, sum(n) AS n FROM delta
+            WHERE owner IN (SELECT id FROM trainer) GROUP BY owner
+            HAVING sum(n) <> 0
+        ),
+        sizes AS (
+            SELECT coalesce(r.pokemons, 0) AS size, c.n FROM changed c
+            LEFT JOIN pokemon_rollup r ON r.dimension = 'owner' AND r.key = c.owner
+        ),
+        moves AS (
+            SELECT size, -1 AS trainers FROM sizes
+            UNION ALL SELECT size + n, 1 FROM sizes
+        )
+        INSERT INTO team_size (size, trainers)
+        SELECT size, sum(trainers) FROM moves
+        GROUP BY size HAVING sum(trainers) <> 0
+        ON CONFLICT (size) DO UPDATE
+        SET trainers = team_size.trainers + excluded.trainers;
+        DELETE FROM team_size WHERE trainers = 0;
+
+        WITH delta AS ({{delta}})
+        INSERT INTO pokemon_rollup
+            (dimension, key, pokemons, levels, "levelSum", "maxLevel")
+        SELECT dimension, key, pokemons, levels, "levelSum", added
+        FROM ({ROLLUP_GROUPS}) grouped
+        WHERE key IS NOT NULL AND pokemons IS NOT NULL
+        AND (dimension <> 'owner' OR key IN (SELECT id FROM trainer))
+        ON CONFLICT (dimension, key) DO UPDATE SET
+            pokemons = pokemon_rollup.pokemons + excluded.pokemons,
+            levels = pokemon_rollup.levels + excluded.levels,
+            "levelSum" = pokemon_rollup."levelSum" + excluded."levelSum",
+            "maxLevel" = greatest(pokemon_rollup."maxLevel", excluded."maxLevel");
+        """
+    ]
+    if op != "insert":
+        # only a removed highest level not matched by an added one is looked
+        # up again, through the index of the dimension
+        statements.append(
+            f"""
+            WITH delta AS ({{delta}})
+            UPDATE pokemon_rollup r SET "maxLevel" = CASE r.dimension
+                WHEN 'owner' THEN (SELECT max(level) FROM pokemon WHERE owner = r.key)
+                WHEN 'species' THEN (SELECT max(level) FROM pokemon WHERE species = r.key)
+                ELSE (SELECT max(level) FROM pokemon) END
+            FROM ({ROLLUP_GROUPS}) grouped
+            WHERE r.dimension = grouped.dimension AND r.key = grouped.key
+            AND grouped.removed >= r."maxLevel"
+            AND (grouped.added IS NULL OR grouped.added < grouped.removed);
+
+            DELETE FROM pokemon_rollup WHERE dimension = 'species'
+            AND pokemons = 0 AND key IN (SELECT species FROM old_rows);
+            """
+        )
+
+    body = "".join(statements).format(delta=ROLLUP_DELTAS[op])
+
+    return f"""
+        CREATE OR REPLACE FUNCTION pokemon_rollup_{op}() RETURNS trigger AS $$
+        BEGIN
+            {body}
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+
+
+ROLLUP_DDL = (
+    "".join(rollup_function(op) for op in ROLLUP_DELTAS)
+    + """
+    CREATE OR REPLACE FUNCTION pokemon_rollup_truncate() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM pokemon_rollup;
+        DELETE FROM team_size;
+        INSERT INTO team_size (size, trainers)
+        SELECT 0, count(*) FROM trainer HAVING count(*) > 0;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION trainer_rollup_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO team_size (size, trainers)
+        SELECT 0, count(*) FROM new_rows HAVING count(*) > 0
+        ON CONFLICT (size) DO UPDATE
+        SET trainers = team_size.trainers + excluded.trainers;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- the cascade of the foreign key deletes the pokemons of the trainers
+    -- after this runs, their owners are left alone then
+    CREATE OR REPLACE FUNCTION trainer_rollup_delete() RETURNS trigger AS $$
+    BEGIN
+        WITH sizes AS (
+            SELECT coalesce(r.pokemons, 0) AS size, count(*) AS trainers
+            FROM old_rows t
+            LEFT JOIN pokemon_rollup r ON r.dimension = 'owner' AND r.key = t.id
+            GROUP BY 1
+        )
+        UPDATE team_size SET trainers = team_size.trainers - sizes.trainers
+        FROM sizes WHERE team_size.size = sizes.size;
+        DELETE FROM team_size WHERE trainers = 0;
+        DELETE FROM pokemon_rollup
+        WHERE dimension = 'owner' AND key IN (SELECT id FROM old_rows);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION trainer_rollup_truncate() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM pokemon_rollup;
+        DELETE FROM team_size;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+    + "".join(
+        f"""
+        DROP TRIGGER IF EXISTS {table}_rollup_{op} ON {table};
+        CREATE TRIGGER {table}_rollup_{op} AFTER {op.upper()} ON {table}
+        {transition}
+        FOR EACH STATEMENT EXECUTE PROCEDURE {table}_rollup_{op}();
+        """
+        for table, op, transition in (
+            ("pokemon", "insert", "REFERENCING NEW TABLE AS new_rows"),
+            (
+                "pokemon",
+                "update",
+                "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+            ),
+            ("pokemon", "delete", "REFERENCING OLD TABLE AS old_rows"),
+            ("pokemon", "truncate", ""),
+            ("trainer", "insert", "REFERENCING NEW TABLE AS new_rows"),
+            ("trainer", "delete", "REFERENCING OLD TABLE AS old_rows"),
+            ("trainer", "truncate", ""),
+        )
+    )
+)
+
+# run by `db.create_all()`, existing databases get it from a migration
+event.listen(
+    db.Model.metadata,
+    "after_create",
+    DDL(ROLLUP_DDL).execute_if(dialect="postgresql"),
+)
@@ -0,0 +1,73 @@
+import math
+
+from app import db
+from app.models import Trainer
+from app.validation import UNKNOWN_OWNER
+
+
+class BloomFilter(object):
+    """This class represents a fixed size Bloom filter of strings.
+
+    Lookups never miss an added key, but may report a key that was never
+    added with a probability of about error_rate. Hashes are derived from
+    hash(), so a filter is only meaningful inside the process that built it.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2) + 1
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        # double hashing, the two halves of hash() act as independent hashes
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(key)
+        )
+
+
+class OwnerIndex(object):
+    """This class represents the trainer ids pokemon uploads may refer to.
+
+    Ids are held in a set, or in a Bloom filter once there are more than
+    bloom_threshold trainers. The odd owner a Bloom filter lets through is
+    still rejected by the foreign key when the upload is loaded, which rolls
+    back the whole upload.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    @staticmethod
+    def load(bloom_threshold=5_000_000, batch_size=10000):
+        """Read every trainer id from the database into a new index"""
+        query = db.session.query(Trainer.id)
+        count = query.count()
+
+        ids = BloomFilter(count) if count > bloom_threshold else set()
+        for (id,) in query.yield_per(batch_size):
+            ids.add(id)
+
+        return OwnerIndex(ids)
+
+    def __contains__(self, id):
+        return id in self.ids
+
+
+def check_owners(batch, owners):
+    """Helper function to report the rows of a batch whose owner is unknown"""
+    return [
+        {"row": batch.start + index, "column": "owner", "error": UNKNOWN_OWNER}
+        for index, owner in enumerate(batch.owners)
+        if owner not in owners
+    ]
@@ -0,0 +1,49 @@
+import base64
+import binascii
+
+
+def encode_cursor(id):
+    """Helper function to build the opaque cursor of the page after id"""
+    return base64.urlsafe_b64encode(id.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Helper function to read the id back from a cursor, raises ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        id = base64.b64decode(padded.encode("ascii"), altchars=b"-_", validate=True)
+        return id.decode("utf-8")
+    except (binascii.Error, UnicodeError):
+        raise ValueError(f"Invalid cursor {cursor}")
+
+
+def paginate(model, args, max_limit=1000, filters=(), **options):
+    """Helper function to fetch the page of model asked for in request args
+
+    Rows are read in id order with LIMIT. A cursor from a previous page turns
+    into WHERE id > last id, which costs the same at any depth. page and
+    limit are still accepted and use OFFSET, plus a COUNT for total_page.
+    Returns (rows, fields) where fields is the paging part of the response,
+    including the cursor of the next page. Raises ValueError on an invalid
+    cursor. Only rows matching the criteria filters are paged through, and
+    options are passed on to model.get_page().
+    """
+    limit = min(max(args.get("limit", default=5, type=int), 1), max_limit)
+    cursor = args.get("cursor", default=None, type=str)
+
+    if cursor is not None:
+        # one extra row tells whether there is a next page
+        rows = model.get_page(
+            limit + 1, after=decode_cursor(cursor), filters=filters, **options
+        )
+        fields = {}
+    else:
+        page = max(args.get("page", default=1, type=int), 1)
+        rows = model.get_page(
+            limit + 1, offset=(page - 1) * limit, filters=filters, **options
+        )
+        fields = {"page": page, "total_page": -(-model.count(filters) // limit)}
+
+    fields["next"] = encode_cursor(rows[limit - 1].id) if len(rows) > limit else None
+
+    return rows[:limit], fields
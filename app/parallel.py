@@ -0,0 +1,79 @@
+import csv
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from app.validation import SCHEMAS, validate_rows
+
+
+def chunk_ranges(path, chunk_size):
+    """Helper function to split a CSV file into byte ranges of whole lines
+
+    The header line is left out. Ranges are roughly chunk_size bytes long and
+    always start and end on a line boundary, which means quoted fields must
+    not contain line breaks when a file is parsed in parallel.
+    """
+    size = os.path.getsize(path)
+    ranges = []
+
+    with open(path, "rb") as f:
+        f.readline()
+        start = f.tell()
+
+        while start < size:
+            f.seek(start + chunk_size)
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def parse_range(path, start, end, dataType, max_errors):
+    """Parse and validate one byte range of a CSV file
+
+    Runs in a worker process. Returns a validation.Batch numbered from the
+    start of the range. Rows go back to the parent as flat lists of strings,
+    which are much cheaper to pickle than one list per row.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+
+    rows = list(csv.reader(io.StringIO(text, newline="")))
+    batch = validate_rows(rows, SCHEMAS[dataType])
+
+    return batch._replace(errors=batch.errors[:max_errors])
+
+
+def iter_validated_parallel(dataType, path, workers, chunk_size, max_errors=100):
+    """Validate a CSV file on disk in a pool of worker processes
+
+    Yields validation.Batch in file order like ingest.iter_validated(), with
+    one batch per byte range. At most 2 ranges per worker are in flight at
+    any time so memory stays bounded for large files.
+    """
+    ranges = deque(chunk_ranges(path, chunk_size))
+    pending = deque()
+    start = 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            while ranges or pending:
+                while ranges and len(pending) < 2 * workers:
+                    begin, end = ranges.popleft()
+                    pending.append(
+                        pool.submit(parse_range, path, begin, end, dataType, max_errors)
+                    )
+
+                batch = pending.popleft().result()
+                for error in batch.errors:
+                    error["row"] += start - 1
+
+                yield batch._replace(start=start)
+                start += batch.size
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,158 @@
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, orm, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+# set on responses to writes, reads of the client stay on the primary until
+# the time it holds so that they see their own writes
+PRIMARY_COOKIE = "read-primary-until"
+# seconds a replica is behind the primary, 0 once it replayed all it received
+LAG = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+        OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+    """
+)
+
+
+class RoutingSession(SignallingSession):
+    """This class represents a session reading from a replica when given one.
+
+    While info["replica"] holds an engine, see ReplicaPool.pick(), the
+    statements that only read are sent to it. Flushes and INSERT, UPDATE and
+    DELETE statements stay on the primary. The session is dropped at the end
+    of each request, and the replica with it.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get("replica")
+        if (
+            replica is not None
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+        ):
+            return replica
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """This class represents the Flask-SQLAlchemy extension with RoutingSession"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@contextmanager
+def use_primary(session):
+    """Context manager sending every statement of session to the primary"""
+    replica = session.info.pop("replica", None)
+    try:
+        yield session
+    finally:
+        if replica is not None:
+            session.info["replica"] = replica
+
+
+class ReplicaPool(object):
+    """This class represents the read replicas reads are spread over.
+
+    pick() hands out the replicas in turn, skipping those that failed their
+    last health check: a replica has to answer and be at most max_lag seconds
+    behind the primary. Replicas are checked every check_interval seconds by
+    a background thread, see start(), so requests only read the last result
+    and never wait on a replica that is down. Replicas are unhealthy until
+    their first check, and pick() returns None when none is healthy.
+    """
+
+    def __init__(self, engines, check_interval=5, max_lag=2):
+        self.engines = list(engines)
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.healthy = [False] * len(self.engines)
+        self.turns = itertools.count()
+        # set once every replica was checked, see refresh()
+        self.checked = threading.Event()
+        self.stopped = threading.Event()
+        self.checker = None
+
+    @staticmethod
+    def from_urls(urls, connect_timeout=2, **options):
+        """Return a pool of new engines for urls, see ReplicaPool()"""
+        engines = [
+            create_engine(
+                url,
+                pool_pre_ping=True,
+                connect_args={"connect_timeout": connect_timeout},
+            )
+            for url in urls
+        ]
+
+        return ReplicaPool(engines, **options)
+
+    def pick(self):
+        """Return the engine of the next healthy replica, None if there is none"""
+        healthy = self.healthy
+        for _ in range(len(self.engines)):
+            index = next(self.turns) % len(self.engines)
+            if healthy[index]:
+                return self.engines[index]
+
+        return None
+
+    def start(self):
+        """Start checking the replicas from a daemon thread, see refresh()"""
+        if not self.engines or self.checker is not None:
+            return
+
+        self.checker = threading.Thread(
+            target=self._watch, name="replicas", daemon=True
+        )
+        self.checker.start()
+
+    def close(self):
+        """Stop checking the replicas, see start()
+
+        The thread exits after its current check or wait.
+        """
+        self.stopped.set()
+
+    def _watch(self):
+        while not self.stopped.is_set():
+            self.refresh()
+            self.stopped.wait(self.check_interval)
+
+    def refresh(self):
+        """Check every replica now and publish the results at once"""
+        self.healthy = [self.check(engine) for engine in self.engines]
+        self.checked.set()
+
+    def check(self, engine):
+        """Return True if the replica of engine answers and is not lagging"""
+        try:
+            with engine.connect() as conn:
+                lag = conn.execute(LAG).scalar()
+        except SQLAlchemyError as e:
+            logger.warning("replica %s is unavailable: %s", engine.url, e)
+            return False
+
+        if lag is None or lag > self.max_lag:
+            logger.warning("replica %s is %s seconds behind", engine.url, lag)
+            return False
+
+        return True
+
+    def dispose(self):
+        self.close()
+        for engine in self.engines:
+            engine.dispose()
@@ -0,0 +1,294 @@
+import heapq
+import re
+import threading
+from collections import Counter, defaultdict, namedtuple
+
+from sqlalchemy import String, any_, case, func, literal, or_, select, text, union_all
+from sqlalchemy.orm import load_only
+
+from app import db
+from app.models import Pokemon, Trainer, any_ids
+from app.replicas import use_primary
+
+# text searched in each type, in order of preference on ties
+FIELDS = {
+    "trainer": ("firstName", "lastName"),
+    "pokemon": ("nickname", "species"),
+}
+MODELS = {"trainer": Trainer, "pokemon": Pokemon}
+WORD_PATTERN = re.compile(r"\w+")
+
+# score is the trigram similarity of value to the query, plus one when a word
+# of value starts with the query
+Result = namedtuple("Result", ["score", "type", "id", "field", "value"])
+
+
+def normalize(text):
+    return " ".join(WORD_PATTERN.findall(text.lower()))
+
+
+def trigrams(text, prefix=False):
+    """Helper function to split text into trigrams the way pg_trgm does
+
+    Each word is padded with two spaces in front and one behind. With
+    prefix, only the trigrams of a word start are kept, leaving out the end.
+    """
+    grams = set()
+    for word in WORD_PATTERN.findall(text.lower()):
+        padded = f"  {word}" if prefix else f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+
+    return grams
+
+
+def rank(result):
+    """Helper function to sort results, best first and on ties by FIELDS order"""
+    return (
+        -result.score,
+        result.type,
+        result.id,
+        FIELDS[result.type].index(result.field),
+    )
+
+
+def is_prefix(query, value):
+    """Helper function to tell if a word of value starts with the query"""
+    return value.startswith(query) or f" {query}" in value
+
+
+class MemorySearch(object):
+    """This class represents the in-process trigram index of searched names.
+
+    Postings map every trigram to the (type, id, field) entries holding it,
+    so a query only looks at entries sharing trigrams with it. The index is
+    built from the database on the first search and then kept up to date from
+    cache invalidations, see Cache.subscribe(): rows written are marked dirty
+    and read again before the next search, and a full invalidation rebuilds
+    everything. It is meant for deployments without pg_trgm, with a few
+    hundred thousand names at most.
+    """
+
+    def __init__(self, min_similarity=0.3, batch_size=10000):
+        self.min_similarity = min_similarity
+        self.batch_size = batch_size
+        self.entries = {}
+        self.postings = defaultdict(set)
+        # pokemon ids by owner, dropped with the owner
+        self.owned = defaultdict(set)
+        self.owners = {}
+        self.dirty = set()
+        self.stale = True
+        self.lock = threading.RLock()
+
+    def evict(self, keys):
+        """Mark the rows behind invalidated cache keys to be read again"""
+        with self.lock:
+            if self.stale:
+                return
+
+            for key in keys:
+                # <prefix>:<type>:<id>
+                _, type, id = key.split(":", 2)
+                if type in MODELS:
+                    self.dirty.add((type, id))
+
+    def clear(self):
+        """Rebuild the whole index before the next search"""
+        with self.lock:
+            self.stale = True
+            self.dirty.clear()
+
+    def refresh(self):
+        """Bring the index up to date with the rows written since last time
+
+        Rows are read from the primary, a lagging replica could still have
+        the old values of rows marked dirty.
+        """
+        with self.lock, use_primary(db.session()):
+            if self.stale:
+                # rows written while reading are marked dirty and read again
+                self.stale = False
+                self.dirty.clear()
+                self.entries.clear()
+                self.postings.clear()
+                self.owned.clear()
+                self.owners.clear()
+                for type, model in MODELS.items():
+                    self.load(type, model.query)
+            elif self.dirty:
+                dirty, self.dirty = self.dirty, set()
+                for type, model in MODELS.items():
+                    ids = [id for t, id in dirty if t == type]
+                    if ids:
+                        self.reload(type, model, ids)
+
+    def load(self, type, query):
+        """Index the rows of query, returns the ids found"""
+        columns = FIELDS[type] + (("owner",) if type == "pokemon" else ())
+        query = query.options(load_only(*columns))
+
+        found = set()
+        for obj in query.yield_per(self.batch_size):
+            found.add(obj.id)
+            self.remove(type, obj.id)
+            for field in FIELDS[type]:
+                self.add(type, obj.id, field, getattr(obj, field))
+            if type == "pokemon":
+                self.owners[obj.id] = obj.owner
+                self.owned[obj.owner].add(obj.id)
+
+        return found
+
+    def reload(self, type, model, ids):
+        found = self.load(type, model.query.filter(model.id == any_(any_ids(ids))))
+        for id in set(ids) - found:
+            self.remove(type, id)
+            if type == "trainer":
+                # deleted along with the trainer by the database
+                for pokemon in list(self.owned.pop(id, ())):
+                    self.remove("pokemon", pokemon)
+
+    def add(self, type, id, field, value):
+        if not value:
+            return
+
+        key = (type, id, field)
+        grams = trigrams(value)
+        self.entries[key] = (normalize(value), value, len(grams))
+        for gram in grams:
+            self.postings[gram].add(key)
+
+    def remove(self, type, id):
+        for field in FIELDS[type]:
+            entry = self.entries.pop((type, id, field), None)
+            if entry is None:
+                continue
+
+            for gram in trigrams(entry[1]):
+                postings = self.postings.get(gram)
+                if postings is not None:
+                    postings.discard((type, id, field))
+                    if not postings:
+                        del self.postings[gram]
+
+        if type == "pokemon":
+            owner = self.owners.pop(id, None)
+            if owner is not None:
+                self.owned[owner].discard(id)
+
+    def search(self, query, types, limit, offset=0):
+        """Return the results ranked offset to offset + limit, see Result"""
+        self.refresh()
+        query = normalize(query)
+        grams = trigrams(query)
+        if not grams:
+            return []
+
+        with self.lock:
+            common = Counter()
+            for gram in grams:
+                common.update(self.postings.get(gram, ()))
+
+            # entries with a word starting with the query share all of the
+            # trigrams of its start
+            start = trigrams(query, prefix=True)
+            prefixed = set.intersection(
+                *(self.postings.get(gram, set()) for gram in start)
+            )
+
+            best = {}
+            for key in set(common) | prefixed:
+                type, id, field = key
+                if type not in types:
+                    continue
+
+                text, value, size = self.entries[key]
+                similarity = common[key] / (len(grams) + size - common[key])
+                prefix = key in prefixed and is_prefix(query, text)
+                if not prefix and similarity < self.min_similarity:
+                    continue
+
+                result = Result(similarity + prefix, type, id, field, value)
+                current = best.get((type, id))
+                if current is None or rank(result) < rank(current):
+                    best[(type, id)] = result
+
+        return heapq.nsmallest(offset + limit, best.values(), key=rank)[offset:]
+
+
+class TrigramSearch(object):
+    """This class represents search backed by pg_trgm and its GIN indexes.
+
+    Each type is searched with one SELECT whose conditions, similarity with
+    the % operator and word prefixes with LIKE, are all served by the
+    gin_trgm_ops indexes of the migration. Results are ranked like
+    MemorySearch.
+    """
+
+    def __init__(self, min_similarity=0.3):
+        self.min_similarity = min_similarity
+
+    def select(self, type, query):
+        model = MODELS[type]
+        fields = FIELDS[type]
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+        scores, conditions = [], []
+        for index, field in enumerate(fields):
+            column = func.lower(getattr(model, field))
+            prefix = column.like(f"{pattern}%") | column.like(f"% {pattern}%")
+            score = func.similarity(column, query) + case((prefix, 1.0), else_=0.0)
+            scores.append(score.label(f"score{index}"))
+            conditions += [column.op("%")(query), prefix]
+
+        # the scores of each field are computed once per matching row, OFFSET 0
+        # keeps the planner from inlining them back into every use below
+        matches = (
+            select(model.id, *(getattr(model, field) for field in fields), *scores)
+            .where(or_(*conditions))
+            .offset(0)
+            .subquery()
+        )
+        scores = [matches.c[f"score{index}"] for index in range(len(fields))]
+        score = func.greatest(*scores)
+        # the first field holding the best score
+        best = [(s == score, field) for s, field in zip(scores, fields)]
+        field = case(*((b, literal(f)) for b, f in best), else_=literal(fields[-1]))
+        value = case(*((b, matches.c[f]) for b, f in best), else_=matches.c[fields[-1]])
+
+        return select(
+            score.label("score"),
+            literal(type, String).label("type"),
+            matches.c.id.label("id"),
+            field.label("field"),
+            value.label("value"),
+        )
+
+    def search(self, query, types, limit, offset=0):
+        query = normalize(query)
+        if not query:
+            return []
+
+        db.session.execute(
+            select(
+                func.set_config(
+                    "pg_trgm.similarity_threshold", str(self.min_similarity), True
+                )
+            )
+        )
+        ranked = union_all(*(self.select(type, query) for type in types)).subquery()
+        rows = db.session.execute(
+            select(ranked)
+            .order_by(ranked.c.score.desc(), ranked.c.type, ranked.c.id)
+            .limit(limit)
+            .offset(offset)
+        )
+
+        return [Result(*row) for row in rows]
+
+
+def has_trigrams():
+    """Helper function to tell if pg_trgm is installed in the database"""
+    stmt = text("SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'")
+
+    return db.session.execute(stmt).scalar() > 0
@@ -0,0 +1,111 @@
+import functools
+import json
+from operator import attrgetter
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+@functools.lru_cache(maxsize=65536)
+def format_date(value):
+    """Helper function to format a date as dd-mm-yyyy, once per distinct date"""
+    return f"{value.day:02d}-{value.month:02d}-{value.year:04d}"
+
+
+def dumps(value):
+    """Helper function to encode value as JSON bytes, with orjson if installed"""
+    if orjson is not None:
+        return orjson.dumps(value)
+
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def loads(document):
+    if orjson is not None:
+        return orjson.loads(document)
+
+    return json.loads(document)
+
+
+def json_response(value):
+    """Helper function to build a JSON response, faster than jsonify()"""
+    return current_app.response_class(dumps(value), mimetype="application/json")
+
+
+class Serializer(object):
+    """This class represents the conversion of model objects to JSON values.
+
+    fields are names of attributes, or (name, convert) pairs where convert is
+    applied to the attribute, None values being left alone. All attributes are
+    read by a single attrgetter, so serializing an object costs one call plus
+    the conversions.
+    """
+
+    def __init__(self, *fields):
+        fields = [
+            field if isinstance(field, tuple) else (field, None) for field in fields
+        ]
+        self.fields = fields
+        self.subsets = {}
+        self.names = tuple(name for name, _ in fields)
+        self.converters = tuple(
+            (index, convert)
+            for index, (_, convert) in enumerate(fields)
+            if convert is not None
+        )
+        self.getter = attrgetter(*self.names)
+
+    def __call__(self, obj):
+        values = self.getter(obj)
+        if len(self.names) == 1:
+            values = (values,)
+
+        if self.converters:
+            values = list(values)
+            for index, convert in self.converters:
+                if values[index] is not None:
+                    values[index] = convert(values[index])
+
+        return dict(zip(self.names, values))
+
+    def many(self, objs):
+        return [self(obj) for obj in objs]
+
+    def only(self, names):
+        """Return the serializer of the fields among names, built once per subset"""
+        key = frozenset(names)
+        if key not in self.subsets:
+            self.subsets[key] = Serializer(
+                *(field for field in self.fields if field[0] in key)
+            )
+
+        return self.subsets[key]
+
+
+POKEMON = Serializer(
+    "id",
+    "nickname",
+    "species",
+    "level",
+    "owner",
+    ("dateOfOwnership", format_date),
+)
+TRAINER = Serializer("id", "firstName", "lastName", ("dateOfBirth", format_date))
+# a trainer listed with its pokemons, see Trainer.pokemons
+TRAINER_WITH_POKEMONS = Serializer(
+    "id",
+    "firstName",
+    "lastName",
+    ("dateOfBirth", format_date),
+    ("pokemons", POKEMON.many),
+)
+# GET /trainer/?trainerId=
+TRAINER_DETAIL = Serializer("firstName", "lastName", ("pokemons", POKEMON.many))
+# pokemon counts and levels of GET /stats/, see PokemonRollup
+ROLLUP = Serializer(
+    "pokemons", ("averageLevel", lambda value: round(value, 2)), "maxLevel"
+)
@@ -0,0 +1,74 @@
+import json
+import uuid
+
+
+# json.dumps builds a new encoder per call when given options, reuse one
+encoder = json.JSONEncoder(separators=(",", ":"))
+
+
+def encode(values):
+    """Helper function to serialize the values of a staged row"""
+    return encoder.encode(values)
+
+
+class Staging(object):
+    """This class represents the redis staging area of a single upload.
+
+    Rows are kept in one redis hash per upload, keyed by row id, so concurrent
+    uploads never see each other's rows and later rows with the same id replace
+    earlier ones. Writes are pipelined in batches and the hash expires after
+    ttl seconds in case the upload dies before cleaning up after itself.
+    """
+
+    def __init__(self, r, ttl=3600, batch_size=1000):
+        self.r = r
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.key = f"upload:{uuid.uuid4().hex}"
+        self.pipe = r.pipeline(transaction=False)
+        self.pending = 0
+
+    def add(self, ids, payloads):
+        """Stage rows given their ids and encoded values, see encode()
+
+        Rows are sent as one HSET per batch_size rows, and buffered writes are
+        flushed once enough of them are pending.
+        """
+        for start in range(0, len(ids), self.batch_size):
+            end = start + self.batch_size
+            self.pipe.hset(
+                self.key, mapping=dict(zip(ids[start:end], payloads[start:end]))
+            )
+            self.pending += len(ids[start:end])
+
+        if self.pending >= self.batch_size * 10:
+            self.flush()
+
+    def flush(self):
+        """Send buffered writes to redis"""
+        if self.pending:
+            self.pipe.expire(self.key, self.ttl)
+            self.pipe.execute()
+            self.pending = 0
+
+    def __len__(self):
+        self.flush()
+        return self.r.hlen(self.key)
+
+    def __iter__(self):
+        """Yield (id, values) for every staged row"""
+        self.flush()
+        for id, values in self.r.hscan_iter(self.key, count=self.batch_size):
+            yield id, json.loads(values)
+
+    def clear(self):
+        """Drop the staging area"""
+        self.pipe.reset()
+        self.pending = 0
+        self.r.delete(self.key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.clear()
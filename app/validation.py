@@ -0,0 +1,155 @@
+import hashlib
+import re
+from collections import namedtuple
+from datetime import date
+from functools import lru_cache
+
+from app.staging import encode
+
+Schema = namedtuple("Schema", ["columns", "dates", "integers"])
+# rows of a validated batch ready to be staged, start is the row number of
+# the first row and owners holds the owner column of pokemon rows
+Batch = namedtuple("Batch", ["start", "size", "ids", "payloads", "owners", "errors"])
+
+SCHEMAS = {
+    "trainer": Schema(
+        columns=("id", "firstName", "lastName", "dateOfBirth"),
+        dates=("dateOfBirth",),
+        integers=(),
+    ),
+    "pokemon": Schema(
+        columns=("id", "nickname", "species", "level", "owner", "dateOfOwnership"),
+        dates=("dateOfOwnership",),
+        integers=("level",),
+    ),
+}
+
+DATE_PATTERN = re.compile(r"(\d{1,2})-(\d{1,2})-(\d{4})")
+INTEGER_PATTERN = re.compile(r"[+-]?[0-9]+")
+
+MISSING_VALUE = "Missing value"
+INVALID_DATE = "Input date format incorrect, should be DD-MM-YYYY"
+INVALID_INTEGER = "Input data format not correct, should be an integer"
+UNKNOWN_OWNER = "Owner not found"
+
+
+@lru_cache(maxsize=65536)
+def parse_date(text):
+    """Helper function to parse a DD-MM-YYYY date, returns None if invalid
+
+    Uploads tend to repeat the same dates many times, so results are memoized.
+    """
+    match = DATE_PATTERN.fullmatch(text)
+    if match is None:
+        return None
+
+    day, month, year = match.groups()
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def parse_integer(text):
+    """Helper function to parse an integer, returns None if invalid"""
+    return int(text) if INTEGER_PATTERN.fullmatch(text) else None
+
+
+def fingerprint(schema, values):
+    """Helper function to hash the values of a valid row, without its id
+
+    Dates and integers are hashed in canonical form so a row gets the same
+    fingerprint whatever format it is uploaded in, see
+    columnar.fingerprint_sql() which must stay in step with this.
+    """
+    canonical = []
+    for name, value in zip(schema.columns[1:], values):
+        if name in schema.dates:
+            value = parse_date(value).isoformat()
+        elif name in schema.integers:
+            value = str(int(value))
+        canonical.append(value)
+
+    return hashlib.md5("\x1f".join(canonical).encode("utf-8")).hexdigest()
+
+
+def validate_batch(rows, schema, start=1):
+    """Validate a batch of CSV rows against schema
+
+    Columns are checked one at a time across the whole batch, and each
+    distinct date or integer value is only parsed once per batch. Returns a
+    list of {"row", "column", "error"} dicts sorted by row, where row is the
+    1-based position of the row in the file excluding the header. An empty
+    list means the whole batch is valid.
+    """
+    errors = []
+    width = len(schema.columns)
+
+    numbers, complete = [], []
+    for number, row in enumerate(rows, start):
+        if len(row) != width:
+            errors.append(
+                {
+                    "row": number,
+                    "column": None,
+                    "error": f"Expected {width} columns, found {len(row)}",
+                }
+            )
+        else:
+            numbers.append(number)
+            complete.append(row)
+
+    if not complete:
+        return errors
+
+    for index, name in enumerate(schema.columns):
+        column = [row[index] for row in complete]
+
+        if name in schema.dates:
+            invalid = {value for value in set(column) if parse_date(value) is None}
+            message = INVALID_DATE
+        elif name in schema.integers:
+            invalid = {
+                value for value in set(column) if not INTEGER_PATTERN.fullmatch(value)
+            }
+            message = INVALID_INTEGER
+        else:
+            invalid = {""} if "" in column else set()
+            message = None
+
+        if not invalid:
+            continue
+
+        for number, value in zip(numbers, column):
+            if value == "":
+                errors.append({"row": number, "column": name, "error": MISSING_VALUE})
+            elif value in invalid:
+                errors.append({"row": number, "column": name, "error": message})
+
+    errors.sort(key=lambda error: error["row"])
+
+    return errors
+
+
+def validate_rows(rows, schema, start=1):
+    """Validate a batch of CSV rows and prepare them for staging
+
+    Returns a Batch, rows of a batch with errors are not encoded.
+    """
+    errors = validate_batch(rows, schema, start)
+    if errors:
+        return Batch(start, len(rows), [], [], [], errors)
+
+    owners = []
+    if "owner" in schema.columns:
+        index = schema.columns.index("owner")
+        owners = [row[index] for row in rows]
+
+    return Batch(
+        start,
+        len(rows),
+        [row[0] for row in rows],
+        [encode(row[1:]) for row in rows],
+        owners,
+        [],
+    )
@@ -0,0 +1,156 @@
+"""
+Benchmark for filtered pokemon lists
+
+Loads generated trainers and pokemons into the testing database with COPY,
+then reports p50/p99 latency of GET /pokemon/ with each filter, for the
+first page by page number (with its COUNT) and by cursor, and for a page
+deep into the results through a cursor, with the indexes of the pokemon
+table and again without them.
+
+Requires the testing database and a running redis-server (see README).
+
+$ python benchmarks/filter.py --rows 1000000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.models import Pokemon  # noqa: E402
+from app.pagination import encode_cursor  # noqa: E402
+from benchmarks.upload import write_pokemon_csv, write_trainer_csv  # noqa: E402
+
+# see write_pokemon_csv() for the distribution of the generated values
+SCENARIOS = (
+    ("species", {"species": "species42"}),
+    ("level range", {"levelMin": 40, "levelMax": 45}),
+    ("owner", {"owner": "trainer7"}),
+    ("owned between", {"ownedFrom": "01-03-1997", "ownedTo": "03-03-1997"}),
+    ("species+level", {"species": "species42", "levelMin": 90}),
+)
+
+
+def copy(path, table, columns):
+    """Helper function to load a generated CSV file with COPY"""
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute("SET datestyle TO 'ISO, DMY'")
+    with open(path) as f:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, HEADER)",
+            f,
+        )
+    db.session.commit()
+
+
+def deep_cursor(filters):
+    """Helper function to get the cursor of a page 90% into the results"""
+    criteria = Pokemon.filters(**filters)
+    total = Pokemon.count(criteria)
+    rows = Pokemon.get_page(1, offset=max(total * 9 // 10 - 1, 0), filters=criteria)
+
+    return encode_cursor(rows[0].id) if rows else ""
+
+
+def measure(client, query, repeat):
+    """Helper function to time GET /pokemon/ repeat times, returns (p50, p99) in ms"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = client.get("/pokemon/", query_string=query)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert res.status_code == 200, res.get_data(as_text=True)
+
+    timings.sort()
+    return (
+        statistics.median(timings),
+        timings[min(len(timings) - 1, len(timings) * 99 // 100)],
+    )
+
+
+def run(app, repeat, limit):
+    results = {}
+    with app.app_context():
+        cursors = {name: deep_cursor(filters) for name, filters in SCENARIOS}
+
+    client = app.test_client()
+    for name, filters in SCENARIOS:
+        # page numbers come with a COUNT of the matching rows
+        results[(name, "page=1")] = measure(
+            client, {**filters, "page": 1, "limit": limit}, repeat
+        )
+        results[(name, "first page")] = measure(
+            client, {**filters, "cursor": "", "limit": limit}, repeat
+        )
+        results[(name, "deep page")] = measure(
+            client, {**filters, "cursor": cursors[name], "limit": limit}, repeat
+        )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--trainers", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app(config_name="testing")
+    with app.app_context():
+        db.create_all()
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp, app.app_context():
+            trainers = os.path.join(tmp, "trainer.csv")
+            pokemons = os.path.join(tmp, "pokemon.csv")
+            write_trainer_csv(trainers, args.trainers)
+            write_pokemon_csv(pokemons, args.rows, args.trainers)
+
+            start = time.perf_counter()
+            copy(
+                trainers,
+                "trainer",
+                ("id", '"firstName"', '"lastName"', '"dateOfBirth"'),
+            )
+            copy(
+                pokemons,
+                "pokemon",
+                ("id", "nickname", "species", "level", "owner", '"dateOfOwnership"'),
+            )
+            db.session.execute("ANALYZE trainer; ANALYZE pokemon")
+            db.session.commit()
+            print(f"loaded {args.rows} pokemons in {time.perf_counter() - start:.1f}s")
+
+        indexed = run(app, args.repeat, args.limit)
+
+        with app.app_context():
+            for index in Pokemon.__table__.indexes:
+                index.drop(db.session.connection())
+            db.session.commit()
+
+        scanned = run(app, args.repeat, args.limit)
+
+        print(
+            f"{'filter':<16}{'page':<12}{'indexed p50/p99 ms':>22}{'no index p50/p99 ms':>24}"
+        )
+        for key, (p50, p99) in indexed.items():
+            name, page = key
+            s50, s99 = scanned[key]
+            print(
+                f"{name:<16}{page:<12}{p50:>12.1f}/{p99:<9.1f}{s50:>14.1f}/{s99:<9.1f}"
+            )
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        app.extensions["cache"].close()
+
+
+if __name__ == "__main__":
+    main()
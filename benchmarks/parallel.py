@@ -0,0 +1,62 @@
+"""
+Benchmark for parallel upload parsing
+
+Generates a large pokemon CSV file and reports parse + validation rows/sec
+for the sequential path and for the process pool at each worker count.
+Does not need a database or redis.
+
+$ python benchmarks/parallel.py --rows 2000000 --workers 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ingest import iter_rows, iter_validated  # noqa: E402
+from app.parallel import iter_validated_parallel  # noqa: E402
+from benchmarks.upload import write_pokemon_csv  # noqa: E402
+
+
+def consume(batches):
+    """Helper function to drain validated batches, returns (rows, errors)"""
+    rows = errors = 0
+    for batch in batches:
+        rows += len(batch.ids)
+        errors += len(batch.errors)
+
+    return rows, errors
+
+
+def report(name, rows, elapsed):
+    print(f"{name:<12} {rows:>10} rows {elapsed:>8.2f}s {rows / elapsed:>10.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--chunk-size", type=int, default=8 * 1024 * 1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "pokemon.csv")
+        write_pokemon_csv(path, args.rows, 1000)
+
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            rows, _ = consume(iter_validated("pokemon", iter_rows(f), 1000))
+        report("sequential", rows, time.perf_counter() - start)
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            rows, _ = consume(
+                iter_validated_parallel("pokemon", path, workers, args.chunk_size)
+            )
+            report(f"workers={workers}", rows, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark for response serialization
+
+Builds pokemons in memory and reports pokemons/sec for the field by field
+dicts with strftime and json.dumps the handlers used to build, and for the
+serializers of app.serializers with the JSON backend in use.
+Does not need a database or redis.
+
+$ python benchmarks/serialize.py --rows 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import serializers  # noqa: E402
+from app.models import Pokemon  # noqa: E402
+
+
+def make_pokemons(rows):
+    """Helper function to build pokemons owned over the last few years"""
+    start = date(2015, 1, 1)
+    return [
+        Pokemon(
+            id=f"pokemon{i}",
+            nickname=f"nick{i}",
+            species=f"species{i % 151}",
+            level=i % 100 + 1,
+            owner=f"trainer{i % 1000}",
+            dateOfOwnership=start + timedelta(days=i % 2000),
+            history=[f"trainer{i % 1000}"],
+        )
+        for i in range(rows)
+    ]
+
+
+def by_hand(pokemons):
+    results = []
+    for pokemon in pokemons:
+        obj = {
+            "id": pokemon.id,
+            "nickname": pokemon.nickname,
+            "species": pokemon.species,
+            "level": pokemon.level,
+            "owner": pokemon.owner,
+            "dateOfOwnership": pokemon.dateOfOwnership.strftime("%d-%m-%Y"),
+        }
+        results.append(obj)
+
+    return json.dumps({"pokemons": results}).encode("utf-8")
+
+
+def with_serializer(pokemons):
+    return serializers.dumps({"pokemons": serializers.POKEMON.many(pokemons)})
+
+
+def report(name, rows, elapsed):
+    print(f"{name:<12} {rows:>10} rows {elapsed:>8.3f}s {rows / elapsed:>10.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pokemons = make_pokemons(args.rows)
+    backend = "orjson" if serializers.orjson is not None else "json"
+    assert json.loads(by_hand(pokemons)) == json.loads(with_serializer(pokemons))
+
+    for name, serialize in (("by hand", by_hand), (backend, with_serializer)):
+        elapsed = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            serialize(pokemons)
+            elapsed.append(time.perf_counter() - start)
+        report(name, args.rows, min(elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark for the /upload/ endpoint
+
+Generates large trainer and pokemon CSV files, uploads them through the test
+client and reports peak RSS and rows/sec for each upload. Every upload runs in
+its own process so that peak RSS is measured per file.
+
+Requires the testing database and a running redis-server (see README).
+
+$ python benchmarks/upload.py --rows 2000000
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+
+
+def write_trainer_csv(path, rows):
+    """Helper function to generate a trainer CSV file"""
+    with open(path, "w") as f:
+        f.write("id,firstName,lastName,dateOfBirth\n")
+        for i in range(rows):
+            f.write(f"trainer{i},first{i},last{i},{i % 28 + 1:02d}-05-1987\n")
+
+
+def write_pokemon_csv(path, rows, trainers):
+    """Helper function to generate a pokemon CSV file"""
+    with open(path, "w") as f:
+        f.write("id,nickname,species,level,owner,dateOfOwnership\n")
+        for i in range(rows):
+            f.write(
+                f"pokemon{i},nick{i},species{i % 151},{i % 100 + 1},"
+                f"trainer{i % trainers},{i % 28 + 1:02d}-03-1997\n"
+            )
+
+
+def upload(path, data_type, queue):
+    """Upload a single file and report (status, seconds, peak RSS in MB)"""
+    app = create_app(config_name="testing")
+    client = app.test_client()
+
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        res = client.post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={"data": f, "type": data_type},
+        )
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((res.status_code, elapsed, peak))
+
+
+def run(path, data_type, rows):
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=upload, args=(path, data_type, queue))
+    proc.start()
+    status, elapsed, peak = queue.get()
+    proc.join()
+
+    size = os.path.getsize(path) / 1024 / 1024
+    print(
+        f"{data_type:<8} {size:>9.1f} MB {rows:>10} rows "
+        f"status={status} {elapsed:>8.2f}s {rows / elapsed:>10.0f} rows/s "
+        f"peak_rss={peak:.1f} MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--trainers", type=int, default=None)
+    args = parser.parse_args()
+    trainers = args.trainers or args.rows
+
+    app = create_app(config_name="testing")
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        trainer_csv = os.path.join(tmp, "trainer.csv")
+        pokemon_csv = os.path.join(tmp, "pokemon.csv")
+        write_trainer_csv(trainer_csv, trainers)
+        write_pokemon_csv(pokemon_csv, args.rows, trainers)
+
+        run(trainer_csv, "trainer", trainers)
+        run(pokemon_csv, "pokemon", args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 class Config(object):
@@ -8,6 +9,85 @@ class Config(object):
     CSRF_ENABLED = True
     SECRET = os.getenv("SECRET")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
+    # comma separated read replicas of DATABASE_URL, GET requests read from
+    # one of them in turn. A replica is checked every REPLICA_CHECK_INTERVAL
+    # seconds and skipped while it is down or more than REPLICA_MAX_LAG
+    # seconds behind, keep that under the 5 second tombstones of the cache.
+    # Clients read from the primary for REPLICA_STICKY_SECONDS after a write
+    SQLALCHEMY_REPLICA_URIS = [
+        url for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url
+    ]
+    REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 5))
+    REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 2))
+    REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
+    # read-through cache of trainer and pokemon lookups, entries expire after
+    # CACHE_TTL seconds. Give the cache its own redis with a maxmemory and an
+    # LRU maxmemory-policy to bound its size
+    CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/2")
+    CACHE_TTL = int(os.getenv("CACHE_TTL", 300))
+    # per worker memory budget in bytes of the in-process tier in front of the
+    # redis cache, 0 disables it. Its entries expire after CACHE_LOCAL_TTL
+    # seconds, or as soon as another worker invalidates them
+    CACHE_LOCAL_MAX_BYTES = int(os.getenv("CACHE_LOCAL_MAX_BYTES", 64 * 1024 * 1024))
+    CACHE_LOCAL_TTL = int(os.getenv("CACHE_LOCAL_TTL", 30))
+    # largest page size accepted by the list endpoints
+    PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", 1000))
+    # most ids accepted by a single batch lookup
+    BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", 100))
+    # rows fetched from the server-side cursor per chunk of an export
+    EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 10000))
+    # Content-Encodings of compressed responses, in order of preference, an
+    # empty list disables compression. Bodies under COMPRESSION_MIN_SIZE bytes
+    # are sent as they are, others at COMPRESSION_GZIP_LEVEL (1-9) or
+    # COMPRESSION_BROTLI_LEVEL (0-11)
+    COMPRESSION_ENCODINGS = [
+        e for e in os.getenv("COMPRESSION_ENCODINGS", "br,gzip").split(",") if e
+    ]
+    COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+    COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+    COMPRESSION_BROTLI_LEVEL = int(os.getenv("COMPRESSION_BROTLI_LEVEL", 4))
+    # per worker memory budget in bytes for compressed bodies of responses
+    # with an ETag, reused until the data changes, 0 disables it
+    COMPRESSION_CACHE_MAX_BYTES = int(
+        os.getenv("COMPRESSION_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+    )
+    # "trigram" searches with pg_trgm, "memory" with an index kept by each
+    # worker, "auto" picks pg_trgm when the extension is installed
+    SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+    # least trigram similarity of a result that does not start like the query
+    SEARCH_MIN_SIMILARITY = float(os.getenv("SEARCH_MIN_SIMILARITY", 0.3))
+    # number of rows sent per INSERT ... ON CONFLICT statement during uploads
+    UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", 1000))
+    # seconds before an abandoned upload staging area expires from redis
+    UPLOAD_STAGING_TTL = int(os.getenv("UPLOAD_STAGING_TTL", 3600))
+    # maximum number of invalid rows reported back for a rejected upload
+    UPLOAD_MAX_ERRORS = int(os.getenv("UPLOAD_MAX_ERRORS", 100))
+    # processes used to parse and validate an upload, opt in per upload with
+    # the workers field. Files are split into chunks of UPLOAD_CHUNK_SIZE bytes
+    UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 1))
+    UPLOAD_MAX_WORKERS = int(os.getenv("UPLOAD_MAX_WORKERS", os.cpu_count() or 1))
+    UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+    # run uploads as background jobs by default, opt in per upload with the
+    # async field. Jobs run on UPLOAD_JOB_WORKERS threads per app process and
+    # their status is kept for UPLOAD_JOB_TTL seconds
+    UPLOAD_ASYNC = os.getenv("UPLOAD_ASYNC", "false").lower() in ("1", "true", "yes")
+    UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", 2))
+    UPLOAD_JOB_TTL = int(os.getenv("UPLOAD_JOB_TTL", 86400))
+    # rows per record batch read from Parquet and Arrow uploads
+    UPLOAD_COLUMNAR_BATCH_SIZE = int(os.getenv("UPLOAD_COLUMNAR_BATCH_SIZE", 65536))
+    # pokemon owners are checked against an in memory set of trainer ids, or a
+    # Bloom filter when there are more trainers than this
+    UPLOAD_OWNER_BLOOM_THRESHOLD = int(
+        os.getenv("UPLOAD_OWNER_BLOOM_THRESHOLD", 5_000_000)
+    )
+    # where chunks of resumable uploads are kept until they are loaded, an
+    # upload no chunk was sent to for UPLOAD_CHUNK_TTL seconds is removed.
+    # Uploads are made of at most UPLOAD_MAX_CHUNKS chunks
+    UPLOAD_CHUNK_DIR = os.getenv(
+        "UPLOAD_CHUNK_DIR", os.path.join(tempfile.gettempdir(), "pokemon-uploads")
+    )
+    UPLOAD_CHUNK_TTL = int(os.getenv("UPLOAD_CHUNK_TTL", 86400))
+    UPLOAD_MAX_CHUNKS = int(os.getenv("UPLOAD_MAX_CHUNKS", 10000))
 
 
 class DevelopmentConfig(Config):
@@ -21,6 +101,7 @@ class TestingConfig(Config):
 
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "postgresql:///test_db"
+    CACHE_REDIS_URL = "redis://localhost:6379/15"
     DEBUG = True
 
 
@@ -0,0 +1,43 @@
+"""upload fingerprints
+
+Columns holding the hash of the values each trainer and pokemon was last
+uploaded with, so unchanged rows of an upload are not written again, and the
+table remembering the last file loaded for each type and the version of the
+table it left, so uploading it again is skipped while nothing else changed.
+
+Revision ID: 2e7f0c9a5b14
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "2e7f0c9a5b14"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("trainer", sa.Column("fingerprint", sa.String(length=32)))
+    op.add_column("pokemon", sa.Column("fingerprint", sa.String(length=32)))
+    op.create_table(
+        "upload",
+        sa.Column("type", sa.String(length=255), nullable=False),
+        sa.Column("hash", sa.String(length=64), nullable=False),
+        sa.Column("rows", sa.Integer(), nullable=True),
+        sa.Column("version", sa.BigInteger(), nullable=True),
+        sa.Column(
+            "created", sa.DateTime(), server_default=sa.text("now()"), nullable=True
+        ),
+        sa.PrimaryKeyConstraint("type"),
+    )
+
+
+def downgrade():
+    op.drop_table("upload")
+    op.drop_column("pokemon", "fingerprint")
+    op.drop_column("trainer", "fingerprint")
@@ -0,0 +1,44 @@
+"""pokemon filter indexes
+
+Indexes backing the filters of GET /pokemon/ and trainer lookups by owner.
+They are built CONCURRENTLY so a large pokemon table stays writable, which
+needs to run outside of the migration transaction.
+
+Revision ID: 5b2d9e7c41a3
+Revises: 6a1c3e8f2d57
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b2d9e7c41a3"
+down_revision = "6a1c3e8f2d57"
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ("ix_pokemon_owner_id", ("owner", "id")),
+    ("ix_pokemon_species_id", ("species", "id")),
+    ("ix_pokemon_level_id", ("level", "id")),
+    ("ix_pokemon_dateOfOwnership_id", ("dateOfOwnership", "id")),
+)
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES:
+            op.create_index(
+                name,
+                "pokemon",
+                list(columns),
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _ in INDEXES:
+            op.drop_index(name, table_name="pokemon", postgresql_concurrently=True)
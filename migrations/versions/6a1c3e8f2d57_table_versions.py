@@ -0,0 +1,64 @@
+"""table versions
+
+Change counters of the trainer and pokemon tables behind the ETag and
+Last-Modified headers of conditional GETs, bumped by statement level triggers
+on every write to the tables.
+
+Revision ID: 6a1c3e8f2d57
+Revises: 2e7f0c9a5b14
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "6a1c3e8f2d57"
+down_revision = "2e7f0c9a5b14"
+branch_labels = None
+depends_on = None
+
+TABLES = ("trainer", "pokemon")
+
+
+def upgrade():
+    op.create_table(
+        "table_version",
+        sa.Column("name", sa.String(length=255), nullable=False),
+        sa.Column("version", sa.BigInteger(), server_default="0", nullable=False),
+        sa.Column(
+            "modified",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE table_version SET version = version + 1, modified = now()
+            WHERE name = TG_TABLE_NAME;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    for name in TABLES:
+        op.execute(f"INSERT INTO table_version (name) VALUES ('{name}')")
+        op.execute(
+            f"""
+            CREATE TRIGGER {name}_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {name}
+            FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()
+            """
+        )
+
+
+def downgrade():
+    for name in TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}_version ON {name}")
+    op.execute("DROP FUNCTION IF EXISTS bump_table_version()")
+    op.drop_table("table_version")
@@ -0,0 +1,54 @@
+"""search trigram indexes
+
+GIN trigram indexes backing GET /search/ on the lowercased names of
+trainers and pokemons. pg_trgm ships with the PostgreSQL contrib package;
+when it is not available the revision does nothing and search falls back to
+the in-memory index of app/search.py.
+
+Revision ID: 8c4f1a6d2e90
+Revises: 5b2d9e7c41a3
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8c4f1a6d2e90"
+down_revision = "5b2d9e7c41a3"
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ("ix_trainer_firstName_trgm", "trainer", "firstName"),
+    ("ix_trainer_lastName_trgm", "trainer", "lastName"),
+    ("ix_pokemon_nickname_trgm", "pokemon", "nickname"),
+    ("ix_pokemon_species_trgm", "pokemon", "species"),
+)
+
+
+def upgrade():
+    available = op.get_bind().execute(
+        sa.text("SELECT count(*) FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    )
+    if not available.scalar():
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        for name, table, column in INDEXES:
+            op.create_index(
+                name,
+                table,
+                [sa.text(f'lower("{column}") gin_trgm_ops')],
+                postgresql_using="gin",
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        # the indexes are missing where pg_trgm was not available
+        for name, _, _ in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
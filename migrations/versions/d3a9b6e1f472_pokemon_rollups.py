@@ -0,0 +1,263 @@
+"""pokemon rollups
+
+Tables behind GET /stats/ and the triggers keeping them up to date, filled
+from the current rows. Writes to trainer and pokemon are blocked from the
+backfill to the end of the migration, so none is counted twice or missed.
+The trigger functions are a copy of those of app/models.py at this
+revision, later changes to the models need a revision of their own.
+
+Revision ID: d3a9b6e1f472
+Revises: 8c4f1a6d2e90
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d3a9b6e1f472"
+down_revision = "8c4f1a6d2e90"
+branch_labels = None
+depends_on = None
+
+# the rows a statement wrote to the pokemon table, with n = 1 for rows added
+# and -1 for rows removed, from the transition tables of the triggers
+ROLLUP_DELTAS = {
+    "insert": "SELECT owner, species, level, 1 AS n FROM new_rows",
+    "update": """
+        SELECT owner, species, level, 1 AS n FROM new_rows
+        UNION ALL SELECT owner, species, level, -1 FROM old_rows
+    """,
+    "delete": "SELECT owner, species, level, -1 AS n FROM old_rows",
+}
+# the delta grouped by owner, by species and overall, see PokemonRollup
+ROLLUP_GROUPS = """
+    SELECT
+        CASE WHEN grouping(owner) = 0 THEN 'owner'
+             WHEN grouping(species) = 0 THEN 'species' ELSE 'all' END AS dimension,
+        CASE WHEN grouping(owner) = 0 THEN owner
+             WHEN grouping(species) = 0 THEN species ELSE '' END AS key,
+        sum(n) AS pokemons,
+        coalesce(sum(n) FILTER (WHERE level IS NOT NULL), 0) AS levels,
+        coalesce(sum(n * level), 0) AS "levelSum",
+        max(level) FILTER (WHERE n > 0) AS added,
+        max(level) FILTER (WHERE n < 0) AS removed
+    FROM delta GROUP BY GROUPING SETS ((owner), (species), ())
+"""
+
+
+def rollup_function(op):
+    """Helper function to build the trigger function of pokemon writes of op"""
+    rows = "new_rows" if op == "insert" else "old_rows"
+    statements = [
+        f"""
+        PERFORM 1 FROM {rows} LIMIT 1;
+        IF NOT FOUND THEN
+            RETURN NULL;
+        END IF;
+
+        -- trainers whose team changes size, read before their count changes
+        WITH delta AS ({{delta}}),
+        changed AS (
+            SELECT owner, sum(n) AS n FROM delta
+            WHERE owner IN (SELECT id FROM trainer) GROUP BY owner
+            HAVING sum(n) <> 0
+        ),
+        sizes AS (
+            SELECT coalesce(r.pokemons, 0) AS size, c.n FROM changed c
+            LEFT JOIN pokemon_rollup r ON r.dimension = 'owner' AND r.key = c.owner
+        ),
+        moves AS (
+            SELECT size, -1 AS trainers FROM sizes
+            UNION ALL SELECT size + n, 1 FROM sizes
+        )
+        INSERT INTO team_size (size, trainers)
+        SELECT size, sum(trainers) FROM moves
+        GROUP BY size HAVING sum(trainers) <> 0
+        ON CONFLICT (size) DO UPDATE
+        SET trainers = team_size.trainers + excluded.trainers;
+        DELETE FROM team_size WHERE trainers = 0;
+
+        WITH delta AS ({{delta}})
+        INSERT INTO pokemon_rollup
+            (dimension, key, pokemons, levels, "levelSum", "maxLevel")
+        SELECT dimension, key, pokemons, levels, "levelSum", added
+        FROM ({ROLLUP_GROUPS}) grouped
+        WHERE key IS NOT NULL AND pokemons IS NOT NULL
+        AND (dimension <> 'owner' OR key IN (SELECT id FROM trainer))
+        ON CONFLICT (dimension, key) DO UPDATE SET
+            pokemons = pokemon_rollup.pokemons + excluded.pokemons,
+            levels = pokemon_rollup.levels + excluded.levels,
+            "levelSum" = pokemon_rollup."levelSum" + excluded."levelSum",
+            "maxLevel" = greatest(pokemon_rollup."maxLevel", excluded."maxLevel");
+        """
+    ]
+    if op != "insert":
+        # only a removed highest level not matched by an added one is looked
+        # up again, through the index of the dimension
+        statements.append(
+            f"""
+            WITH delta AS ({{delta}})
+            UPDATE pokemon_rollup r SET "maxLevel" = CASE r.dimension
+                WHEN 'owner' THEN (SELECT max(level) FROM pokemon WHERE owner = r.key)
+                WHEN 'species' THEN (SELECT max(level) FROM pokemon WHERE species = r.key)
+                ELSE (SELECT max(level) FROM pokemon) END
+            FROM ({ROLLUP_GROUPS}) grouped
+            WHERE r.dimension = grouped.dimension AND r.key = grouped.key
+            AND grouped.removed >= r."maxLevel"
+            AND (grouped.added IS NULL OR grouped.added < grouped.removed);
+
+            DELETE FROM pokemon_rollup WHERE dimension = 'species'
+            AND pokemons = 0 AND key IN (SELECT species FROM old_rows);
+            """
+        )
+
+    body = "".join(statements).format(delta=ROLLUP_DELTAS[op])
+
+    return f"""
+        CREATE OR REPLACE FUNCTION pokemon_rollup_{op}() RETURNS trigger AS $$
+        BEGIN
+            {body}
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+
+
+ROLLUP_DDL = (
+    "".join(rollup_function(op) for op in ROLLUP_DELTAS)
+    + """
+    CREATE OR REPLACE FUNCTION pokemon_rollup_truncate() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM pokemon_rollup;
+        DELETE FROM team_size;
+        INSERT INTO team_size (size, trainers)
+        SELECT 0, count(*) FROM trainer HAVING count(*) > 0;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION trainer_rollup_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO team_size (size, trainers)
+        SELECT 0, count(*) FROM new_rows HAVING count(*) > 0
+        ON CONFLICT (size) DO UPDATE
+        SET trainers = team_size.trainers + excluded.trainers;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- the cascade of the foreign key deletes the pokemons of the trainers
+    -- after this runs, their owners are left alone then
+    CREATE OR REPLACE FUNCTION trainer_rollup_delete() RETURNS trigger AS $$
+    BEGIN
+        WITH sizes AS (
+            SELECT coalesce(r.pokemons, 0) AS size, count(*) AS trainers
+            FROM old_rows t
+            LEFT JOIN pokemon_rollup r ON r.dimension = 'owner' AND r.key = t.id
+            GROUP BY 1
+        )
+        UPDATE team_size SET trainers = team_size.trainers - sizes.trainers
+        FROM sizes WHERE team_size.size = sizes.size;
+        DELETE FROM team_size WHERE trainers = 0;
+        DELETE FROM pokemon_rollup
+        WHERE dimension = 'owner' AND key IN (SELECT id FROM old_rows);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION trainer_rollup_truncate() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM pokemon_rollup;
+        DELETE FROM team_size;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+    + "".join(
+        f"""
+        DROP TRIGGER IF EXISTS {table}_rollup_{op} ON {table};
+        CREATE TRIGGER {table}_rollup_{op} AFTER {op.upper()} ON {table}
+        {transition}
+        FOR EACH STATEMENT EXECUTE PROCEDURE {table}_rollup_{op}();
+        """
+        for table, op, transition in (
+            ("pokemon", "insert", "REFERENCING NEW TABLE AS new_rows"),
+            (
+                "pokemon",
+                "update",
+                "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+            ),
+            ("pokemon", "delete", "REFERENCING OLD TABLE AS old_rows"),
+            ("pokemon", "truncate", ""),
+            ("trainer", "insert", "REFERENCING NEW TABLE AS new_rows"),
+            ("trainer", "delete", "REFERENCING OLD TABLE AS old_rows"),
+            ("trainer", "truncate", ""),
+        )
+    )
+)
+
+TRIGGERS = (
+    ("pokemon", "insert"),
+    ("pokemon", "update"),
+    ("pokemon", "delete"),
+    ("pokemon", "truncate"),
+    ("trainer", "insert"),
+    ("trainer", "delete"),
+    ("trainer", "truncate"),
+)
+
+
+def upgrade():
+    op.create_table(
+        "pokemon_rollup",
+        sa.Column("dimension", sa.String(length=16), nullable=False),
+        sa.Column("key", sa.String(length=255), nullable=False),
+        sa.Column("pokemons", sa.BigInteger(), nullable=False),
+        sa.Column("levels", sa.BigInteger(), nullable=False),
+        sa.Column("levelSum", sa.BigInteger(), nullable=False),
+        sa.Column("maxLevel", sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint("dimension", "key"),
+    )
+    op.create_table(
+        "team_size",
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("trainers", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("size"),
+    )
+
+    op.execute("LOCK TABLE trainer, pokemon IN SHARE MODE")
+    op.execute(ROLLUP_DDL)
+    op.execute(
+        """
+        INSERT INTO pokemon_rollup
+            (dimension, key, pokemons, levels, "levelSum", "maxLevel")
+        SELECT * FROM (
+            SELECT
+                CASE WHEN grouping(owner) = 0 THEN 'owner'
+                     WHEN grouping(species) = 0 THEN 'species' ELSE 'all' END,
+                CASE WHEN grouping(owner) = 0 THEN owner
+                     WHEN grouping(species) = 0 THEN species ELSE '' END AS key,
+                count(*), count(level), coalesce(sum(level), 0), max(level)
+            FROM pokemon GROUP BY GROUPING SETS ((owner), (species), ())
+        ) grouped
+        WHERE key IS NOT NULL
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO team_size (size, trainers)
+        SELECT coalesce(r.pokemons, 0), count(*) FROM trainer t
+        LEFT JOIN pokemon_rollup r ON r.dimension = 'owner' AND r.key = t.id
+        GROUP BY 1
+        """
+    )
+
+
+def downgrade():
+    for table, op_name in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_rollup_{op_name} ON {table}")
+        op.execute(f"DROP FUNCTION IF EXISTS {table}_rollup_{op_name}()")
+    op.drop_table("team_size")
+    op.drop_table("pokemon_rollup")
@@ -4,10 +4,25 @@ import os
 import json
 import io
 import csv
-from datetime import datetime
+import gzip
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import redis
+import zstandard
+import brotli
+from unittest.mock import patch
+from sqlalchemy import event, text
 
 from app import create_app, db
 from app.models import Trainer, Pokemon
+from app.compression import Compression
+from app.replicas import ReplicaPool
+from app.search import MemorySearch, TrigramSearch, has_trigrams
 
 
 class TrainerTestCase(unittest.TestCase):
@@ -38,6 +53,344 @@ class TrainerTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 201)
         self.assertTrue(data["success"])
 
+    def test_upload_trainer_data_crlf_utf8(self):
+        """Test API can upload a CRLF terminated UTF8 Trainer CSV (POST request)"""
+        content = (
+            "id,firstName,lastName,dateOfBirth\r\n"
+            "trainer30,Zoë,Ægir,01-02-2003\r\n"
+            'trainer31,"Ash, Jr",ケッチャム,04-05-2006\r\n'
+        )
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.encode("utf-8")), "trainer.csv"),
+                "type": "trainer",
+            },
+        )
+
+        self.assertEqual(res.status_code, 201)
+
+        with self.app.app_context():
+            self.assertEqual(Trainer.get_trainer("trainer30").firstName, "Zoë")
+            self.assertEqual(Trainer.get_trainer("trainer31").firstName, "Ash, Jr")
+            self.assertEqual(Trainer.get_trainer("trainer31").lastName, "ケッチャム")
+
+    def test_upload_trainer_data_updates_existing(self):
+        """Test API upload updates Trainers that already exist (POST request)"""
+        with open(self.trainer_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "trainer"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        content = "id,firstName,lastName,dateOfBirth\ntrainer1,gary,oak,01-01-1990\n"
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.encode("utf-8")), "trainer.csv"),
+                "type": "trainer",
+            },
+        )
+
+        self.assertEqual(res.status_code, 201)
+
+        with self.app.app_context():
+            trainer = Trainer.get_trainer("trainer1")
+            self.assertEqual(trainer.firstName, "gary")
+            self.assertEqual(trainer.lastName, "oak")
+            self.assertEqual(trainer.dateOfBirth.strftime("%d-%m-%Y"), "01-01-1990")
+
+    def test_upload_trainer_data_only_writes_changes(self):
+        """Test API upload skips files and rows already loaded (POST request)"""
+        content = (
+            "id,firstName,lastName,dateOfBirth\n"
+            "trainer40,gary,oak,01-01-1990\n"
+            "trainer41,ash,ketchum,01-01-1990\n"
+        )
+
+        def upload(content):
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={
+                    "data": (io.BytesIO(content.encode("utf-8")), "trainer.csv"),
+                    "type": "trainer",
+                },
+            )
+            return res.status_code, json.loads(res.get_data(as_text=True))
+
+        status, data = upload(content)
+        self.assertEqual(status, 201)
+        self.assertEqual((data["rows_committed"], data["rows_unchanged"]), (2, 0))
+
+        status, data = upload(content)
+        self.assertEqual(status, 200)
+        self.assertTrue(data["duplicate"])
+
+        status, data = upload(content.replace("ketchum", "satoshi"))
+        self.assertEqual(status, 201)
+        self.assertEqual((data["rows_committed"], data["rows_unchanged"]), (1, 1))
+
+        # rows written outside uploads are loaded again, without the write
+        # itself touching the record of the last upload
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                res = self.client().put("/trainer/?trainerId=trainer40&firstName=blue")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse([s for s in statements if "upload" in s])
+
+        status, data = upload(content.replace("ketchum", "satoshi"))
+        self.assertEqual(status, 201)
+        self.assertEqual((data["rows_committed"], data["rows_unchanged"]), (1, 1))
+
+        with self.app.app_context():
+            self.assertEqual(Trainer.get_trainer("trainer40").firstName, "gary")
+
+    def test_upload_trainer_data_gzip(self):
+        """Test API can upload a gzip compressed Trainer CSV (POST request)"""
+        with open(self.trainer_csv, "rb") as f:
+            content = gzip.compress(f.read())
+
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={"data": (io.BytesIO(content), "trainer.csv.gz"), "type": "trainer"},
+        )
+
+        self.assertEqual(res.status_code, 201)
+
+        with self.app.app_context():
+            self.assertEqual(Trainer.get_trainer("trainer12").firstName, "indra")
+
+    def test_upload_trainer_data_parquet(self):
+        """Test API can upload a Parquet Trainer file (POST request)"""
+        with open(self.trainer_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "trainer"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        # same rows as the CSV file with native dates, and one changed row
+        with open(self.trainer_csv) as f:
+            rows = list(csv.DictReader(f))
+        rows[0]["firstName"] = "gary"
+        table = pa.table(
+            {
+                "id": [row["id"] for row in rows],
+                "firstName": [row["firstName"] for row in rows],
+                "lastName": [row["lastName"] for row in rows],
+                "dateOfBirth": [
+                    datetime.strptime(row["dateOfBirth"], "%d-%m-%Y").date()
+                    for row in rows
+                ],
+            }
+        )
+        content = io.BytesIO()
+        pq.write_table(table, content)
+
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.getvalue()), "trainer.parquet"),
+                "type": "trainer",
+            },
+        )
+
+        data = json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(
+            (data["rows_committed"], data["rows_unchanged"]), (1, len(rows) - 1)
+        )
+
+        with self.app.app_context():
+            trainer = Trainer.get_trainer(rows[0]["id"])
+            self.assertEqual(trainer.firstName, "gary")
+            self.assertEqual(trainer.dateOfBirth, date(1987, 5, 22))
+
+    def test_upload_trainer_data_only_loads_current_file(self):
+        """Test API upload does not reload rows of earlier uploads (POST request)"""
+        with open(self.trainer_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "trainer"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        res = self.client().delete("/trainer/?trainerId=trainer1")
+        self.assertEqual(res.status_code, 200)
+
+        content = "id,firstName,lastName,dateOfBirth\ntrainer40,gary,oak,01-01-1990\n"
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.encode("utf-8")), "trainer.csv"),
+                "type": "trainer",
+            },
+        )
+
+        self.assertEqual(res.status_code, 201)
+
+        with self.app.app_context():
+            self.assertIsNone(Trainer.get_trainer("trainer1"))
+            self.assertIsNotNone(Trainer.get_trainer("trainer40"))
+
+    def test_upload_invalid_trainer_data(self):
+        """Test API rejects the whole Trainer CSV if a row is invalid (POST request)"""
+        content = (
+            "id,firstName,lastName,dateOfBirth\n"
+            "trainer40,gary,oak,01-01-1990\n"
+            "trainer41,gary,oak,1990-01-01\n"
+        )
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.encode("utf-8")), "trainer.csv"),
+                "type": "trainer",
+            },
+        )
+
+        data = json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data["success"])
+
+        with self.app.app_context():
+            self.assertIsNone(Trainer.get_trainer("trainer40"))
+
+    def test_upload_trainer_data_chunked(self):
+        """Test API can upload Trainer CSV in resumable chunks (POST/PUT request)"""
+        with open(self.trainer_csv, "rb") as f:
+            content = f.read()
+        # chunk boundaries deliberately fall in the middle of lines
+        chunks = [content[i : i + 50] for i in range(0, len(content), 50)]
+
+        res = self.client().post("/upload/chunked/?type=trainer")
+        self.assertEqual(res.status_code, 201)
+        upload = json.loads(res.get_data(as_text=True))["upload"]
+
+        for index in range(1, len(chunks)):
+            res = self.client().put(
+                f"/upload/chunked/{upload}/{index}",
+                data=chunks[index],
+                content_type="application/octet-stream",
+            )
+            self.assertEqual(res.status_code, 201)
+
+        res = self.client().post(
+            f"/upload/chunked/{upload}/finalize?chunks={len(chunks)}"
+        )
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.get_data(as_text=True))["missing"], [0])
+
+        # resume: resending every chunk only stores the missing one
+        for index, chunk in enumerate(chunks):
+            res = self.client().put(
+                f"/upload/chunked/{upload}/{index}",
+                data=chunk,
+                content_type="application/octet-stream",
+            )
+            self.assertEqual(res.status_code, 201 if index == 0 else 200)
+
+        res = self.client().get(f"/upload/chunked/{upload}")
+        self.assertEqual(
+            json.loads(res.get_data(as_text=True))["chunks"], list(range(len(chunks)))
+        )
+
+        res = self.client().post(
+            f"/upload/chunked/{upload}/finalize?chunks={len(chunks)}"
+        )
+        self.assertEqual(res.status_code, 201)
+
+        with self.app.app_context():
+            self.assertEqual(Trainer.get_trainer("trainer12").firstName, "indra")
+
+        res = self.client().get(f"/upload/chunked/{upload}")
+        self.assertEqual(res.status_code, 404)
+
+    def test_upload_trainer_data_chunked_failures(self):
+        """Test chunks of an upload are kept until it loads, and then expire"""
+        content = b"id,firstName,lastName,dateOfBirth\ntrainer50,gary,oak,1990\n"
+
+        def start():
+            res = self.client().post("/upload/chunked/?type=trainer")
+            self.assertEqual(res.status_code, 201)
+            return json.loads(res.get_data(as_text=True))["upload"]
+
+        def put(upload, index, chunk):
+            res = self.client().put(
+                f"/upload/chunked/{upload}/{index}",
+                data=chunk,
+                content_type="application/octet-stream",
+            )
+            self.assertIn(res.status_code, (200, 201))
+
+        upload = start()
+        put(upload, 0, content[:40])
+        put(upload, 1, content[40:])
+        put(upload, 2, b"trainer51,ash,ketchum,01-01-1990\n")
+
+        # more chunks than declared
+        res = self.client().post(f"/upload/chunked/{upload}/finalize?chunks=2")
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.get_data(as_text=True))["extra"], [2])
+
+        # invalid date, the chunks stay for another try
+        res = self.client().post(f"/upload/chunked/{upload}/finalize?chunks=3")
+        self.assertEqual(res.status_code, 400)
+        res = self.client().get(f"/upload/chunked/{upload}")
+        self.assertEqual(json.loads(res.get_data(as_text=True))["chunks"], [0, 1, 2])
+
+        # indexes and totals past UPLOAD_MAX_CHUNKS are refused
+        limit = self.app.config["UPLOAD_MAX_CHUNKS"]
+        res = self.client().put(
+            f"/upload/chunked/{upload}/{limit}",
+            data=b"",
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post(
+            f"/upload/chunked/{upload}/finalize?chunks={limit + 1}"
+        )
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(
+            json.loads(res.get_data(as_text=True))["error"], "Too many chunks"
+        )
+
+        put(upload, 5, b"")
+        res = self.client().post(f"/upload/chunked/{upload}/finalize")
+        self.assertEqual(json.loads(res.get_data(as_text=True))["missing"], [3, 4])
+
+        # uploads nothing was sent to for too long go as new ones start
+        path = os.path.join(self.app.config["UPLOAD_CHUNK_DIR"], upload)
+        stale = time.time() - self.app.config["UPLOAD_CHUNK_TTL"] - 1
+        os.utime(path, (stale, stale))
+        start()
+        res = self.client().get(f"/upload/chunked/{upload}")
+        self.assertEqual(res.status_code, 404)
+
     def test_get_list_trainers_data(self):
         """Test API can list all trainers (GET request)"""
         # preload db with trainer data
@@ -65,6 +418,34 @@ class TrainerTestCase(unittest.TestCase):
         self.assertEqual(len(data["trainers"]), 5)
         self.assertEqual(data["page"], page)
 
+    def test_get_list_trainers_data_cursor(self):
+        """Test API can list all trainers page by page with cursors (GET request)"""
+        with open(self.trainer_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "trainer"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        res = self.client().get("/trainer/?page=1&limit=5")
+        data = json.loads(res.get_data(as_text=True))
+        ids = [trainer["id"] for trainer in data["trainers"]]
+        self.assertEqual(data["total_page"], 4)
+
+        while data["next"] is not None:
+            res = self.client().get(f"/trainer/?cursor={data['next']}&limit=5")
+            self.assertEqual(res.status_code, 200)
+            data = json.loads(res.get_data(as_text=True))
+            ids.extend(trainer["id"] for trainer in data["trainers"])
+
+        with self.app.app_context():
+            self.assertEqual(ids, [trainer.id for trainer in Trainer.get_all()])
+
+        res = self.client().get("/trainer/?cursor=%25%25")
+        self.assertEqual(res.status_code, 400)
+
     def test_get_trainer_data(self):
         """Test API can get Trainer by ID (GET request)"""
         # preload db with trainer data
@@ -87,6 +468,64 @@ class TrainerTestCase(unittest.TestCase):
         self.assertIn("lastName", str(data))
         self.assertIn("dateOfBirth", str(data))
 
+    def test_get_data_from_replica(self):
+        """Test API reads GET requests from healthy replicas (GET request)"""
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                exists = conn.execute(
+                    text("SELECT 1 FROM pg_database WHERE datname = 'test_db_replica'")
+                ).scalar()
+                if not exists:
+                    conn.execute(text("CREATE DATABASE test_db_replica"))
+
+            Trainer(
+                id="trainer1", firstName="Ash", lastName="", dateOfBirth=None
+            ).save()
+
+        # a database of its own stands for the replica, to tell where reads go
+        replicas = ReplicaPool.from_urls(
+            ["postgresql:///test_db_replica", "postgresql://localhost:1/down"],
+            check_interval=60,
+        )
+        self.app.extensions["replicas"] = replicas
+        replica = replicas.engines[0]
+        db.Model.metadata.create_all(bind=replica)
+        try:
+            replicas.start()
+            self.assertTrue(replicas.checked.wait(10))
+
+            with replica.begin() as conn:
+                conn.execute(
+                    Trainer.__table__.insert().values(id="trainer1", firstName="Misty")
+                )
+
+            def first_name(client):
+                res = client.get("/trainer/")
+                self.assertEqual(res.status_code, 200)
+                return json.loads(res.get_data(as_text=True))["trainers"][0][
+                    "firstName"
+                ]
+
+            # requests only read the results of the background checks
+            client = self.client()
+            with patch.object(replicas, "check", side_effect=AssertionError):
+                self.assertEqual(first_name(client), "Misty")
+            self.assertEqual(replicas.healthy, [True, False])
+
+            # writes go to the primary, and so do the next reads of the writer
+            res = client.put("/trainer/?trainerId=trainer1&firstName=Gary")
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(first_name(client), "Gary")
+            self.assertEqual(first_name(self.client()), "Misty")
+
+            # reads fall back to the primary without a healthy replica
+            replicas.healthy[0] = False
+            self.assertEqual(first_name(self.client()), "Gary")
+        finally:
+            db.Model.metadata.drop_all(bind=replica)
+            replicas.dispose()
+
     def test_create_trainer_data(self):
         """Test API can create Trainer data (POST request)"""
         with open(self.trainer_csv, "rb") as f:
@@ -187,6 +626,8 @@ class TrainerTestCase(unittest.TestCase):
             # drop all tables
             db.session.remove()
             db.drop_all()
+        self.app.extensions["cache"].r.flushdb()
+        self.app.extensions["cache"].close()
 
 
 class PokemonTestCase(unittest.TestCase):
@@ -234,6 +675,209 @@ class PokemonTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 201)
         self.assertTrue(data["success"])
 
+    def test_upload_invalid_pokemon_data(self):
+        """Test API reports every invalid Pokemon row (POST request)"""
+        content = (
+            "id,nickname,species,level,owner,dateOfOwnership\n"
+            "pikachu30,pika,pikachu,ten,trainer1,01-03-1997\n"
+            "pikachu31,pika,pikachu,10,trainer1,31-02-1997\n"
+            "pikachu32,,pikachu,10,trainer1,01-03-1997\n"
+            "pikachu33,pika,pikachu,10,trainer1\n"
+            "pikachu34,pika,pikachu,10,trainer1,01-03-1997\n"
+        )
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.encode("utf-8")), "pokemon.csv"),
+                "type": "pokemon",
+            },
+        )
+
+        data = json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data["success"])
+        self.assertEqual(
+            [(e["row"], e["column"]) for e in data["errors"]],
+            [(1, "level"), (2, "dateOfOwnership"), (3, "nickname"), (4, None)],
+        )
+
+        with self.app.app_context():
+            self.assertIsNone(Pokemon.get_pokemon("pikachu34"))
+
+    def test_upload_pokemon_data_unknown_owner(self):
+        """Test API rejects Pokemon owned by unknown trainers (POST request)"""
+        content = (
+            "id,nickname,species,level,owner,dateOfOwnership\n"
+            "pikachu40,pika,pikachu,10,trainer1,01-03-1997\n"
+            "pikachu41,pika,pikachu,10,trainer404,01-03-1997\n"
+        )
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.encode("utf-8")), "pokemon.csv"),
+                "type": "pokemon",
+            },
+        )
+
+        data = json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(
+            [(e["row"], e["column"]) for e in data["errors"]], [(2, "owner")]
+        )
+
+        with self.app.app_context():
+            self.assertIsNone(Pokemon.get_pokemon("pikachu40"))
+
+    def test_upload_pokemon_data_zstd(self):
+        """Test API can upload a zstd compressed Pokemon CSV (POST request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            content = zstandard.ZstdCompressor().compress(f.read())
+
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={"data": (io.BytesIO(content), "pokemon.csv.zst"), "type": "pokemon"},
+        )
+
+        self.assertEqual(res.status_code, 201)
+
+        with self.app.app_context():
+            self.assertEqual(Pokemon.get_pokemon("pikachu1").level, 95)
+
+    def test_upload_invalid_pokemon_data_arrow(self):
+        """Test API reports every invalid row of an Arrow Pokemon file (POST request)"""
+        table = pa.table(
+            {
+                "id": ["pikachu50", "pikachu51", "pikachu52", "pikachu53"],
+                "nickname": ["pika", None, "pika", "pika"],
+                "species": ["pikachu"] * 4,
+                "level": ["10", "10", "ten", "10"],
+                "owner": ["trainer1"] * 4,
+                "dateOfOwnership": [
+                    "01-03-1997",
+                    "01-03-1997",
+                    "01-03-1997",
+                    "31-02-1997",
+                ],
+            }
+        )
+        content = io.BytesIO()
+        with pa.ipc.new_file(content, table.schema) as writer:
+            writer.write_table(table)
+
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.getvalue()), "pokemon.arrow"),
+                "type": "pokemon",
+            },
+        )
+
+        data = json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(
+            [(e["row"], e["column"]) for e in data["errors"]],
+            [(2, "nickname"), (3, "level"), (4, "dateOfOwnership")],
+        )
+
+        # an unknown owner is reported once the rest of the file is valid
+        table = table.slice(0, 1).set_column(4, "owner", pa.array(["trainer404"]))
+        content = io.BytesIO()
+        with pa.ipc.new_stream(content, table.schema) as writer:
+            writer.write_table(table)
+
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.getvalue()), "pokemon.arrows"),
+                "type": "pokemon",
+            },
+        )
+
+        data = json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["errors"][0]["column"], "owner")
+
+        with self.app.app_context():
+            self.assertIsNone(Pokemon.get_pokemon("pikachu50"))
+
+    def test_upload_pokemon_data_parallel(self):
+        """Test API can parse Pokemon CSV with worker processes (POST request)"""
+        # split the file into many small chunks
+        self.app.config["UPLOAD_CHUNK_SIZE"] = 64
+        self.app.config["UPLOAD_MAX_WORKERS"] = 2
+
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon", "workers": 2},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        with open(self.pokemon_csv, "r") as f:
+            ids = [row[0] for row in list(csv.reader(f))[1:]]
+
+        with self.app.app_context():
+            self.assertEqual(len(Pokemon.get_all()), len(set(ids)))
+
+        content = "id,nickname,species,level,owner,dateOfOwnership\n" + "".join(
+            f"pikachu{i},pika,pikachu,{'x' if i == 37 else 10},trainer1,01-03-1997\n"
+            for i in range(30, 40)
+        )
+        res = self.client().post(
+            "/upload/",
+            content_type="multipart/form-data",
+            data={
+                "data": (io.BytesIO(content.encode("utf-8")), "pokemon.csv"),
+                "type": "pokemon",
+                "workers": 2,
+            },
+        )
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.get_json()["errors"][0]["row"], 8)
+
+    def test_upload_pokemon_data_async(self):
+        """Test API can upload Pokemon CSV as a background job (POST request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon", "async": "true"},
+            )
+
+        self.assertEqual(res.status_code, 202)
+        job = json.loads(res.get_data(as_text=True))["job"]
+
+        for _ in range(100):
+            res = self.client().get(f"/upload/status/{job}")
+            data = json.loads(res.get_data(as_text=True))
+            if data["status"] in ("done", "failed"):
+                break
+            time.sleep(0.05)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["status"], "done")
+        self.assertTrue(data["success"])
+        self.assertEqual(data["rows_committed"], data["rows_validated"])
+        self.assertIn("rows_per_second", data)
+
+        with self.app.app_context():
+            self.assertIsNotNone(Pokemon.get_pokemon("pikachu1"))
+
+        res = self.client().get("/upload/status/unknown")
+        self.assertEqual(res.status_code, 404)
+
     def test_get_pokemon(self):
         """Test API can get Pokemon by id (GET request)"""
         with open(self.pokemon_csv, "rb") as f:
@@ -326,10 +970,702 @@ class PokemonTestCase(unittest.TestCase):
                     db.session.query(Pokemon).filter(Pokemon.id == b).first()
                 )
                 self.assertEqual(pokemon_obj_b.owner, data["trainerA"])
+                self.assertEqual(pokemon_obj_b.history[-1], data["trainerA"])
 
         self.assertEqual(res.status_code, 200)
         self.assertTrue(res_data["success"])
 
+    def test_get_cached_data_after_exchange(self):
+        """Test cached Trainers and Pokemons are invalidated by an exchange"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+        # entries written by the upload are tombstoned for a few seconds
+        self.app.extensions["cache"].r.flushdb()
+
+        # a second worker with its own local cache
+        other = create_app(config_name="testing")
+        self.addCleanup(other.extensions["cache"].close)
+        for app in (self.app, other):
+            self.assertTrue(app.extensions["cache"].listening.wait(5))
+
+        def get(app, url):
+            res = app.test_client().get(url)
+            self.assertEqual(res.status_code, 200)
+            return json.loads(res.get_data(as_text=True))
+
+        def lookup(app):
+            return (
+                [p["id"] for p in get(app, "/trainer/?trainerId=trainer1")["pokemons"]],
+                [p["id"] for p in get(app, "/trainer/?trainerId=trainer2")["pokemons"]],
+                get(app, "/pokemon/?pokemonId=pikachu2")["owner"],
+            )
+
+        # misses, then local hits, then redis hits from the other worker
+        for app in (self.app, self.app, other, other):
+            trainer1, trainer2, owner = lookup(app)
+            self.assertIn("pikachu2", trainer1)
+            self.assertNotIn("pikachu2", trainer2)
+            self.assertEqual(owner, "trainer1")
+
+        # the other worker sends its counts along with its next lookup
+        other.extensions["cache"].send_counts()
+        stats = get(self.app, "/cache/stats")
+        self.assertEqual((stats["trainer"]["hits"], stats["trainer"]["misses"]), (2, 2))
+        self.assertEqual(stats["trainer"]["local_hits"], 2)
+        self.assertEqual((stats["pokemon"]["hits"], stats["pokemon"]["misses"]), (1, 1))
+
+        # a redis hit and its counts take a single round trip, leaving out
+        # those of the thread listening to invalidations
+        round_trips = []
+
+        def counting(send):
+            def count(*args, **kwargs):
+                if threading.current_thread() is threading.main_thread():
+                    round_trips.append(send.__name__)
+                return send(*args, **kwargs)
+
+            return count
+
+        other.extensions["cache"].local.clear()
+        with patch.object(
+            redis.Redis, "execute_command", counting(redis.Redis.execute_command)
+        ), patch.object(
+            redis.client.Pipeline, "execute", counting(redis.client.Pipeline.execute)
+        ):
+            owner = get(other, "/pokemon/?pokemonId=pikachu2")["owner"]
+        self.assertEqual(owner, "trainer1")
+        self.assertEqual(len(round_trips), 1)
+
+        res = self.client().post(
+            "/exchange/?trainerA=trainer1&trainerB=trainer2"
+            "&pokemonsA=pikachu2&pokemonsB=pikachu5"
+        )
+        self.assertEqual(res.status_code, 200)
+
+        expected = (False, True, "trainer2")
+        trainer1, trainer2, owner = lookup(self.app)
+        self.assertEqual(
+            ("pikachu2" in trainer1, "pikachu2" in trainer2, owner), expected
+        )
+
+        # the other worker is told over pub/sub
+        deadline = time.monotonic() + 5
+        while True:
+            trainer1, trainer2, owner = lookup(other)
+            found = ("pikachu2" in trainer1, "pikachu2" in trainer2, owner)
+            if found == expected or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        self.assertEqual(found, expected)
+
+    def test_get_trainer_with_pokemons_queries(self):
+        """Test Trainers come with their Pokemons without a query per Trainer"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            # leaving out the table versions read for the ETag
+            if statement.lstrip().startswith("SELECT") and (
+                "table_version" not in statement
+            ):
+                statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                self.app.extensions["cache"].r.flushdb()
+                res = self.client().get("/trainer/?trainerId=trainer1")
+                detail = json.loads(res.get_data(as_text=True))
+                self.assertEqual(len(statements), 1)
+
+                del statements[:]
+                res = self.client().get("/trainer/?limit=10&cursor=&embed=pokemons")
+                page = json.loads(res.get_data(as_text=True))
+                self.assertEqual(len(statements), 2)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+            pokemons = [p["id"] for p in detail["pokemons"]]
+            self.assertIn("pikachu2", pokemons)
+            self.assertEqual(pokemons, sorted(pokemons))
+            self.assertEqual(len(page["trainers"]), 10)
+            for trainer in page["trainers"]:
+                expected = [p.id for p in Pokemon.get_trainer(trainer["id"])]
+                self.assertEqual(
+                    [p["id"] for p in trainer["pokemons"]], sorted(expected)
+                )
+
+    def test_get_batch_data(self):
+        """Test API can get many Trainers and Pokemons at once (GET/POST request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        res = self.client().get(
+            "/trainer/batch/?ids=trainer2,trainer99,trainer1,trainer2"
+        )
+        data = json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [t["id"] for t in data["trainers"]], ["trainer2", "trainer99", "trainer1"]
+        )
+        self.assertEqual(data["trainers"][1]["error"], "No trainer found")
+        self.assertIn("pikachu2", [p["id"] for p in data["trainers"][2]["pokemons"]])
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        ids = ["pikachu2", "missing", "pikachu5"]
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                res = self.client().post("/pokemon/batch/", json={"ids": ids})
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+        data = json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual([p["id"] for p in data["pokemons"]], ids)
+        self.assertEqual(data["pokemons"][0]["owner"], "trainer1")
+        self.assertEqual(data["pokemons"][1]["error"], "No Pokemon found")
+
+        # the same through the cache
+        res = self.client().post("/pokemon/batch/", json={"ids": ids})
+        self.assertEqual(json.loads(res.get_data(as_text=True)), data)
+
+        ids = ",".join(
+            f"pikachu{i}" for i in range(self.app.config["BATCH_MAX_IDS"] + 1)
+        )
+        res = self.client().get(f"/pokemon/batch/?ids={ids}")
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_data_not_modified(self):
+        """Test API answers 304 to requests with a current ETag (GET request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        res = self.client().get("/trainer/?trainerId=trainer1")
+        etag = res.headers["ETag"]
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("Last-Modified", res.headers)
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                res = self.client().get(
+                    "/trainer/?trainerId=trainer1", headers={"If-None-Match": etag}
+                )
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], etag)
+        self.assertEqual(len(statements), 1)
+
+        # other pages and other tables have their own ETags
+        res = self.client().get(
+            "/trainer/?trainerId=trainer2", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(res.status_code, 200)
+        res = self.client().get("/pokemon/")
+        pokemons_etag = res.headers["ETag"]
+
+        # deleting a trainer deletes its pokemons and changes both
+        res = self.client().delete("/trainer/?trainerId=trainer1")
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get(
+            "/trainer/?trainerId=trainer1", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(res.status_code, 404)
+        res = self.client().get("/pokemon/", headers={"If-None-Match": pokemons_etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], pokemons_etag)
+
+    def test_get_compressed_data(self):
+        """Test API compresses large responses the client accepts (GET request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        plain = self.client().get("/pokemon/?limit=20")
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+
+        res = self.client().get(
+            "/pokemon/?limit=20", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(res.get_data()), plain.get_data())
+        self.assertEqual(res.headers["ETag"], plain.headers["ETag"][:-1] + '-gzip"')
+
+        res = self.client().get(
+            "/pokemon/?limit=20", headers={"Accept-Encoding": "gzip;q=0.5, br"}
+        )
+        self.assertEqual(res.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(res.get_data()), plain.get_data())
+
+        # the compressed body is kept until the pokemons change
+        cache = self.app.extensions["compression"].cache
+        with patch.object(Compression, "encode") as encode:
+            res = self.client().get(
+                "/pokemon/?limit=20", headers={"Accept-Encoding": "br"}
+            )
+            encode.assert_not_called()
+        self.assertEqual(brotli.decompress(res.get_data()), plain.get_data())
+        self.assertEqual(len(cache.entries), 2)
+
+        res = self.client().get(
+            "/pokemon/?limit=20",
+            headers={"Accept-Encoding": "br", "If-None-Match": res.headers["ETag"]},
+        )
+        self.assertEqual(res.status_code, 304)
+
+        # small bodies are not worth it
+        res = self.client().get(
+            "/pokemon/?pokemonId=pikachu1", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("Content-Encoding", res.headers)
+
+        # exports are compressed as they are streamed
+        plain = self.client().get("/export/?type=pokemon")
+        res = self.client().get(
+            "/export/?type=pokemon", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(res.get_data()), plain.get_data())
+
+    def test_export_data(self):
+        """Test API can export Trainers and Pokemons as CSV and NDJSON (GET request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        # several chunks
+        self.app.config["EXPORT_BATCH_SIZE"] = 3
+
+        res = self.client().get("/export/?type=trainer")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.is_streamed)
+        self.assertEqual(res.mimetype, "text/csv")
+
+        with open(self.trainer_csv) as f:
+            expected = list(csv.reader(f))
+        exported = list(csv.reader(io.StringIO(res.get_data(as_text=True))))
+        self.assertEqual(exported[0], expected[0])
+        self.assertEqual(sorted(exported[1:]), sorted(expected[1:]))
+
+        res = self.client().get("/export/?type=pokemon&format=ndjson")
+        self.assertEqual(res.status_code, 200)
+        pokemons = [
+            json.loads(line) for line in res.get_data(as_text=True).splitlines()
+        ]
+
+        with self.app.app_context():
+            self.assertEqual(len(pokemons), Pokemon.count())
+            pokemon = Pokemon.get_pokemon(pokemons[0]["id"])
+        self.assertEqual(
+            pokemons[0]["dateOfOwnership"], pokemon.dateOfOwnership.strftime("%d-%m-%Y")
+        )
+        self.assertEqual(pokemons[0]["level"], pokemon.level)
+
+        res = self.client().get("/export/?type=pokemon&format=xml")
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_pokemon_fields(self):
+        """Test API only reads and returns the fields asked for (GET request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            if "FROM pokemon" in statement:
+                statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                res = self.client().get("/pokemon/?cursor=&fields=id,species")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+        data = json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("history", statements[0])
+        self.assertNotIn("nickname", statements[0])
+        for pokemon in data["pokemons"]:
+            self.assertEqual(set(pokemon), {"id", "species"})
+
+        res = self.client().get("/pokemon/?pokemonId=pikachu2&fields=owner")
+        self.assertEqual(json.loads(res.get_data(as_text=True)), {"owner": "trainer1"})
+
+        res = self.client().get("/trainer/?fields=lastName&embed=pokemons")
+        data = json.loads(res.get_data(as_text=True))
+        self.assertEqual(set(data["trainers"][0]), {"lastName", "pokemons"})
+
+        # uncached, then cached
+        for _ in range(2):
+            res = self.client().get("/trainer/?trainerId=trainer1&fields=firstName")
+            self.assertEqual(
+                json.loads(res.get_data(as_text=True)), {"firstName": "ash"}
+            )
+
+        res = self.client().get("/trainer/?trainerId=trainer1&fields=dateOfBirth")
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client().get("/pokemon/?fields=id,history")
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_pokemon_never_reads_history(self):
+        """Test API lookups by id do not read the pokemon history (GET request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            if statement.lstrip().startswith("SELECT"):
+                statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                responses = [
+                    self.client().get("/pokemon/?pokemonId=pikachu1"),
+                    self.client().get("/pokemon/batch/?ids=pikachu2,pikachu3"),
+                    self.client().get("/trainer/?trainerId=trainer1"),
+                    self.client().get("/trainer/batch/?ids=trainer2"),
+                    self.client().get("/trainer/?embed=pokemons"),
+                ]
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+
+        for res in responses:
+            self.assertEqual(res.status_code, 200)
+        self.assertTrue([s for s in statements if "FROM pokemon" in s])
+        self.assertFalse([s for s in statements if "history" in s])
+
+        data = json.loads(responses[0].get_data(as_text=True))
+        self.assertEqual(data["owner"], "trainer1")
+        data = json.loads(responses[2].get_data(as_text=True))
+        self.assertTrue(data["pokemons"])
+
+    def test_get_pokemon_filtered(self):
+        """Test API can filter the list of Pokemons (GET request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        def ids(**filters):
+            # small pages to go through the cursor with the filters
+            ids, cursor = [], ""
+            while cursor is not None:
+                res = self.client().get(
+                    "/pokemon/", query_string={"limit": 2, "cursor": cursor, **filters}
+                )
+                self.assertEqual(res.status_code, 200)
+                data = json.loads(res.get_data(as_text=True))
+                ids += [pokemon["id"] for pokemon in data["pokemons"]]
+                cursor = data["next"]
+
+            return sorted(ids, key=lambda id: int(id[len("pikachu") :]))
+
+        self.assertEqual(
+            ids(species="pika", levelMin=90, ownedFrom="02-03-1998"),
+            [f"pikachu{i}" for i in range(2, 13)],
+        )
+        self.assertEqual(ids(levelMin=91), ["pikachu1"])
+        self.assertEqual(ids(ownedTo="01-03-1997", levelMax=95), ["pikachu1"])
+        self.assertEqual(ids(owner="trainer6"), ["pikachu10", "pikachu11"])
+        self.assertEqual(ids(species="pika", levelMin=91), [])
+
+        res = self.client().get("/pokemon/?owner=trainer1&limit=2")
+        data = json.loads(res.get_data(as_text=True))
+        self.assertEqual(data["total_page"], 2)
+
+        res = self.client().get("/pokemon/?levelMin=high")
+        self.assertEqual(res.status_code, 400)
+
+    def test_search(self):
+        """Test API can search Trainers and Pokemons by name (GET request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        def search(**args):
+            res = self.client().get("/search/", query_string=args)
+            self.assertEqual(res.status_code, 200)
+            return json.loads(res.get_data(as_text=True))
+
+        # exact names rank first, then other word starts
+        data = search(q="pika", type="pokemon", limit=20)
+        self.assertEqual(len(data["results"]), 12)
+        self.assertEqual(
+            (data["results"][0]["field"], data["results"][0]["score"]), ("species", 2)
+        )
+        self.assertEqual(data["results"][-1]["id"], "pikachu1")
+        self.assertIsNone(data["next"])
+
+        data = search(q="kurniawn")
+        self.assertEqual(data["results"][0]["id"], "trainer12")
+        self.assertEqual(data["results"][0]["field"], "lastName")
+
+        data = search(q="pika", limit=5, page=3)
+        self.assertEqual(len(data["results"]), 2)
+
+        # writes show up in the next search
+        res = self.client().put("/pokemon/?pokemonId=pikachu5&nickname=sparky")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([r["id"] for r in search(q="spark")["results"]], ["pikachu5"])
+
+        res = self.client().delete("/trainer/?trainerId=trainer1")
+        self.assertEqual(res.status_code, 200)
+        ids = [r["id"] for r in search(q="pika", limit=20)["results"]]
+        self.assertEqual(sorted(ids), sorted(f"pikachu{i}" for i in range(5, 13)))
+
+        res = self.client().get("/search/?q=%20")
+        self.assertEqual(res.status_code, 400)
+
+    def test_search_trigram(self):
+        """Test pg_trgm search ranks names like the in-memory index"""
+        with self.app.app_context():
+            if not has_trigrams():
+                self.skipTest("pg_trgm is not installed in the test database")
+
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        def ranked(results):
+            # similarities are single precision in the database
+            return [
+                (round(r.score, 4), r.type, r.id, r.field, r.value) for r in results
+            ]
+
+        min_similarity = self.app.config["SEARCH_MIN_SIMILARITY"]
+        memory, trigram = MemorySearch(min_similarity), TrigramSearch(min_similarity)
+        types = ("trainer", "pokemon")
+        with self.app.app_context():
+            for query in ("pika", "kurniawn", "ash", "pika_%"):
+                self.assertEqual(
+                    ranked(trigram.search(query, types, 50)),
+                    ranked(memory.search(query, types, 50)),
+                )
+
+            self.assertEqual(
+                ranked(trigram.search("pika", types, 5, offset=5)),
+                ranked(memory.search("pika", types, 5, offset=5)),
+            )
+
+    def test_get_stats(self):
+        """Test API keeps Pokemon stats up to date with every write (GET request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        def expected():
+            """Stats computed from the whole tables"""
+            with self.app.app_context():
+                pokemons = Pokemon.get_all()
+                trainers = Trainer.get_all()
+
+            def rollup(group):
+                levels = [p.level for p in group if p.level is not None]
+                return {
+                    "pokemons": len(group),
+                    "averageLevel": round(sum(levels) / len(levels), 2)
+                    if levels
+                    else None,
+                    "maxLevel": max(levels, default=None),
+                }
+
+            species = sorted({p.species for p in pokemons})
+            sizes = Counter(sum(p.owner == t.id for p in pokemons) for t in trainers)
+            return {
+                "trainers": len(trainers),
+                **rollup(pokemons),
+                "species": sorted(
+                    (
+                        {
+                            "species": name,
+                            **rollup([p for p in pokemons if p.species == name]),
+                        }
+                        for name in species
+                    ),
+                    key=lambda s: (-s["pokemons"], s["species"]),
+                ),
+                "teamSizes": [
+                    {"size": size, "trainers": sizes[size]} for size in sorted(sizes)
+                ],
+            }
+
+        def stats(**args):
+            res = self.client().get("/stats/", query_string=args)
+            self.assertEqual(res.status_code, 200)
+            return json.loads(res.get_data(as_text=True))
+
+        self.assertEqual(stats(), expected())
+        self.assertEqual(
+            stats(trainerId="trainer1"),
+            {"pokemons": 4, "averageLevel": 91.25, "maxLevel": 95},
+        )
+
+        res = self.client().post(
+            "/exchange/?trainerA=trainer1&trainerB=trainer2"
+            "&pokemonsA=pikachu1,pikachu2&pokemonsB=pikachu5"
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(stats(), expected())
+        self.assertEqual(
+            stats(trainerId="trainer1"),
+            {"pokemons": 3, "averageLevel": 90, "maxLevel": 90},
+        )
+
+        res = self.client().put("/pokemon/?pokemonId=pikachu5&level=99&species=raichu")
+        self.assertEqual(res.status_code, 200)
+        res = self.client().delete("/pokemon/?pokemonId=pikachu3")
+        self.assertEqual(res.status_code, 200)
+        res = self.client().delete("/trainer/?trainerId=trainer2")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(stats(), expected())
+
+        self.assertEqual(
+            stats(trainerId="trainer9"),
+            {"pokemons": 0, "averageLevel": None, "maxLevel": None},
+        )
+        res = self.client().get("/stats/?trainerId=trainer2")
+        self.assertEqual(res.status_code, 404)
+
+    def test_exchange_unknown_pokemon(self):
+        """Test API exchanges nothing if a Pokemon does not exist (POST request)"""
+        with open(self.pokemon_csv, "rb") as f:
+            res = self.client().post(
+                "/upload/",
+                content_type="multipart/form-data",
+                data={"data": f, "type": "pokemon"},
+            )
+
+        self.assertEqual(res.status_code, 201)
+
+        res = self.client().post(
+            "/exchange/?trainerA=trainer1&trainerB=trainer2&pokemonsA=pikachu4,missingno&pokemonsB=pikachu5",
+        )
+
+        self.assertEqual(res.status_code, 400)
+
+        with self.app.app_context():
+            self.assertEqual(Pokemon.get_pokemon("pikachu4").owner, "trainer1")
+            self.assertEqual(Pokemon.get_pokemon("pikachu5").history, ["trainer2"])
+
+    def test_save_pokemon_single_statement(self):
+        """Test Pokemon.save inserts or updates with a single statement"""
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            # the upload record of pokemon is dropped alongside, see Upload
+            if "pokemon" in statement.split("(")[0]:
+                statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                for nickname in ("first", "second"):
+                    Pokemon(
+                        id="pikachu40",
+                        nickname=nickname,
+                        species="pikachu",
+                        level=5,
+                        owner="trainer1",
+                        dateOfOwnership="01-01-2000",
+                        history=["trainer1"],
+                    ).save()
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+            self.assertEqual(len(statements), 2)
+            self.assertEqual(Pokemon.get_pokemon("pikachu40").nickname, "second")
+
     def test_create_pokemon(self):
         """Test API can create pokemon data (POST request)"""
         valid_data = {
@@ -428,6 +1764,8 @@ class PokemonTestCase(unittest.TestCase):
             # drop all tables
             db.session.remove()
             db.drop_all()
+        self.app.extensions["cache"].r.flushdb()
+        self.app.extensions["cache"].close()
 
 
 # Make the tests conveniently executable